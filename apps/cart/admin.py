@@ -1,6 +1,7 @@
 from django.contrib import admin
 from base.base_admin import BaseAdmin, BaseStackedInline
 from .models import Cart, CartItem,CartInfo
+from .store import RedisCartStore, is_redis_storage
 
 
 # Register your models here.
@@ -16,6 +17,25 @@ class CartAdmin(BaseAdmin):
     inlines = [CartItemInline]
     readonly_fields = BaseAdmin.readonly_fields + ["amount"]
 
+    # live carts in redis are flushed first, so admin sees the rows users see
+    def changelist_view(self, request, extra_context=None):
+        if is_redis_storage():
+            RedisCartStore.flush_dirty()
+        return super().changelist_view(request, extra_context)
+
+    def change_view(self, request, object_id, form_url="", extra_context=None):
+        if is_redis_storage():
+            cart = self.get_object(request, object_id)
+            if cart is not None:
+                RedisCartStore.flush(cart.user_id)
+        return super().change_view(request, object_id, form_url, extra_context)
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        # the edited rows are loaded again on the next access of the user
+        if is_redis_storage():
+            RedisCartStore.evict(form.instance.user_id)
+
 
 @admin.register(CartInfo)
 class CartInfoAdmin(BaseAdmin):
@@ -0,0 +1,173 @@
+import logging
+from django.db import transaction
+from django.db.models import Case, F, When, Value
+
+from apps.cart.models import CartInfo, CartItem, OrderLine, OutOfStockError, ReservedStock, StockReservation
+from apps.cart.store import RedisCartStore, flush_cart, is_redis_storage
+from apps.cart.upsert import CartItemUpsert
+from apps.product.models import Product
+from apps.transaction.models import Transaction
+from core.cache.invalidation import invalidate_product_detail
+
+logger = logging.getLogger(__name__)
+
+
+class EmptyCartError(ValueError):
+    pass
+
+
+class CheckoutService:
+    """
+    Turn the cart of a user into an order.
+
+    Stock of every product is decremented by one conditional UPDATE
+    (stock >= quantity), so concurrent buyers can never oversell. Stock
+    held by other carts (StockReservation) can't be bought. The
+    snapshot (CartInfo and its OrderLines), the transaction and clearing
+    the cart happen in the same database transaction, if anything fails
+    nothing is written.
+    """
+
+    @staticmethod
+    def lock_products(quantities):
+        """
+        lock products of the cart in a fixed order (so two checkouts can't deadlock),
+        returns {product_id: product} with the columns that the snapshot needs
+        """
+        return {
+            product.id: product
+            for product in Product.objects
+            .select_for_update()
+            .filter(id__in=quantities)
+            .order_by('id')
+            .only('id', 'name', 'market_id', 'stock', 'discount_price')
+        }
+
+    @staticmethod
+    def held_by_others(cart_id, quantities):
+        """
+        {product_id: quantity} that holds of other carts keep from the stock, 0 where
+        the cart's own hold covers the quantity (it was held first). The counters
+        are locked until commit so no hold can grow meanwhile.
+        """
+        reserved = dict(
+            ReservedStock.objects
+            .select_for_update()
+            .filter(product_id__in=quantities)
+            .order_by('product_id')
+            .values_list('product_id', 'quantity')
+        )
+        own = dict(
+            StockReservation.objects
+            .filter(cart_id=cart_id, product_id__in=quantities)
+            .values_list('product_id', 'quantity')
+        )
+        return {
+            product_id: 0 if own.get(product_id, 0) >= quantity
+            else max(reserved.get(product_id, 0) - own.get(product_id, 0), 0)
+            for product_id, quantity in quantities.items()
+        }
+
+    @staticmethod
+    def decrement_stock(quantities):
+        """one conditional update for all products, returns number of updated rows"""
+        quantity = Case(
+            *[When(id=product_id, then=Value(count)) for product_id, count in quantities.items()],
+        )
+        return (
+            Product.objects
+            .filter(id__in=quantities, stock__gte=quantity)
+            .update(stock=F('stock') - quantity)
+        )
+
+    @staticmethod
+    def snapshot_items(items, products):
+        return [
+            {
+                "product_id": str(item.product_id),
+                "product_name": products[item.product_id].name,
+                "market_id": str(products[item.product_id].market_id),
+                "quantity": item.quantity,
+                "unit_price": products[item.product_id].discount_price,
+                "final_price": item.quantity * products[item.product_id].discount_price,
+            }
+            for item in items
+        ]
+
+    @staticmethod
+    def invalidate_products(product_ids):
+        for product_id in product_ids:
+            invalidate_product_detail(product_id)
+
+    @classmethod
+    def checkout(cls, user, first_name, last_name, mobile_number):
+        """returns (cart_info, transaction)"""
+        # live carts in redis are written to database first
+        flush_cart(user)
+
+        with transaction.atomic():
+            cart_id = CartItemUpsert.lock_cart(user)
+
+            items = list(
+                CartItem.objects
+                .filter(cart_id=cart_id)
+                .only('product_id', 'quantity')
+                .order_by('product_id')
+            )
+            quantities = {item.product_id: item.quantity for item in items}
+            if not quantities:
+                raise EmptyCartError("Cart is empty")
+
+            products = cls.lock_products(quantities)
+            held = cls.held_by_others(cart_id, quantities)
+            out_of_stock = sorted(
+                str(product_id)
+                for product_id, quantity in quantities.items()
+                if product_id not in products or products[product_id].stock - held[product_id] < quantity
+            )
+            if out_of_stock:
+                raise OutOfStockError(out_of_stock)
+
+            if cls.decrement_stock(quantities) != len(quantities):
+                # can't happen while rows are locked, the condition of the update is the guarantee
+                raise OutOfStockError(sorted(str(product_id) for product_id in quantities))
+
+            snapshot = cls.snapshot_items(items, products)
+            amount = sum(item["final_price"] for item in snapshot)
+
+            cart_info = CartInfo.objects.create(user=user, amount=amount, items=snapshot)
+            OrderLine.objects.bulk_create([
+                OrderLine(
+                    cart_info=cart_info,
+                    product_id=item.product_id,
+                    market_id=products[item.product_id].market_id,
+                    quantity=item.quantity,
+                    unit_price=products[item.product_id].discount_price,
+                    created_at=cart_info.created_at,
+                )
+                for item in items
+            ])
+            transaction_ = Transaction.objects.create(
+                user=user,
+                first_name=first_name,
+                last_name=last_name,
+                mobile_number=mobile_number,
+                final_price=amount,
+                description={
+                    "cart_info": str(cart_info.id),
+                    "items": len(snapshot),
+                },
+            )
+
+            StockReservation.objects.release_cart(cart_id)
+            CartItemUpsert.clear(cart_id)
+
+            # stock is changed by a queryset update, product signals are not sent
+            transaction.on_commit(lambda: cls.invalidate_products(quantities))
+            if is_redis_storage():
+                # not evicted, items added since flush_cart are only in the live cart
+                transaction.on_commit(lambda: RedisCartStore.remove_checked_out(user.pk, quantities))
+
+        logger.info(f'user {user.id} checked out cart {cart_id}, cart info id is {cart_info.id}')
+
+        return cart_info, transaction_
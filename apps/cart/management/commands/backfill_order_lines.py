@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+
+from apps.cart.models import CartInfo, OrderLine
+
+
+class Command(BaseCommand):
+    help = "Create OrderLine rows for CartInfo snapshots that don't have them yet."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=500,
+            help="number of CartInfo rows that are read and written together",
+        )
+
+    def handle(self, *args, **options):
+        chunk_size = options["chunk_size"]
+
+        cart_infos = (
+            CartInfo.objects
+            .filter(~Exists(OrderLine.objects.filter(cart_info=OuterRef('pk'))))
+            .only('id', 'items', 'created_at')
+            .order_by()
+            .iterator(chunk_size=chunk_size)
+        )
+
+        orders = lines = 0
+        chunk = []
+        for cart_info in cart_infos:
+            chunk.append(cart_info)
+            if len(chunk) == chunk_size:
+                lines += self.write(chunk)
+                orders += len(chunk)
+                chunk = []
+        if chunk:
+            lines += self.write(chunk)
+            orders += len(chunk)
+
+        self.stdout.write(self.style.SUCCESS(f"{lines} order lines created for {orders} orders"))
+
+    @staticmethod
+    def write(cart_infos):
+        with transaction.atomic():
+            return len(OrderLine.objects.bulk_create(OrderLine.objects.from_items(cart_infos)))
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.10 on 2026-10-18 09:04
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cart', '0004_cartinfo'),
+        ('product', '0004_product_category'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReservedStock',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='reserved', serialize=False, to='product.product', verbose_name='Product')),
+                ('quantity', models.PositiveIntegerField(default=0, verbose_name='quantity')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='StockReservation',
+            fields=[
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('id', models.UUIDField(default=uuid.uuid4, primary_key=True, serialize=False)),
+                ('quantity', models.PositiveIntegerField(verbose_name='quantity')),
+                ('expires_at', models.DateTimeField(verbose_name='Expires at')),
+                ('cart', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='cart.cart', verbose_name='Cart')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='product.product', verbose_name='Product')),
+            ],
+            options={
+                'ordering': ['-created_at'],
+                'abstract': False,
+                'indexes': [models.Index(fields=['-created_at'], name='cart_stockr_created_a8da02_idx'), models.Index(fields=['expires_at'], name='reservation_expires_at_index')],
+                'unique_together': {('cart', 'product')},
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.10 on 2026-10-18 09:10
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cart', '0005_stock_reservation'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='cartinfo',
+            name='user_index',
+        ),
+        migrations.AddIndex(
+            model_name='cartinfo',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='user_created_at_index'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.10 on 2026-10-18 09:11
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cart', '0006_cart_info_user_created_at_index'),
+        ('market', '0006_market_score'),
+        ('product', '0004_product_category'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderLine',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('quantity', models.PositiveIntegerField(verbose_name='quantity')),
+                ('unit_price', models.PositiveIntegerField(verbose_name='Unit price')),
+                ('created_at', models.DateTimeField(verbose_name='Created at')),
+                ('cart_info', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lines', to='cart.cartinfo', verbose_name='Cart info')),
+                ('market', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='order_lines', to='market.market', verbose_name='Market')),
+                ('product', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='order_lines', to='product.product', verbose_name='Product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['product', 'created_at'], name='order_line_product_index'), models.Index(fields=['market', 'created_at'], name='order_line_market_index')],
+            },
+        ),
+    ]
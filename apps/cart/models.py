@@ -1,76 +1,275 @@
+from datetime import timedelta
+from django.conf import settings
 from django.db import models, transaction
+from django.db.models import Case, F, OuterRef, Prefetch, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
+from apps.market.models import Market
+from apps.product.models import Product
 from base.base_models import BaseModel
 
 
+class OutOfStockError(ValueError):
+    def __init__(self, product_ids):
+        self.product_ids = product_ids
+        super().__init__(f"Not enough stock for products {product_ids}")
+
+
+def items_amount():
+    """sum of final prices of a cart's items, usable in Cart querysets"""
+    return Coalesce(
+        Subquery(
+            CartItem.objects
+            .filter(cart=OuterRef('pk'))
+            .values('cart')
+            .annotate(total=Sum('final_price'))
+            .values('total')
+        ),
+        Value(0),
+    )
+
+
+def apply_cart_changes(quantities, changes):
+    """
+    apply a list of (product_id, op, quantity) in order to {product_id: quantity}.
+    decrease never goes below 1 and decrease/remove of a missing product raise ValueError
+    """
+    quantities = dict(quantities)
+
+    for product_id, op, quantity in changes:
+        if op == 'add':
+            quantities[product_id] = quantities.get(product_id, 0) + quantity
+        elif op == 'set':
+            quantities[product_id] = quantity
+        elif product_id not in quantities:
+            raise ValueError("Product not in cart")
+        elif op == 'decrease':
+            quantities[product_id] = max(quantities[product_id] - quantity, 1)
+        elif op == 'remove':
+            del quantities[product_id]
+        else:
+            raise ValueError(f"Unknown operation {op}")
+
+    return quantities
+
+
 class CartManager(models.Manager):
 
     def get_cart(self, user):
         cart, _ = Cart.objects.get_or_create(user=user)
         return cart
 
+    def detail_queryset(self):
+        """carts with their items and the product columns that serializers need"""
+        items = (
+            CartItem.objects
+            .select_related('product')
+            .only('id', 'cart', 'quantity', 'final_price', 'product__name')
+        )
+        return Cart.objects.prefetch_related(Prefetch('items', queryset=items))
+
+    def get_cart_detail(self, user):
+        cart, _ = self.detail_queryset().get_or_create(user=user)
+        return cart
+
     @transaction.atomic
     def set(self, user, product, quantity=1):
+        from apps.cart.upsert import CartItemUpsert
+
         if  quantity is None :
             raise ValueError("Quantity is not None")
         if quantity <= 0:
             raise ValueError("Quantity must be positive")
 
-        cart = self.get_cart(user)
+        cart_id = CartItemUpsert.lock_cart(user)
 
-        item, _ = cart.items.get_or_create(product=product)
-        item.quantity = quantity
-        item.save()
+        item = CartItemUpsert.set(cart_id, product, quantity)
+        StockReservation.objects.hold(cart_id, {product.id: item.quantity})
 
         return item
 
     @transaction.atomic
-    def add(self, user, product):
-        cart = self.get_cart(user)
-        item, is_created = cart.items.get_or_create(product=product)
+    def add(self, user, product, quantity=1):
+        from apps.cart.upsert import CartItemUpsert
+
+        if quantity <= 0:
+            raise ValueError("Quantity must be positive")
 
-        if not is_created:
-            item.quantity += 1
+        cart_id = CartItemUpsert.lock_cart(user)
 
-        item.save()
+        item = CartItemUpsert.add(cart_id, product, quantity)
+        StockReservation.objects.hold(cart_id, {product.id: item.quantity})
 
         return item
 
     @transaction.atomic
     def decrease(self, user, product):
-        cart = self.get_cart(user)
+        from apps.cart.upsert import CartItemUpsert
 
-        if cart.items.filter(product=product).exists():
-            item = cart.items.get(product=product)
-            if item.quantity > 1:
-                item.quantity -= 1
-                item.save()
+        cart_id = CartItemUpsert.lock_cart(user)
 
-        else:
+        item = CartItemUpsert.decrease(cart_id, product)
+        if item is None:
             raise ValueError("Product not in cart")
+        StockReservation.objects.hold(cart_id, {product.id: item.quantity}, grow=())
 
         return item
 
     @transaction.atomic
     def remove(self, user, product):
-        cart = self.get_cart(user)
+        from apps.cart.upsert import CartItemUpsert
 
-        if cart.items.filter(product=product).exists():
-            item = cart.items.get(product=product)
-            item.delete()
-        else:
+        cart_id = CartItemUpsert.lock_cart(user)
+
+        if not CartItemUpsert.remove(cart_id, product):
             raise ValueError("Product not in cart")
+        StockReservation.objects.hold(cart_id, {product.id: 0}, grow=())
 
         return True
 
+    @transaction.atomic
+    def batch(self, user, changes):
+        """
+        apply a list of (product, op, quantity) in order.
+        items are written with bulk queries and the cart amount is recalculated once.
+        """
+        from apps.cart.upsert import CartItemUpsert
+
+        cart_id = CartItemUpsert.lock_cart(user)
+
+        products = {product.id: product for product, _, _ in changes}
+        stored = {
+            item.product_id: item
+            for item in CartItem.objects.filter(cart_id=cart_id, product__in=products)
+        }
+        quantities = apply_cart_changes(
+            {product_id: item.quantity for product_id, item in stored.items()},
+            [(product.id, op, quantity) for product, op, quantity in changes],
+        )
+
+        # lowered items don't fail on stock
+        grow = {
+            product_id
+            for product_id, quantity in quantities.items()
+            if product_id not in stored or quantity > stored[product_id].quantity
+        }
+        self.write_items(cart_id, stored, quantities, products)
+        StockReservation.objects.hold(
+            cart_id,
+            {product_id: quantities.get(product_id, 0) for product_id in products},
+            grow=grow,
+        )
+
+        return self.detail_queryset().get(id=cart_id)
+
+    @transaction.atomic
+    def sync(self, cart_id, quantities):
+        """
+        make items of the cart exactly {product_id: quantity},
+        products that don't exist anymore are dropped
+        """
+        products = Product.objects.in_bulk(quantities)
+        stored = {
+            item.product_id: item
+            for item in CartItem.objects.select_for_update().filter(cart_id=cart_id)
+        }
+        quantities = {
+            product_id: quantity
+            for product_id, quantity in quantities.items()
+            if product_id in products
+        }
+
+        self.write_items(cart_id, stored, quantities, products)
+
+    def write_items(self, cart_id, stored, quantities, products):
+        """
+        turn stored items {product_id: CartItem} into {product_id: quantity} with one
+        bulk query for each of delete, update and create
+        """
+        from apps.cart.signals.cart import coalesce_cart_amount
+
+        now = timezone.now()
+        removed = [item.id for product_id, item in stored.items() if product_id not in quantities]
+        changed = []
+        created = []
+
+        for product_id, quantity in quantities.items():
+            product = products[product_id]
+            final_price = quantity * product.discount_price
+            item = stored.get(product_id)
+
+            if item is None:
+                created.append(
+                    CartItem(
+                        cart_id=cart_id,
+                        product=product,
+                        quantity=quantity,
+                        final_price=final_price,
+                    )
+                )
+            else:
+                item.quantity = quantity
+                item.final_price = final_price
+                item.updated_at = now
+                changed.append(item)
+
+        with coalesce_cart_amount() as cart_ids:
+            cart_ids.add(cart_id)
+            if removed:
+                CartItem.objects.filter(id__in=removed).delete()
+            if changed:
+                CartItem.objects.bulk_update(changed, ['quantity', 'final_price', 'updated_at'])
+            if created:
+                CartItem.objects.bulk_create(created)
+
+    def recalculate_amount(self, cart_ids):
+        return Cart.objects.filter(id__in=cart_ids).update(
+            amount=items_amount(),
+            updated_at=timezone.now(),
+        )
+
+    @transaction.atomic
+    def reprice(self, product_id, discount_price, cart_ids=None):
+        """
+        set final price of the product's items to quantity * discount_price and
+        move the amount of their carts by the difference, with two UPDATEs
+        """
+        items = (
+            CartItem.objects
+            .filter(product_id=product_id)
+            .exclude(final_price=F('quantity') * discount_price)
+        )
+        if cart_ids is not None:
+            items = items.filter(cart_id__in=cart_ids)
+
+        now = timezone.now()
+        delta = Subquery(
+            items
+            .filter(cart=OuterRef('pk'))
+            .values(delta=F('quantity') * discount_price - F('final_price'))[:1]
+        )
+
+        count = Cart.objects.filter(id__in=items.values('cart_id')).update(
+            amount=F('amount') + delta,
+            updated_at=now,
+        )
+        items.update(
+            final_price=F('quantity') * discount_price,
+            updated_at=now,
+        )
+
+        return count
+
     @transaction.atomic
     def clear(self, user):
-        cart = self.get_cart(user)
-        for item in cart.items.all():
-            item.delete()
+        from apps.cart.upsert import CartItemUpsert
 
-        return cart
+        cart_id = CartItemUpsert.lock_cart(user)
+        StockReservation.objects.release_cart(cart_id)
+
+        return CartItemUpsert.clear(cart_id)
 
 
 class Cart(BaseModel):
@@ -126,7 +325,10 @@ class CartItem(BaseModel):
 
     def save(self, *args, **kwargs):
         self.final_price = self.quantity * self.product.discount_price
-        super().save(*args, **kwargs)
+        # cart amount is changed by the difference of final prices (signals/cart.py)
+        # so reading the old row and writing the new one must be in one transaction
+        with transaction.atomic():
+            super().save(*args, **kwargs)
 
 
 class CartInfo(BaseModel):
@@ -170,9 +372,273 @@ class CartInfo(BaseModel):
         indexes = BaseModel.Meta.indexes + [
             models.Index(fields=["status"], name="status_index"),
             models.Index(fields=["amount"], name="amount_index"),
-            models.Index(fields=["user"], name="user_index"),
+            # order history of a user, newest first (CartInfoListView)
+            models.Index(fields=["user", "-created_at", "-id"], name="user_created_at_index"),
         ]
 
     def __str__(self):
         return f"{str(self.user)} : {self.status}"
 
+
+
+def per_product(quantities):
+    """Case expression that gives quantities[product_id] for each product row"""
+    return Case(
+        *[When(product_id=product_id, then=Value(quantity)) for product_id, quantity in quantities.items()],
+        default=Value(0),
+    )
+
+
+class ReservationManager(models.Manager):
+
+    def hold(self, cart_id, quantities, grow=None):
+        """
+        make holds of the cart {product_id: quantity}, 0 releases the hold.
+        holds of the products in grow (all by default) may grow, available stock
+        is checked against the running counter of the product, raises
+        OutOfStockError if a product can't be held.
+        the other holds are only capped at the quantity and never fail on stock,
+        a decrease or remove works even after the hold expired.
+        """
+        held = dict(
+            self.select_for_update()
+            .filter(cart_id=cart_id, product_id__in=quantities)
+            .values_list('product_id', 'quantity')
+        )
+        if grow is not None:
+            quantities = {
+                product_id: quantity if product_id in grow else min(quantity, held.get(product_id, 0))
+                for product_id, quantity in quantities.items()
+            }
+        deltas = {
+            product_id: quantity - held.get(product_id, 0)
+            for product_id, quantity in quantities.items()
+            if quantity != held.get(product_id, 0)
+        }
+        if not deltas:
+            return
+
+        ReservedStock.objects.bulk_create(
+            [ReservedStock(product_id=product_id) for product_id in deltas],
+            ignore_conflicts=True,
+        )
+        delta = per_product(deltas)
+        growing = [product_id for product_id, change in deltas.items() if change > 0]
+        shrinking = [product_id for product_id, change in deltas.items() if change < 0]
+        updated = (
+            ReservedStock.objects
+            .filter(
+                models.Q(product_id__in=shrinking)
+                | models.Q(product_id__in=growing, quantity__lte=F('product__stock') - delta)
+            )
+            .update(quantity=F('quantity') + delta)
+        )
+        if updated != len(deltas):
+            available = dict(
+                ReservedStock.objects
+                .filter(product_id__in=growing)
+                .values_list('product_id', F('product__stock') - F('quantity'))
+            )
+            raise OutOfStockError(sorted(
+                str(product_id)
+                for product_id in growing
+                if available.get(product_id, 0) < deltas[product_id]
+            ))
+
+        expires_at = timezone.now() + timedelta(seconds=settings.CART_RESERVATION_TTL)
+        holds = [
+            StockReservation(cart_id=cart_id, product_id=product_id, quantity=quantity, expires_at=expires_at)
+            for product_id, quantity in quantities.items()
+            if quantity
+        ]
+        if holds:
+            self.bulk_create(
+                holds,
+                update_conflicts=True,
+                unique_fields=['cart', 'product'],
+                update_fields=['quantity', 'expires_at', 'updated_at'],
+            )
+        released = [product_id for product_id, quantity in quantities.items() if not quantity and product_id in held]
+        if released:
+            self.filter(cart_id=cart_id, product_id__in=released).delete()
+
+    def release(self, reservations):
+        """give the held quantity of the reservations back to the counters, returns their number"""
+        quantities = {}
+        ids = []
+        for reservation_id, product_id, quantity in (
+            reservations.select_for_update().values_list('id', 'product_id', 'quantity')
+        ):
+            quantities[product_id] = quantities.get(product_id, 0) + quantity
+            ids.append(reservation_id)
+        if not ids:
+            return 0
+
+        ReservedStock.objects.filter(product_id__in=quantities).update(
+            quantity=F('quantity') - per_product(quantities)
+        )
+        self.filter(id__in=ids).delete()
+
+        return len(ids)
+
+    def release_cart(self, cart_id):
+        return self.release(self.filter(cart_id=cart_id))
+
+    def release_expired(self, limit=1000):
+        """holds of abandoned carts, locked rows are left for the next run"""
+        expired = self.filter(
+            id__in=self.filter(expires_at__lte=timezone.now())
+            .select_for_update(skip_locked=True)
+            .values('id')[:limit]
+        )
+        return self.release(expired)
+
+
+class OrderLineManager(models.Manager):
+
+    def from_items(self, cart_infos):
+        """
+        unsaved lines of the items snapshot of cart infos,
+        products and markets that don't exist anymore are kept as null
+        """
+        rows = [
+            (cart_info, item)
+            for cart_info in cart_infos
+            if isinstance(cart_info.items, list)
+            for item in cart_info.items
+            if isinstance(item, dict) and item.get("product_id") and item.get("quantity")
+        ]
+        product_ids = Product.objects.filter(
+            id__in={item["product_id"] for _, item in rows}
+        ).values_list('id', flat=True)
+        product_ids = {str(product_id) for product_id in product_ids}
+        market_ids = Market.objects.filter(
+            id__in={item["market_id"] for _, item in rows if item.get("market_id")}
+        ).values_list('id', flat=True)
+        market_ids = {str(market_id) for market_id in market_ids}
+
+        return [
+            OrderLine(
+                cart_info=cart_info,
+                product_id=item["product_id"] if item["product_id"] in product_ids else None,
+                market_id=item.get("market_id") if item.get("market_id") in market_ids else None,
+                quantity=item["quantity"],
+                unit_price=item.get("unit_price", 0),
+                created_at=cart_info.created_at,
+            )
+            for cart_info, item in rows
+        ]
+
+
+class StockReservation(BaseModel):
+    """quantity of a product that a cart holds until expires_at"""
+    cart = models.ForeignKey(
+        Cart,
+        on_delete=models.CASCADE,
+        related_name="reservations",
+        verbose_name=_("Cart"),
+    )
+
+    product = models.ForeignKey(
+        "product.Product",
+        on_delete=models.CASCADE,
+        related_name="reservations",
+        verbose_name=_("Product"),
+    )
+
+    quantity = models.PositiveIntegerField(
+        verbose_name=_("quantity")
+    )
+
+    expires_at = models.DateTimeField(
+        verbose_name=_("Expires at")
+    )
+
+    objects = ReservationManager()
+
+    class Meta(BaseModel.Meta):
+        unique_together = (("cart", "product"),)
+        indexes = BaseModel.Meta.indexes + [
+            models.Index(fields=["expires_at"], name="reservation_expires_at_index"),
+        ]
+
+    def __str__(self):
+        return f"{str(self.product)} : {self.quantity}"
+
+
+class ReservedStock(models.Model):
+    """
+    running sum of the holds of a product, so checking a hold costs one row
+    instead of summing StockReservation
+    """
+    product = models.OneToOneField(
+        "product.Product",
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="reserved",
+        verbose_name=_("Product"),
+    )
+
+    quantity = models.PositiveIntegerField(
+        default=0,
+        verbose_name=_("quantity")
+    )
+
+    def __str__(self):
+        return f"{str(self.product)} : {self.quantity}"
+
+
+class OrderLine(models.Model):
+    """
+    one row per product of a CartInfo snapshot, so sales can be queried
+    by product or market without decoding CartInfo.items
+    """
+    id = models.BigAutoField(primary_key=True)
+
+    cart_info = models.ForeignKey(
+        CartInfo,
+        on_delete=models.CASCADE,
+        related_name="lines",
+        verbose_name=_("Cart info"),
+    )
+
+    # lines outlive deleted products and markets
+    product = models.ForeignKey(
+        "product.Product",
+        on_delete=models.SET_NULL,
+        null=True,
+        related_name="order_lines",
+        verbose_name=_("Product"),
+    )
+
+    market = models.ForeignKey(
+        "market.Market",
+        on_delete=models.SET_NULL,
+        null=True,
+        related_name="order_lines",
+        verbose_name=_("Market"),
+    )
+
+    quantity = models.PositiveIntegerField(
+        verbose_name=_("quantity")
+    )
+
+    unit_price = models.PositiveIntegerField(
+        verbose_name=_("Unit price")
+    )
+
+    # time of the order, not of this row (backfilled lines keep it)
+    created_at = models.DateTimeField(
+        verbose_name=_("Created at")
+    )
+
+    objects = OrderLineManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["product", "created_at"], name="order_line_product_index"),
+            models.Index(fields=["market", "created_at"], name="order_line_market_index"),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id} : {self.quantity}"
@@ -1,4 +1,5 @@
 from rest_framework import serializers
+from utils.validate import check_phone
 from apps.cart.models import (
     Cart,
     CartItem,
@@ -53,6 +54,45 @@ class CartSerializer(serializers.ModelSerializer):
         )
 
 
+class CartBatchItemSerializer(serializers.Serializer):
+    OPERATIONS = ('add', 'set', 'decrease', 'remove')
+
+    product_id = serializers.UUIDField()
+    op = serializers.ChoiceField(choices=OPERATIONS)
+    quantity = serializers.IntegerField(required=False, min_value=1)
+
+    def validate(self, attrs):
+        if attrs['op'] == 'set' and not attrs.get('quantity'):
+            raise serializers.ValidationError({'quantity': 'quantity is required'})
+        attrs.setdefault('quantity', 1)
+        return attrs
+
+
+class CheckoutSerializer(serializers.Serializer):
+    """receiver of the order, missing fields are taken from the user"""
+    first_name = serializers.CharField(max_length=100, required=False)
+    last_name = serializers.CharField(max_length=100, required=False)
+    mobile_number = serializers.CharField(max_length=11, required=False)
+
+    def validate_mobile_number(self, mobile_number):
+        success, message = check_phone(mobile_number)
+        if not success:
+            raise serializers.ValidationError(message)
+        return mobile_number
+
+
+class CartInfoListSerializer(serializers.ModelSerializer):
+    """order history rows without the items snapshot"""
+    class Meta:
+        model = CartInfo
+        fields = (
+            'id',
+            'amount',
+            'created_at',
+            'status',
+        )
+
+
 class CartInfoDetailSerializer(serializers.ModelSerializer):
     class Meta:
         model = CartInfo
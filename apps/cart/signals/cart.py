@@ -1,25 +1,107 @@
 import logging
+import threading
+from contextlib import contextmanager
 from django.dispatch import receiver
-from django.db.models.signals import post_save, post_delete
-from django.db.models import Sum
-from apps.cart.models import CartItem
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from apps.cart.models import Cart, CartItem, StockReservation
 
 logger = logging.getLogger(__name__)
 
+_coalesced = threading.local()
 
-def change_cart_amount(instance):
-    amount = instance.cart.items.aggregate(amount=Sum('final_price'))['amount']
-    instance.cart.amount = amount if amount else 0
-    instance.cart.save()
 
-    logger.info(f'cart with {instance.cart.id} is up to date')
+@contextmanager
+def coalesce_cart_amount():
+    """
+    inside this block item signals only remember the changed carts and
+    amount of each one is recalculated once when the outermost block exits.
+    bulk queries that don't send signals can add their cart ids to the yielded set.
+    """
+    if hasattr(_coalesced, 'cart_ids'):
+        yield _coalesced.cart_ids
+        return
+
+    _coalesced.cart_ids = set()
+    try:
+        with transaction.atomic():
+            yield _coalesced.cart_ids
+            if _coalesced.cart_ids:
+                Cart.manage_items.recalculate_amount(_coalesced.cart_ids)
+    finally:
+        del _coalesced.cart_ids
+
+
+def is_coalesced(instance):
+    cart_ids = getattr(_coalesced, 'cart_ids', None)
+    if cart_ids is None:
+        return False
+    cart_ids.add(instance.cart_id)
+    return True
+
+
+def stored_final_price(instance):
+    """
+    final_price of the row as it is stored right now.
+    the row is locked, so concurrent writers of the same item are serialized
+    and every delta is computed against the committed value.
+    """
+    final_price = (
+        CartItem.objects
+        .select_for_update()
+        .filter(pk=instance.pk)
+        .values_list('final_price', flat=True)
+        .first()
+    )
+    return final_price or 0
+
+
+def change_cart_amount(cart_id, delta):
+    if not delta:
+        return
+
+    Cart.objects.filter(id=cart_id).update(
+        amount=F('amount') + delta,
+        updated_at=timezone.now(),
+    )
+
+    logger.info(f'cart with {cart_id} is up to date')
+
+
+@receiver(pre_save, sender=CartItem)
+def remember_final_price_pre_save(sender, instance, **kwargs):
+    if is_coalesced(instance):
+        return
+    instance._stored_final_price = stored_final_price(instance)
 
 
 @receiver(post_save, sender=CartItem)
 def change_cart_amount_post_save(sender, instance, **kwargs):
-    change_cart_amount(instance)
+    if is_coalesced(instance):
+        return
+    change_cart_amount(
+        instance.cart_id,
+        instance.final_price - instance._stored_final_price,
+    )
+
+
+@receiver(pre_delete, sender=CartItem)
+def remember_final_price_pre_delete(sender, instance, **kwargs):
+    if is_coalesced(instance):
+        return
+    instance._stored_final_price = stored_final_price(instance)
 
 
 @receiver(post_delete, sender=CartItem)
 def change_cart_amount_post_delete(sender, instance, **kwargs):
-    change_cart_amount(instance)
+    if is_coalesced(instance):
+        return
+    change_cart_amount(instance.cart_id, -instance._stored_final_price)
+
+
+@receiver(pre_delete, sender=Cart)
+def release_reservations_pre_delete(sender, instance, **kwargs):
+    # holds are deleted with the cart (or its user), their quantity goes back to the counters first
+    StockReservation.objects.release_cart(instance.id)
@@ -0,0 +1,56 @@
+import logging
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save
+from django.dispatch import receiver
+
+from apps.cart.models import Cart, CartItem
+from apps.cart.tasks import reprice_cart_items
+from apps.product.models import Product
+
+logger = logging.getLogger(__name__)
+
+# above this many cart items the repricing runs in celery
+REPRICE_INLINE_LIMIT = 500
+
+PRICE_FIELDS = {'price', 'percentage_off', 'discount_price'}
+
+
+def price_may_change(instance, update_fields):
+    if instance._state.adding:
+        return False
+    return update_fields is None or bool(PRICE_FIELDS & set(update_fields))
+
+
+@receiver(pre_save, sender=Product)
+def remember_discount_price(sender, instance, update_fields=None, **kwargs):
+    instance._stored_discount_price = None
+    if not price_may_change(instance, update_fields):
+        return
+
+    instance._stored_discount_price = (
+        Product.objects
+        .filter(pk=instance.pk)
+        .values_list('discount_price', flat=True)
+        .first()
+    )
+
+
+@receiver(post_save, sender=Product)
+def reprice_cart_items_post_save(sender, instance, created, **kwargs):
+    stored = getattr(instance, '_stored_discount_price', None)
+    # discount_price is a float until it is read back from database
+    discount_price = int(instance.discount_price)
+    if created or stored is None or stored == discount_price:
+        return
+
+    fan_out = CartItem.objects.filter(product=instance)[:REPRICE_INLINE_LIMIT + 1].count()
+    if not fan_out:
+        return
+
+    if fan_out > REPRICE_INLINE_LIMIT:
+        product_id = str(instance.id)
+        transaction.on_commit(lambda: reprice_cart_items.delay(product_id))
+        logger.info(f'repricing of product {product_id} is sent to celery')
+        return
+
+    Cart.manage_items.reprice(instance.id, discount_price)
@@ -0,0 +1,289 @@
+import logging
+import uuid
+from django.conf import settings
+from django.db import transaction
+from django_redis import get_redis_connection
+
+from apps.cart.models import Cart, CartItem, apply_cart_changes
+from apps.product.models import Product
+
+logger = logging.getLogger(__name__)
+
+# field of the live hash that holds id of the cart row, it also shows the hash is loaded
+CART_FIELD = "_cart"
+
+# returns 0 if the hash is already loaded, so a concurrent write is never overwritten
+HYDRATE_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return 0
+end
+redis.call('HSET', KEYS[1], unpack(ARGV, 2))
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+return 1
+"""
+
+# returns the new quantity or false if the product is not in cart
+DECREASE_SCRIPT = """
+local quantity = tonumber(redis.call('HGET', KEYS[1], ARGV[1]))
+if not quantity then
+    return false
+end
+quantity = math.max(quantity - tonumber(ARGV[2]), 1)
+redis.call('HSET', KEYS[1], ARGV[1], quantity)
+return quantity
+"""
+
+# subtracts the checked out quantities, returns 0 if the cart is not live
+CHECKOUT_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+for i = 1, #ARGV, 2 do
+    local quantity = tonumber(redis.call('HGET', KEYS[1], ARGV[i]))
+    if quantity then
+        quantity = quantity - tonumber(ARGV[i + 1])
+        if quantity > 0 then
+            redis.call('HSET', KEYS[1], ARGV[i], quantity)
+        else
+            redis.call('HDEL', KEYS[1], ARGV[i])
+        end
+    end
+end
+return 1
+"""
+
+
+class RedisCartStore:
+    """
+    Live carts in redis hashes {product_id: quantity}.
+
+    Every write marks the cart dirty and flush_dirty_carts (tasks.py) writes
+    dirty carts to Cart/CartItem in the background. Code that needs the
+    database rows (checkout, admin) calls flush first.
+    """
+
+    key_prefix = "cart:live"
+    dirty_key = "cart:dirty"
+    ttl = 60 * 60 * 24 * 7
+
+    @staticmethod
+    def connection():
+        return get_redis_connection("default")
+
+    @classmethod
+    def key(cls, user_id):
+        return f"{cls.key_prefix}:{user_id}"
+
+    @classmethod
+    def hydrate(cls, user):
+        """load the cart from database if it is not live yet, returns id of the cart row"""
+        conn = cls.connection()
+        key = cls.key(user.pk)
+
+        cart_id = conn.hget(key, CART_FIELD)
+        if cart_id:
+            return uuid.UUID(cart_id.decode())
+
+        cart, _ = Cart.objects.get_or_create(user=user)
+        fields = [CART_FIELD, str(cart.id)]
+        for product_id, quantity in cart.items.values_list('product_id', 'quantity'):
+            fields += [str(product_id), quantity]
+
+        conn.eval(HYDRATE_SCRIPT, 1, key, cls.ttl, *fields)
+        return cart.id
+
+    @classmethod
+    def write(cls, user, *commands):
+        """run commands on the live hash, mark it dirty and return results of the commands"""
+        key = cls.key(user.pk)
+        pipe = cls.connection().pipeline()
+        for command, *args in commands:
+            getattr(pipe, command)(key, *args)
+        pipe.sadd(cls.dirty_key, str(user.pk))
+        pipe.expire(key, cls.ttl)
+        return pipe.execute()[:len(commands)]
+
+    @staticmethod
+    def to_item(cart_id, product, quantity):
+        # live items don't have a row yet
+        return CartItem(
+            id=None,
+            cart_id=cart_id,
+            product=product,
+            quantity=quantity,
+            final_price=quantity * product.discount_price,
+        )
+
+    @staticmethod
+    def parse(raw):
+        """{product_id: quantity} of a live hash"""
+        return {
+            uuid.UUID(field.decode()): int(quantity)
+            for field, quantity in raw.items()
+            if field.decode() != CART_FIELD
+        }
+
+    @classmethod
+    def read(cls, user):
+        return cls.parse(cls.connection().hgetall(cls.key(user.pk)))
+
+    @classmethod
+    def to_cart(cls, user, cart_id, quantities):
+        """unsaved cart with items of live products, shaped like CartManager.get_cart_detail"""
+        products = Product.objects.only('id', 'name', 'discount_price').in_bulk(quantities)
+        items = [
+            cls.to_item(cart_id, products[product_id], quantity)
+            for product_id, quantity in quantities.items()
+            if product_id in products
+        ]
+
+        cart = Cart(id=cart_id, user=user, amount=sum(item.final_price for item in items))
+        cart._prefetched_objects_cache = {'items': items}
+        return cart
+
+    @classmethod
+    def get_cart_detail(cls, user):
+        cart_id = cls.hydrate(user)
+        return cls.to_cart(user, cart_id, cls.read(user))
+
+    @classmethod
+    def set(cls, user, product, quantity=1):
+        if quantity is None:
+            raise ValueError("Quantity is not None")
+        if quantity <= 0:
+            raise ValueError("Quantity must be positive")
+
+        cart_id = cls.hydrate(user)
+        cls.write(user, ('hset', str(product.id), quantity))
+
+        return cls.to_item(cart_id, product, quantity)
+
+    @classmethod
+    def add(cls, user, product, quantity=1):
+        if quantity <= 0:
+            raise ValueError("Quantity must be positive")
+
+        cart_id = cls.hydrate(user)
+        quantity, = cls.write(user, ('hincrby', str(product.id), quantity))
+
+        return cls.to_item(cart_id, product, quantity)
+
+    @classmethod
+    def decrease(cls, user, product):
+        cart_id = cls.hydrate(user)
+        key = cls.key(user.pk)
+
+        quantity = cls.connection().eval(DECREASE_SCRIPT, 1, key, str(product.id), 1)
+        if quantity is None:
+            raise ValueError("Product not in cart")
+        cls.write(user)
+
+        return cls.to_item(cart_id, product, quantity)
+
+    @classmethod
+    def remove(cls, user, product):
+        cls.hydrate(user)
+
+        removed, = cls.write(user, ('hdel', str(product.id)))
+        if not removed:
+            raise ValueError("Product not in cart")
+
+        return True
+
+    @classmethod
+    def batch(cls, user, changes):
+        cart_id = cls.hydrate(user)
+        key = cls.key(user.pk)
+        result = {}
+
+        def apply(pipe):
+            result['quantities'] = apply_cart_changes(
+                cls.parse(pipe.hgetall(key)),
+                [(product.id, op, quantity) for product, op, quantity in changes],
+            )
+
+            pipe.multi()
+            pipe.delete(key)
+            pipe.hset(key, mapping={
+                CART_FIELD: str(cart_id),
+                **{str(product_id): quantity for product_id, quantity in result['quantities'].items()},
+            })
+            pipe.sadd(cls.dirty_key, str(user.pk))
+            pipe.expire(key, cls.ttl)
+
+        # retried if the hash changes between reading and writing it
+        cls.connection().transaction(apply, key)
+
+        return cls.to_cart(user, cart_id, result['quantities'])
+
+    @classmethod
+    def clear(cls, user):
+        cart_id = cls.hydrate(user)
+        cls.write(user, ('delete',), ('hset', CART_FIELD, str(cart_id)))
+
+        return cls.to_cart(user, cart_id, {})
+
+    @classmethod
+    def flush(cls, user_id):
+        """write the live cart of a user to Cart/CartItem"""
+        conn = cls.connection()
+        key = cls.key(user_id)
+
+        with transaction.atomic():
+            cart, _ = Cart.objects.select_for_update().get_or_create(user_id=user_id)
+            # a write after this point marks the cart dirty again
+            conn.srem(cls.dirty_key, str(user_id))
+            raw = conn.hgetall(key)
+            if not raw:
+                logger.info(f'live cart of user {user_id} has expired')
+                return False
+
+            Cart.manage_items.sync(cart.id, cls.parse(raw))
+
+        return True
+
+    @classmethod
+    def flush_dirty(cls):
+        count = 0
+        for user_id in cls.connection().smembers(cls.dirty_key):
+            try:
+                count += cls.flush(user_id.decode())
+            except Exception as e:
+                logger.error(f'cart of user {user_id.decode()} has not been flushed : {e}')
+        return count
+
+    @classmethod
+    def remove_checked_out(cls, user_id, quantities):
+        """
+        subtract {product_id: quantity} that was checked out from the live cart,
+        writes that landed after checkout read the cart are kept
+        """
+        conn = cls.connection()
+        args = [value for product_id, quantity in quantities.items() for value in (str(product_id), quantity)]
+        if conn.eval(CHECKOUT_SCRIPT, 1, cls.key(user_id), *args):
+            # the cart row was emptied, what is left must be written to it again
+            conn.sadd(cls.dirty_key, str(user_id))
+
+    @classmethod
+    def evict(cls, user_id):
+        """drop the live cart so the next access loads it from database"""
+        conn = cls.connection()
+        conn.delete(cls.key(user_id))
+        conn.srem(cls.dirty_key, str(user_id))
+
+
+def is_redis_storage():
+    return settings.CART_STORAGE == 'redis'
+
+
+def get_cart_store():
+    """where live carts are kept, both stores share the CartManager interface"""
+    if is_redis_storage():
+        return RedisCartStore
+    return Cart.manage_items
+
+
+def flush_cart(user):
+    """make Cart/CartItem rows of the user up to date"""
+    if is_redis_storage():
+        RedisCartStore.flush(user.pk)
@@ -0,0 +1,102 @@
+import logging
+from celery import shared_task
+from django.db import transaction
+from django.db.models import F
+
+from apps.cart.models import Cart, CartItem, StockReservation, items_amount
+from apps.cart.store import RedisCartStore, is_redis_storage
+from apps.product.models import Product
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task
+def reconcile_cart_amounts():
+    """
+    cart amounts are maintained by deltas, this task fixes any drift
+    (raw sql, admin edits, ...) by comparing them with the real sum of items
+    """
+    real_amount = items_amount()
+
+    drifted = (
+        Cart.objects
+        .annotate(real_amount=real_amount)
+        .exclude(amount=F('real_amount'))
+        .values('pk')
+    )
+
+    count = Cart.objects.filter(pk__in=drifted).update(amount=real_amount)
+
+    if count:
+        logger.warning(f'{count} cart amounts have been reconciled')
+    else:
+        logger.info('There was no drifted cart amount!')
+
+    return count
+
+
+@shared_task
+def reprice_cart_items(product_id, chunk_size=1000):
+    """
+    reprice every cart item of a product that sits in many carts.
+    carts are handled in chunks so each transaction keeps few rows locked
+    """
+    discount_price = (
+        Product.objects
+        .filter(id=product_id)
+        .values_list('discount_price', flat=True)
+        .first()
+    )
+    if discount_price is None:
+        logger.info(f'product with id {product_id} does not exist anymore')
+        return 0
+
+    cart_ids = (
+        CartItem.objects
+        .filter(product_id=product_id)
+        .values_list('cart_id', flat=True)
+        .order_by('cart_id')
+    )
+
+    count = 0
+    chunk = []
+    for cart_id in cart_ids.iterator(chunk_size=chunk_size):
+        chunk.append(cart_id)
+        if len(chunk) == chunk_size:
+            count += Cart.manage_items.reprice(product_id, discount_price, chunk)
+            chunk = []
+    if chunk:
+        count += Cart.manage_items.reprice(product_id, discount_price, chunk)
+
+    logger.info(f'{count} carts have been repriced for product {product_id}')
+
+    return count
+
+
+@shared_task
+def release_expired_reservations(chunk_size=1000):
+    """give stock held by abandoned carts back, in chunks so few rows are locked at once"""
+    count = 0
+    while True:
+        with transaction.atomic():
+            released = StockReservation.objects.release_expired(limit=chunk_size)
+        count += released
+        if released < chunk_size:
+            break
+
+    logger.info(f'{count} expired reservations have been released')
+
+    return count
+
+
+@shared_task
+def flush_dirty_carts():
+    """write carts changed in redis to database (CART_STORAGE = 'redis')"""
+    if not is_redis_storage():
+        return 0
+
+    count = RedisCartStore.flush_dirty()
+
+    logger.info(f'{count} live carts have been flushed')
+
+    return count
@@ -0,0 +1,290 @@
+import threading
+from unittest import skipUnless
+from unittest.mock import patch
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from django.contrib.auth import get_user_model
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from apps.market.models import Market
+from apps.cart.checkout import CheckoutService, EmptyCartError, OutOfStockError
+from apps.cart.models import Cart, CartItem, CartInfo, OrderLine, ReservedStock, StockReservation
+from apps.cart.store import RedisCartStore, flush_cart
+from apps.product.models import Product
+from apps.transaction.models import Transaction
+from apps.user.models import Marketer
+
+User = get_user_model()
+
+
+class CheckoutServiceTest(TestCase):
+    """Tests for turning a cart into CartInfo + Transaction."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(phone="09123456789", password="testpass123")
+        Marketer.objects.create(
+            user=cls.user,
+            age=20,
+            national_code="1234567890",
+            city="city",
+            province="province",
+            address="address",
+        )
+        cls.market = Market.objects.create(marketer=cls.user.marketer, name="Test Market")
+        cls.product = Product.objects.create(
+            market=cls.market,
+            name="Product 1",
+            price=100_000,
+            percentage_off=20,  # discount_price = 80_000
+            stock=5,
+        )
+        cls.product2 = Product.objects.create(
+            market=cls.market,
+            name="Product 2",
+            price=50_000,
+            stock=10,
+        )
+
+    def checkout(self):
+        return CheckoutService.checkout(
+            self.user,
+            first_name="Amir",
+            last_name="Shop",
+            mobile_number="09123456789",
+        )
+
+    def test_checkout(self):
+        Cart.manage_items.set(self.user, self.product, quantity=2)
+        Cart.manage_items.set(self.user, self.product2, quantity=3)
+
+        cart_info, transaction = self.checkout()
+
+        self.assertEqual(cart_info.amount, 2 * 80_000 + 3 * 50_000)
+        self.assertEqual(transaction.final_price, cart_info.amount)
+        self.assertEqual(transaction.description["cart_info"], str(cart_info.id))
+        self.assertEqual(
+            {item["product_id"]: item["quantity"] for item in cart_info.items},
+            {str(self.product.id): 2, str(self.product2.id): 3},
+        )
+
+        self.assertEqual(
+            set(cart_info.lines.values_list('product_id', 'market_id', 'quantity', 'unit_price', 'created_at')),
+            {
+                (self.product.id, self.market.id, 2, 80_000, cart_info.created_at),
+                (self.product2.id, self.market.id, 3, 50_000, cart_info.created_at),
+            },
+        )
+
+        self.product.refresh_from_db()
+        self.product2.refresh_from_db()
+        self.assertEqual(self.product.stock, 3)
+        self.assertEqual(self.product2.stock, 7)
+
+        cart = Cart.objects.get(user=self.user)
+        self.assertEqual(cart.amount, 0)
+        self.assertFalse(cart.items.exists())
+
+    def test_empty_cart(self):
+        with self.assertRaises(EmptyCartError):
+            self.checkout()
+
+        self.assertFalse(CartInfo.objects.exists())
+
+    def test_out_of_stock_writes_nothing(self):
+        Cart.manage_items.set(self.user, self.product, quantity=2)
+        Cart.manage_items.set(self.user, self.product2, quantity=1)
+        # the owner lowers the stock after it is held
+        Product.objects.filter(id=self.product.id).update(stock=1)
+
+        with self.assertRaises(OutOfStockError) as error:
+            self.checkout()
+
+        self.assertEqual(error.exception.product_ids, [str(self.product.id)])
+        self.assertFalse(CartInfo.objects.exists())
+        self.assertFalse(OrderLine.objects.exists())
+        self.assertFalse(Transaction.objects.exists())
+        self.product2.refresh_from_db()
+        self.assertEqual(self.product2.stock, 10)
+        self.assertEqual(CartItem.objects.count(), 2)
+
+    def test_stock_held_by_another_cart_is_not_sold(self):
+        product = Product.objects.create(market=self.market, name="Last one", price=1_000, stock=1)
+        other = User.objects.create_user(phone="09876543210", password="anotherpass")
+        Cart.manage_items.set(self.user, product, quantity=1)
+        # the hold of the user expires and another cart holds the last unit
+        StockReservation.objects.filter(cart__user=self.user).update(expires_at=timezone.now())
+        StockReservation.objects.release_expired()
+        Cart.manage_items.set(other, product, quantity=1)
+
+        with self.assertRaises(OutOfStockError) as error:
+            self.checkout()
+        self.assertEqual(error.exception.product_ids, [str(product.id)])
+
+        CheckoutService.checkout(other, first_name="Other", last_name="Buyer", mobile_number="09876543210")
+
+        product.refresh_from_db()
+        self.assertEqual(product.stock, 0)
+        self.assertEqual(ReservedStock.objects.get(product=product).quantity, 0)
+
+    def test_checkout_cost_does_not_depend_on_items(self):
+        for i in range(5):
+            product = Product.objects.create(market=self.market, name=f"P {i}", price=1_000, stock=10)
+            Cart.manage_items.add(self.user, product)
+
+        with self.assertNumQueries(15 if connection.vendor == 'postgresql' else 20):
+            self.checkout()
+
+    @override_settings(CART_STORAGE='redis')
+    def test_checkout_flushes_live_cart(self):
+        self.addCleanup(RedisCartStore.evict, self.user.pk)
+        RedisCartStore.add(self.user, self.product, quantity=2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            cart_info, _ = self.checkout()
+
+        self.assertEqual(cart_info.amount, 2 * 80_000)
+        self.assertEqual(RedisCartStore.get_cart_detail(self.user).amount, 0)
+
+    @override_settings(CART_STORAGE='redis')
+    def test_writes_after_flush_stay_in_live_cart(self):
+        self.addCleanup(RedisCartStore.evict, self.user.pk)
+        RedisCartStore.add(self.user, self.product, quantity=2)
+
+        def flush_then_add(user):
+            flush_cart(user)
+            # lands between the flush and the commit of the checkout
+            RedisCartStore.add(user, self.product, quantity=1)
+            RedisCartStore.add(user, self.product2, quantity=3)
+
+        with patch('apps.cart.checkout.flush_cart', flush_then_add), \
+                self.captureOnCommitCallbacks(execute=True):
+            cart_info, _ = self.checkout()
+
+        self.assertEqual(cart_info.amount, 2 * 80_000)
+        self.assertEqual(RedisCartStore.read(self.user), {self.product.id: 1, self.product2.id: 3})
+        RedisCartStore.flush(self.user.pk)
+        self.assertEqual(
+            dict(CartItem.objects.filter(cart__user=self.user).values_list('product_id', 'quantity')),
+            {self.product.id: 1, self.product2.id: 3},
+        )
+
+
+class CheckoutViewTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            phone="09123456789",
+            password="testpass123",
+            first_name="Amir",
+        )
+        Marketer.objects.create(
+            user=cls.user,
+            age=20,
+            national_code="1234567890",
+            city="city",
+            province="province",
+            address="address",
+        )
+        cls.market = Market.objects.create(marketer=cls.user.marketer, name="Test Market")
+        cls.product = Product.objects.create(market=cls.market, name="Product", price=10_000, stock=1)
+        cls.url = reverse('cart_user:checkout')
+
+    def setUp(self):
+        self.client.force_authenticate(user=self.user)
+
+    def test_checkout(self):
+        Cart.manage_items.add(self.user, self.product)
+
+        response = self.client.post(self.url, {"last_name": "Shop"}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['amount'], 10_000)
+        transaction = Transaction.objects.get(id=response.data['transaction_id'])
+        self.assertEqual(transaction.first_name, "Amir")
+        self.assertEqual(transaction.last_name, "Shop")
+        self.assertEqual(transaction.mobile_number, "09123456789")
+
+    def test_empty_cart(self):
+        response = self.client.post(self.url, {}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_out_of_stock(self):
+        Cart.manage_items.add(self.user, self.product)
+        Product.objects.filter(id=self.product.id).update(stock=0)
+
+        response = self.client.post(self.url, {}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response.data['product_ids'], [str(self.product.id)])
+
+    def test_invalid_mobile_number(self):
+        response = self.client.post(self.url, {"mobile_number": "123"}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_unauthenticated(self):
+        self.client.force_authenticate(user=None)
+
+        response = self.client.post(self.url, {}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+@skipUnless(connection.vendor == 'postgresql', 'needs row level locks')
+class CheckoutConcurrencyTest(TransactionTestCase):
+    """A flash sale: many buyers, one product, no overselling."""
+
+    stock = 5
+    buyers = 20
+
+    def setUp(self):
+        owner = User.objects.create_user(phone="09000000000", password="testpass123")
+        Marketer.objects.create(
+            user=owner,
+            age=20,
+            national_code="1234567890",
+            city="city",
+            province="province",
+            address="address",
+        )
+        market = Market.objects.create(marketer=owner.marketer, name="Test Market")
+        self.product = Product.objects.create(market=market, name="Product", price=10_000, stock=self.buyers)
+
+        self.users = [
+            User.objects.create_user(phone=f"0912{i:07d}", password="testpass123")
+            for i in range(self.buyers)
+        ]
+        for user in self.users:
+            Cart.manage_items.add(user, self.product)
+        # every buyer holds the product, then the stock drops
+        Product.objects.filter(id=self.product.id).update(stock=self.stock)
+
+    def buy(self, user, results):
+        try:
+            CheckoutService.checkout(user, "first", "last", user.phone)
+            results.append(True)
+        except OutOfStockError:
+            results.append(False)
+        finally:
+            connection.close()
+
+    def test_parallel_buyers_do_not_oversell(self):
+        results = []
+        workers = [threading.Thread(target=self.buy, args=(user, results)) for user in self.users]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        self.assertEqual(len(results), self.buyers)
+        self.assertEqual(results.count(True), self.stock)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 0)
+        self.assertEqual(CartInfo.objects.count(), self.stock)
+        self.assertEqual(Transaction.objects.count(), self.stock)
@@ -0,0 +1,80 @@
+from datetime import timedelta
+from io import StringIO
+from django.core.management import call_command
+from django.test import TestCase
+from django.contrib.auth import get_user_model
+from django.utils import timezone
+
+from apps.market.models import Market
+from apps.cart.models import CartInfo, OrderLine
+from apps.product.models import Product
+from apps.user.models import Marketer
+
+User = get_user_model()
+
+
+class BackfillOrderLinesTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(phone="09123456789", password="testpass123")
+        Marketer.objects.create(
+            user=cls.user,
+            age=20,
+            national_code="1234567890",
+            city="city",
+            province="province",
+            address="address",
+        )
+        cls.market = Market.objects.create(marketer=cls.user.marketer, name="Test Market")
+        cls.product = Product.objects.create(market=cls.market, name="Product", price=10_000, stock=10)
+
+    def snapshot(self, product_id, market_id, quantity):
+        return CartInfo.objects.create(
+            user=self.user,
+            amount=quantity * 10_000,
+            items=[{
+                "product_id": str(product_id),
+                "market_id": str(market_id),
+                "quantity": quantity,
+                "unit_price": 10_000,
+            }],
+        )
+
+    def backfill(self, chunk_size=2):
+        out = StringIO()
+        call_command('backfill_order_lines', chunk_size=chunk_size, stdout=out)
+        return out.getvalue()
+
+    def test_backfill(self):
+        infos = [self.snapshot(self.product.id, self.market.id, quantity) for quantity in (1, 2, 3)]
+        ordered_at = timezone.now() - timedelta(days=30)
+        CartInfo.objects.filter(id=infos[0].id).update(created_at=ordered_at)
+
+        self.assertIn("3 order lines created for 3 orders", self.backfill())
+
+        line = OrderLine.objects.get(cart_info=infos[0])
+        self.assertEqual(line.product, self.product)
+        self.assertEqual(line.market, self.market)
+        self.assertEqual(line.unit_price, 10_000)
+        self.assertEqual(line.created_at, ordered_at)
+        self.assertEqual(sum(OrderLine.objects.values_list('quantity', flat=True)), 6)
+
+    def test_backfill_skips_filled_orders(self):
+        self.snapshot(self.product.id, self.market.id, 1)
+        self.backfill()
+
+        self.assertIn("0 order lines created for 0 orders", self.backfill())
+        self.assertEqual(OrderLine.objects.count(), 1)
+
+    def test_backfill_keeps_lines_of_deleted_products(self):
+        product = Product.objects.create(market=self.market, name="Gone", price=1_000, stock=1)
+        info = self.snapshot(product.id, self.market.id, 1)
+        product.delete()
+        CartInfo.objects.create(user=self.user, amount=0)  # old snapshot without items
+
+        self.backfill()
+
+        line = OrderLine.objects.get(cart_info=info)
+        self.assertIsNone(line.product)
+        self.assertEqual(line.market, self.market)
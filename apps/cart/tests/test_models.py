@@ -1,10 +1,14 @@
-from django.test import TestCase
+import threading
+from unittest import skipUnless
+from django.test import TestCase, TransactionTestCase, skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth import get_user_model
-from django.db import IntegrityError, transaction
+from django.db import IntegrityError, connection, transaction
+from django.utils import timezone
 
 from apps.market.models import Market
 from apps.product.models import Product
-from apps.cart.models import Cart, CartItem
+from apps.cart.models import Cart, CartItem, OutOfStockError, ReservedStock, StockReservation
 from apps.user.models import Marketer
 
 User = get_user_model()
@@ -222,4 +226,321 @@ class CartAndCartItemTest(TestCase):
 
         # Cart state should remain unchanged
         item = self.user.cart.items.get(product=self.product1)
-        self.assertEqual(item.quantity, 1)
\ No newline at end of file
+        self.assertEqual(item.quantity, 1)
+
+
+class CartUpsertTest(TestCase):
+    """Tests for the upsert engine used by CartManager mutations."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(phone="09123456789", password="testpass123")
+        Marketer.objects.create(
+            user=cls.user,
+            age=20,
+            national_code="1234567890",
+            city="city",
+            province="province",
+            address="address",
+        )
+        cls.market = Market.objects.create(marketer=cls.user.marketer, name="Test Market")
+        cls.product = Product.objects.create(
+            market=cls.market,
+            name="First Product",
+            price=100_000,
+            percentage_off=20,  # discount_price = 80_000
+            stock=100,
+        )
+        cls.product2 = Product.objects.create(
+            market=cls.market,
+            name="Second Product",
+            price=200_000,
+            stock=50,
+        )
+
+    def assertAmountIsExact(self):
+        cart = Cart.objects.get(user=self.user)
+        self.assertEqual(cart.amount, sum(item.final_price for item in cart.items.all()))
+
+    def statements(self, queries):
+        return [query for query in queries if 'SAVEPOINT' not in query['sql']]
+
+    def test_add_creates_cart_and_item(self):
+        item = Cart.manage_items.add(self.user, self.product, quantity=3)
+
+        self.assertEqual(item.quantity, 3)
+        self.assertEqual(item.final_price, 3 * 80_000)
+        self.assertEqual(item.product, self.product)
+        self.assertEqual(item.cart.user, self.user)
+        self.assertAmountIsExact()
+
+    def test_add_rejects_non_positive_quantity(self):
+        with self.assertRaises(ValueError):
+            Cart.manage_items.add(self.user, self.product, quantity=0)
+
+    def test_mutations_keep_amount_exact(self):
+        Cart.manage_items.add(self.user, self.product)
+        Cart.manage_items.add(self.user, self.product2)
+        self.assertAmountIsExact()
+
+        Cart.manage_items.set(self.user, self.product, quantity=4)
+        self.assertAmountIsExact()
+
+        Cart.manage_items.decrease(self.user, self.product)
+        self.assertAmountIsExact()
+
+        Cart.manage_items.remove(self.user, self.product2)
+        self.assertAmountIsExact()
+        self.assertEqual(Cart.objects.get(user=self.user).amount, 3 * 80_000)
+
+    def test_mutations_reprice_item(self):
+        Cart.manage_items.add(self.user, self.product)
+        Product.objects.filter(id=self.product.id).update(discount_price=50_000)
+        self.product.refresh_from_db()
+
+        item = Cart.manage_items.add(self.user, self.product)
+
+        self.assertEqual(item.final_price, 2 * 50_000)
+        self.assertAmountIsExact()
+
+    def test_returned_item_matches_database(self):
+        item = Cart.manage_items.set(self.user, self.product, quantity=2)
+        stored = CartItem.objects.get(id=item.id)
+
+        self.assertEqual(item.quantity, stored.quantity)
+        self.assertEqual(item.final_price, stored.final_price)
+        self.assertEqual(item.cart_id, stored.cart_id)
+
+    def test_batch_recalculates_amount_once(self):
+        Cart.manage_items.add(self.user, self.product)
+        products = [self.product, self.product2] + [
+            Product.objects.create(market=self.market, name=f"Product {i}", price=1_000, stock=10)
+            for i in range(4)
+        ]
+
+        def run_batch(changes):
+            with CaptureQueriesContext(connection) as queries:
+                cart = Cart.manage_items.batch(self.user, changes)
+            return cart, len(queries)
+
+        _, few_queries = run_batch([(products[2], 'add', 1), (products[0], 'decrease', 1)])
+        cart, many_queries = run_batch(
+            [(product, 'set', 2) for product in products] + [(products[3], 'remove', 1)]
+        )
+
+        self.assertEqual(few_queries, many_queries)
+        self.assertEqual(cart.items.count(), 5)
+        self.assertAmountIsExact()
+
+    def test_clear_cost_does_not_depend_on_items(self):
+        Cart.manage_items.add(self.user, self.product)
+
+        with CaptureQueriesContext(connection) as queries:
+            cart = Cart.manage_items.clear(self.user)
+        few_queries = len(queries)
+
+        for i in range(5):
+            product = Product.objects.create(market=self.market, name=f"Product {i}", price=1_000, stock=10)
+            Cart.manage_items.add(self.user, product)
+
+        with CaptureQueriesContext(connection) as queries:
+            cart = Cart.manage_items.clear(self.user)
+
+        self.assertEqual(len(queries), few_queries)
+        self.assertEqual(cart.amount, 0)
+        self.assertEqual(cart.items.count(), 0)
+        self.assertAmountIsExact()
+
+    def test_batch_rejects_changes_of_missing_items(self):
+        with self.assertRaises(ValueError):
+            Cart.manage_items.batch(self.user, [(self.product, 'decrease', 1)])
+
+    @skipUnless(connection.vendor == 'postgresql', 'single statement mutations need postgresql')
+    def test_each_mutation_costs_two_statements(self):
+        Cart.manage_items.add(self.user, self.product)
+
+        for operation, kwargs in (
+                ('add', {}),
+                ('set', {'quantity': 5}),
+                ('decrease', {}),
+                ('remove', {}),
+                ('clear', {}),
+        ):
+            with CaptureQueriesContext(connection) as queries:
+                if operation == 'clear':
+                    Cart.manage_items.clear(self.user)
+                else:
+                    getattr(Cart.manage_items, operation)(self.user, self.product, **kwargs)
+            # stock holds (StockReservation, ReservedStock) are counted by StockReservationTest
+            statements = [
+                query for query in self.statements(queries)
+                if 'cart_stockreservation' not in query['sql'] and 'cart_reservedstock' not in query['sql']
+            ]
+            self.assertEqual(len(statements), 2, operation)
+
+        self.assertAmountIsExact()
+
+
+@skipUnlessDBFeature('has_select_for_update')
+class CartUpsertConcurrencyTest(TransactionTestCase):
+    """Concurrent clicks must not lose updates."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(phone="09123456789", password="testpass123")
+        Marketer.objects.create(
+            user=self.user,
+            age=20,
+            national_code="1234567890",
+            city="city",
+            province="province",
+            address="address",
+        )
+        market = Market.objects.create(marketer=self.user.marketer, name="Test Market")
+        self.product = Product.objects.create(market=market, name="Product", price=10_000, stock=100)
+
+    def add_to_cart(self):
+        try:
+            Cart.manage_items.add(self.user, self.product)
+        finally:
+            connection.close()
+
+    def test_concurrent_add_does_not_lose_updates(self):
+        workers = [threading.Thread(target=self.add_to_cart) for _ in range(10)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        item = CartItem.objects.get(cart__user=self.user, product=self.product)
+        self.assertEqual(item.quantity, 10)
+        self.assertEqual(Cart.objects.get(user=self.user).amount, 10 * 10_000)
+
+
+class StockReservationTest(TestCase):
+    """Carts hold the stock of their products until the hold expires."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(phone="09123456789", password="testpass123")
+        cls.user2 = User.objects.create_user(phone="09876543210", password="anotherpass")
+        Marketer.objects.create(
+            user=cls.user,
+            age=20,
+            national_code="1234567890",
+            city="city",
+            province="province",
+            address="address",
+        )
+        cls.market = Market.objects.create(marketer=cls.user.marketer, name="Test Market")
+        cls.product = Product.objects.create(market=cls.market, name="Product", price=10_000, stock=5)
+        cls.product2 = Product.objects.create(market=cls.market, name="Product 2", price=20_000, stock=5)
+
+    def reserved(self, product):
+        return ReservedStock.objects.filter(product=product).values_list('quantity', flat=True).first() or 0
+
+    def test_add_and_set_hold_stock(self):
+        Cart.manage_items.add(self.user, self.product, quantity=2)
+        self.assertEqual(self.reserved(self.product), 2)
+
+        Cart.manage_items.add(self.user, self.product)
+        self.assertEqual(self.reserved(self.product), 3)
+
+        Cart.manage_items.set(self.user, self.product, quantity=1)
+        self.assertEqual(self.reserved(self.product), 1)
+
+        reservation = StockReservation.objects.get(cart__user=self.user, product=self.product)
+        self.assertEqual(reservation.quantity, 1)
+        self.assertGreater(reservation.expires_at, timezone.now())
+
+    def test_decrease_remove_and_clear_release_stock(self):
+        Cart.manage_items.set(self.user, self.product, quantity=3)
+        Cart.manage_items.set(self.user, self.product2, quantity=2)
+
+        Cart.manage_items.decrease(self.user, self.product)
+        self.assertEqual(self.reserved(self.product), 2)
+
+        Cart.manage_items.remove(self.user, self.product)
+        self.assertEqual(self.reserved(self.product), 0)
+        self.assertFalse(StockReservation.objects.filter(product=self.product).exists())
+
+        Cart.manage_items.clear(self.user)
+        self.assertEqual(self.reserved(self.product2), 0)
+        self.assertFalse(StockReservation.objects.exists())
+
+    def test_decrease_after_hold_expired_does_not_check_stock(self):
+        Cart.manage_items.set(self.user, self.product, quantity=3)
+        StockReservation.objects.filter(cart__user=self.user).update(expires_at=timezone.now())
+        StockReservation.objects.release_expired()
+        Cart.manage_items.set(self.user2, self.product, quantity=5)
+
+        item = Cart.manage_items.decrease(self.user, self.product)
+        self.assertEqual(item.quantity, 2)
+        Cart.manage_items.batch(self.user, [(self.product, 'decrease', 1)])
+        Cart.manage_items.remove(self.user, self.product)
+
+        self.assertEqual(self.reserved(self.product), 5)
+        self.assertFalse(StockReservation.objects.filter(cart__user=self.user).exists())
+
+    def test_deleted_cart_releases_stock(self):
+        Cart.manage_items.set(self.user2, self.product, quantity=2)
+        Cart.manage_items.set(self.user2, self.product2, quantity=1)
+
+        self.user2.delete()
+
+        self.assertEqual(self.reserved(self.product), 0)
+        self.assertEqual(self.reserved(self.product2), 0)
+        self.assertFalse(StockReservation.objects.exists())
+
+    def test_holds_of_other_carts_limit_stock(self):
+        Cart.manage_items.set(self.user, self.product, quantity=4)
+
+        with self.assertRaises(OutOfStockError) as error:
+            Cart.manage_items.add(self.user2, self.product, quantity=2)
+
+        self.assertEqual(error.exception.product_ids, [str(self.product.id)])
+        self.assertFalse(CartItem.objects.filter(cart__user=self.user2).exists())
+        self.assertEqual(self.reserved(self.product), 4)
+
+        Cart.manage_items.add(self.user2, self.product)
+        self.assertEqual(self.reserved(self.product), 5)
+
+    def test_batch_holds_stock(self):
+        Cart.manage_items.set(self.user, self.product, quantity=2)
+
+        Cart.manage_items.batch(self.user, [
+            (self.product, 'remove', 1),
+            (self.product2, 'set', 3),
+        ])
+
+        self.assertEqual(self.reserved(self.product), 0)
+        self.assertEqual(self.reserved(self.product2), 3)
+
+        with self.assertRaises(OutOfStockError):
+            Cart.manage_items.batch(self.user, [(self.product, 'add', 1), (self.product2, 'add', 3)])
+        self.assertEqual(self.reserved(self.product), 0)
+        self.assertEqual(self.reserved(self.product2), 3)
+
+    def test_hold_cost_does_not_depend_on_other_holds(self):
+        product = Product.objects.create(market=self.market, name="Popular", price=1_000, stock=100)
+        with CaptureQueriesContext(connection) as first:
+            Cart.manage_items.add(self.user, product)
+
+        for i in range(10):
+            user = User.objects.create_user(phone=f"0912{i:07d}", password="testpass123")
+            Cart.manage_items.add(user, product)
+
+        with CaptureQueriesContext(connection) as last:
+            Cart.manage_items.add(self.user2, product)
+
+        self.assertEqual(len(first), len(last))
+        self.assertEqual(self.reserved(product), 12)
+
+    def test_release_expired(self):
+        Cart.manage_items.set(self.user, self.product, quantity=2)
+        Cart.manage_items.set(self.user2, self.product, quantity=1)
+        StockReservation.objects.filter(cart__user=self.user).update(expires_at=timezone.now())
+
+        self.assertEqual(StockReservation.objects.release_expired(), 1)
+
+        self.assertEqual(self.reserved(self.product), 1)
+        self.assertEqual(StockReservation.objects.get().cart.user, self.user2)
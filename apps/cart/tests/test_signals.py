@@ -1,8 +1,15 @@
-from django.test import TestCase
+import threading
+from unittest.mock import patch
+from django.test import TestCase, TransactionTestCase, skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth import get_user_model
+from django.db import connection
+from django.db.models import Sum
 
 from apps.market.models import Market
 from apps.cart.models import Cart, CartItem
+from apps.cart.tasks import reconcile_cart_amounts
+from apps.cart.signals.cart import coalesce_cart_amount
 from apps.product.models import Product
 from apps.user.models import Marketer
 
@@ -123,7 +130,230 @@ class CartSignalTest(TestCase):
         self.cart.refresh_from_db()
         self.assertEqual(self.cart.amount, 999)  # No items, but manual save doesn't trigger item signal
 
-        # Now add item
+        # Now add item, only the difference is applied
         CartItem.objects.create(cart=self.cart, product=self.product1, quantity=1)
         self.cart.refresh_from_db()
-        self.assertEqual(self.cart.amount, 80_000)  # Overwrites to correct sum
\ No newline at end of file
+        self.assertEqual(self.cart.amount, 999 + 80_000)
+
+        # drift is fixed by reconciliation
+        reconcile_cart_amounts()
+        self.cart.refresh_from_db()
+        self.assertEqual(self.cart.amount, 80_000)
+
+    def test_signal_does_not_aggregate_items(self):
+        """Saving an item should not re-aggregate the whole cart."""
+        CartItem.objects.create(cart=self.cart, product=self.product1, quantity=1)
+        item = CartItem.objects.create(cart=self.cart, product=self.product2, quantity=1)
+
+        item.quantity = 2
+        with CaptureQueriesContext(connection) as queries:
+            item.save()
+
+        self.assertFalse(any('SUM(' in query['sql'].upper() for query in queries))
+        self.cart.refresh_from_db()
+        self.assertEqual(self.cart.amount, 80_000 + 400_000)
+
+    def test_signal_uses_stored_price_for_stale_instances(self):
+        """Two copies of the same item saved one after another keep the amount exact."""
+        item = CartItem.objects.create(cart=self.cart, product=self.product1, quantity=1)
+        first_copy = CartItem.objects.get(id=item.id)
+        second_copy = CartItem.objects.get(id=item.id)
+
+        first_copy.quantity = 3
+        first_copy.save()
+        second_copy.quantity = 2
+        second_copy.save()
+        self.cart.refresh_from_db()
+        self.assertEqual(self.cart.amount, 2 * 80_000)
+
+        first_copy.delete()
+        self.cart.refresh_from_db()
+        self.assertEqual(self.cart.amount, 0)
+
+    def test_signal_unchanged_item_does_not_write_cart(self):
+        """Saving an item without changing final_price should not update the cart."""
+        item = CartItem.objects.create(cart=self.cart, product=self.product1, quantity=1)
+
+        with CaptureQueriesContext(connection) as queries:
+            item.save()
+
+        self.assertFalse(any('"cart_cart"' in query['sql'] and query['sql'].startswith('UPDATE') for query in queries))
+
+
+    def test_coalesced_deletes_recalculate_amount_once(self):
+        """Inside coalesce_cart_amount items are deleted without per row bookkeeping."""
+        CartItem.objects.create(cart=self.cart, product=self.product1, quantity=2)
+        CartItem.objects.create(cart=self.cart, product=self.product2, quantity=1)
+
+        with CaptureQueriesContext(connection) as queries:
+            with coalesce_cart_amount():
+                for item in self.cart.items.all():
+                    item.delete()
+
+        cart_updates = [
+            query for query in queries
+            if query['sql'].startswith('UPDATE') and '"cart_cart"' in query['sql']
+        ]
+        self.assertEqual(len(cart_updates), 1)
+        self.cart.refresh_from_db()
+        self.assertEqual(self.cart.amount, 0)
+
+    def test_coalesced_block_is_atomic(self):
+        """An error inside the block rolls back items and skips recalculation."""
+        CartItem.objects.create(cart=self.cart, product=self.product1, quantity=2)
+
+        with self.assertRaises(RuntimeError):
+            with coalesce_cart_amount():
+                self.cart.items.all().delete()
+                raise RuntimeError
+
+        self.cart.refresh_from_db()
+        self.assertEqual(self.cart.items.count(), 1)
+        self.assertEqual(self.cart.amount, 160_000)
+
+    def test_coalesced_product_delete_updates_every_cart(self):
+        """Deleting a product recalculates each cart that had it."""
+        other_user = User.objects.create_user(phone="09876543210", password="anotherpass")
+        other_cart = Cart.manage_items.get_cart(other_user)
+        product = Product.objects.create(market=self.market, name="Temporary", price=10_000, stock=5)
+        for cart in (self.cart, other_cart):
+            CartItem.objects.create(cart=cart, product=product, quantity=1)
+            CartItem.objects.create(cart=cart, product=self.product2, quantity=1)
+
+        with coalesce_cart_amount():
+            product.delete()
+
+        for cart in (self.cart, other_cart):
+            cart.refresh_from_db()
+            self.assertEqual(cart.amount, 200_000)
+
+@skipUnlessDBFeature('has_select_for_update')
+class CartSignalConcurrencyTest(TransactionTestCase):
+    """Cart.amount must stay equal to the sum of items under concurrent writes."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(phone="09123456789", password="testpass123")
+        Marketer.objects.create(
+            user=self.user,
+            age=20,
+            national_code="1234567890",
+            city="city",
+            province="province",
+            address="address",
+        )
+        market = Market.objects.create(marketer=self.user.marketer, name="Test Market")
+        self.products = [
+            Product.objects.create(market=market, name=f"Product {i}", price=10_000 * (i + 1), stock=100)
+            for i in range(3)
+        ]
+        self.cart = Cart.manage_items.get_cart(self.user)
+
+    def run_worker(self, operations):
+        try:
+            for operation, product in operations:
+                try:
+                    getattr(Cart.manage_items, operation)(self.user, product)
+                except (ValueError, CartItem.DoesNotExist):
+                    pass
+        finally:
+            connection.close()
+
+    def test_amount_is_exact_after_concurrent_add_decrease_remove(self):
+        operations = ['add', 'add', 'add', 'decrease', 'remove']
+        workers = []
+        for i in range(8):
+            plan = [
+                (operations[(i + j) % len(operations)], self.products[(i * j) % len(self.products)])
+                for j in range(15)
+            ]
+            workers.append(threading.Thread(target=self.run_worker, args=(plan,)))
+
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        self.cart.refresh_from_db()
+        total = self.cart.items.aggregate(total=Sum('final_price'))['total'] or 0
+        self.assertEqual(self.cart.amount, total)
+
+
+class ProductRepriceSignalTest(TestCase):
+    """Changing a product price reprices every cart that contains it."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(phone="09123456789", password="testpass123")
+        cls.user2 = User.objects.create_user(phone="09876543210", password="anotherpass")
+        Marketer.objects.create(
+            user=cls.user,
+            age=20,
+            national_code="1234567890",
+            city="city",
+            province="province",
+            address="address",
+        )
+        cls.market = Market.objects.create(marketer=cls.user.marketer, name="Test Market")
+        cls.other_product = Product.objects.create(
+            market=cls.market,
+            name="Other",
+            price=50_000,
+            stock=10,
+        )
+
+    def setUp(self):
+        self.product = Product.objects.create(
+            market=self.market,
+            name="Product",
+            price=100_000,
+            percentage_off=20,  # discount_price = 80_000
+            stock=100,
+        )
+        Cart.manage_items.set(self.user, self.product, quantity=2)
+        Cart.manage_items.add(self.user, self.other_product)
+        Cart.manage_items.set(self.user2, self.product, quantity=3)
+
+    def assertCart(self, user, amount):
+        cart = Cart.objects.get(user=user)
+        self.assertEqual(cart.amount, amount)
+        self.assertEqual(cart.amount, sum(item.final_price for item in cart.items.all()))
+
+    def test_price_change_reprices_items_and_carts(self):
+        self.product.price = 200_000  # discount_price = 160_000
+        self.product.save()
+
+        self.assertCart(self.user, 2 * 160_000 + 50_000)
+        self.assertCart(self.user2, 3 * 160_000)
+
+    def test_percentage_off_change_reprices_with_few_updates(self):
+        self.product.percentage_off = 50  # discount_price = 50_000
+
+        with CaptureQueriesContext(connection) as queries:
+            self.product.save()
+
+        updates = [query for query in queries if query['sql'].startswith('UPDATE')]
+        # product, carts and items
+        self.assertEqual(len(updates), 3)
+        self.assertCart(self.user, 2 * 50_000 + 50_000)
+        self.assertCart(self.user2, 3 * 50_000)
+
+    def test_other_changes_do_not_reprice(self):
+        self.product.stock = 1
+
+        with CaptureQueriesContext(connection) as queries:
+            self.product.save(update_fields=['stock'])
+
+        self.assertEqual(len(queries), 1)
+        self.assertCart(self.user, 2 * 80_000 + 50_000)
+
+    def test_large_fan_out_is_sent_to_celery(self):
+        self.product.price = 200_000
+
+        with patch('apps.cart.signals.product.REPRICE_INLINE_LIMIT', 1), \
+                patch('apps.cart.signals.product.reprice_cart_items.delay') as delay:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.product.save()
+
+        delay.assert_called_once_with(str(self.product.id))
+        # nothing is repriced until the task runs
+        self.assertCart(self.user, 2 * 80_000 + 50_000)
\ No newline at end of file
@@ -0,0 +1,217 @@
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.contrib.auth import get_user_model
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from apps.market.models import Market
+from apps.cart.models import Cart, CartItem
+from apps.cart.store import RedisCartStore, get_cart_store, flush_cart
+from apps.cart.tasks import flush_dirty_carts
+from apps.product.models import Product
+from apps.user.models import Marketer
+
+User = get_user_model()
+
+
+@override_settings(CART_STORAGE='redis')
+class RedisCartStoreTest(TestCase):
+    """Tests for live carts kept in redis and flushed to the database."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(phone="09123456789", password="testpass123")
+        Marketer.objects.create(
+            user=cls.user,
+            age=20,
+            national_code="1234567890",
+            city="city",
+            province="province",
+            address="address",
+        )
+        cls.market = Market.objects.create(marketer=cls.user.marketer, name="Test Market")
+        cls.product = Product.objects.create(
+            market=cls.market,
+            name="Product 1",
+            price=100_000,
+            percentage_off=20,  # discount_price = 80_000
+            stock=100,
+        )
+        cls.product2 = Product.objects.create(
+            market=cls.market,
+            name="Product 2",
+            price=50_000,
+            stock=100,
+        )
+
+    def setUp(self):
+        RedisCartStore.evict(self.user.pk)
+        self.addCleanup(RedisCartStore.evict, self.user.pk)
+
+    def test_get_cart_store(self):
+        self.assertIs(get_cart_store(), RedisCartStore)
+
+        with override_settings(CART_STORAGE='database'):
+            self.assertIs(get_cart_store(), Cart.manage_items)
+
+    def test_writes_do_not_touch_database(self):
+        RedisCartStore.hydrate(self.user)
+
+        with self.assertNumQueries(0):
+            item = RedisCartStore.add(self.user, self.product, quantity=2)
+            RedisCartStore.set(self.user, self.product2, quantity=3)
+            RedisCartStore.decrease(self.user, self.product)
+
+        self.assertEqual(item.quantity, 2)
+        self.assertEqual(item.final_price, 160_000)
+        self.assertFalse(CartItem.objects.exists())
+
+    def test_cart_detail_reads_live_items(self):
+        RedisCartStore.add(self.user, self.product, quantity=2)
+        RedisCartStore.add(self.user, self.product2)
+        RedisCartStore.remove(self.user, self.product2)
+
+        cart = RedisCartStore.get_cart_detail(self.user)
+
+        self.assertEqual(cart.amount, 160_000)
+        self.assertEqual([item.quantity for item in cart.items.all()], [2])
+
+    def test_decrease_and_remove_missing_product(self):
+        with self.assertRaises(ValueError):
+            RedisCartStore.decrease(self.user, self.product)
+        with self.assertRaises(ValueError):
+            RedisCartStore.remove(self.user, self.product)
+
+    def test_decrease_does_not_go_below_one(self):
+        RedisCartStore.add(self.user, self.product)
+
+        item = RedisCartStore.decrease(self.user, self.product)
+
+        self.assertEqual(item.quantity, 1)
+
+    def test_hydrate_loads_database_items(self):
+        Cart.manage_items.set(self.user, self.product, quantity=4)
+
+        RedisCartStore.add(self.user, self.product)
+        cart = RedisCartStore.get_cart_detail(self.user)
+
+        self.assertEqual(cart.id, Cart.objects.get(user=self.user).id)
+        self.assertEqual(cart.items.all()[0].quantity, 5)
+
+    def test_flush_writes_items_and_amount(self):
+        RedisCartStore.add(self.user, self.product, quantity=2)
+        RedisCartStore.set(self.user, self.product2, quantity=3)
+
+        flush_cart(self.user)
+
+        cart = Cart.objects.get(user=self.user)
+        self.assertEqual(cart.amount, 2 * 80_000 + 3 * 50_000)
+        self.assertEqual(
+            dict(cart.items.values_list('product_id', 'quantity')),
+            {self.product.id: 2, self.product2.id: 3},
+        )
+
+        RedisCartStore.remove(self.user, self.product2)
+        RedisCartStore.decrease(self.user, self.product)
+        flush_cart(self.user)
+
+        cart.refresh_from_db()
+        self.assertEqual(cart.amount, 80_000)
+        self.assertEqual(list(cart.items.values_list('quantity', flat=True)), [1])
+
+    def test_flush_drops_deleted_products(self):
+        product = Product.objects.create(market=self.market, name="Gone", price=1_000, stock=1)
+        RedisCartStore.add(self.user, product)
+        RedisCartStore.add(self.user, self.product)
+        product.delete()
+
+        self.assertEqual(RedisCartStore.get_cart_detail(self.user).amount, 80_000)
+
+        flush_cart(self.user)
+
+        self.assertEqual(Cart.objects.get(user=self.user).amount, 80_000)
+
+    def test_batch(self):
+        RedisCartStore.add(self.user, self.product)
+
+        cart = RedisCartStore.batch(self.user, [
+            (self.product, 'add', 2),
+            (self.product2, 'set', 4),
+            (self.product2, 'decrease', 1),
+        ])
+
+        self.assertEqual(cart.amount, 3 * 80_000 + 3 * 50_000)
+
+        with self.assertRaises(ValueError):
+            RedisCartStore.batch(self.user, [(self.product, 'remove', 1), (self.product, 'decrease', 1)])
+        self.assertEqual(RedisCartStore.read(self.user)[self.product.id], 3)
+
+    def test_clear(self):
+        RedisCartStore.add(self.user, self.product)
+        flush_cart(self.user)
+
+        cart = RedisCartStore.clear(self.user)
+
+        self.assertEqual(cart.amount, 0)
+        self.assertEqual(RedisCartStore.read(self.user), {})
+        flush_cart(self.user)
+        self.assertFalse(CartItem.objects.exists())
+        self.assertEqual(Cart.objects.get(user=self.user).amount, 0)
+
+    def test_flush_dirty_carts_task(self):
+        RedisCartStore.add(self.user, self.product)
+
+        self.assertEqual(flush_dirty_carts(), 1)
+        self.assertEqual(flush_dirty_carts(), 0)
+        self.assertEqual(Cart.objects.get(user=self.user).amount, 80_000)
+
+    def test_flush_dirty_carts_task_in_database_mode(self):
+        RedisCartStore.add(self.user, self.product)
+
+        with override_settings(CART_STORAGE='database'):
+            self.assertEqual(flush_dirty_carts(), 0)
+
+
+@override_settings(CART_STORAGE='redis')
+class RedisCartViewsTest(APITestCase):
+    """Cart endpoints behave the same when carts live in redis."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(phone="09123456789", password="testpass123")
+        Marketer.objects.create(
+            user=cls.user,
+            age=20,
+            national_code="1234567890",
+            city="city",
+            province="province",
+            address="address",
+        )
+        cls.market = Market.objects.create(marketer=cls.user.marketer, name="Test Market")
+        cls.product = Product.objects.create(
+            market=cls.market,
+            name="Product 1",
+            price=100_000,
+            stock=100,
+        )
+
+    def setUp(self):
+        self.client.force_authenticate(user=self.user)
+        RedisCartStore.evict(self.user.pk)
+        self.addCleanup(RedisCartStore.evict, self.user.pk)
+
+    def test_add_then_detail(self):
+        response = self.client.post(reverse('cart_user:add_to_cart', args=[self.product.id]))
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['quantity'], 1)
+
+        response = self.client.get(reverse('cart_user:cart_detail'))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['amount'], 100_000)
+        self.assertEqual(response.data['items'][0]['product_name'], "Product 1")
+
+    def test_decrease_missing_product(self):
+        response = self.client.post(reverse('cart_user:decrease_item', args=[self.product.id]))
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
@@ -0,0 +1,80 @@
+import uuid
+from django.test import TestCase
+from django.utils import timezone
+from django.contrib.auth import get_user_model
+
+from apps.market.models import Market
+from apps.cart.models import Cart, CartItem, ReservedStock, StockReservation
+from apps.cart.tasks import reconcile_cart_amounts, release_expired_reservations, reprice_cart_items
+from apps.product.models import Product
+from apps.user.models import Marketer
+
+User = get_user_model()
+
+
+class ReconcileCartAmountsTest(TestCase):
+    """Tests for the periodic task that fixes drifted Cart.amount values."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(phone="09123456789", password="testpass123")
+        cls.user2 = User.objects.create_user(phone="09876543210", password="anotherpass")
+        Marketer.objects.create(
+            user=cls.user,
+            age=20,
+            national_code="1234567890",
+            city="city",
+            province="province",
+            address="address",
+        )
+        cls.market = Market.objects.create(marketer=cls.user.marketer, name="Test Market")
+        cls.product = Product.objects.create(
+            market=cls.market,
+            name="Product 1",
+            price=100_000,
+            percentage_off=20,  # discount_price = 80_000
+            stock=100,
+        )
+
+    def test_reconcile_fixes_drifted_amounts(self):
+        cart = Cart.manage_items.get_cart(self.user)
+        CartItem.objects.create(cart=cart, product=self.product, quantity=2)
+        empty_cart = Cart.manage_items.get_cart(self.user2)
+        Cart.objects.update(amount=1)
+
+        self.assertEqual(reconcile_cart_amounts(), 2)
+
+        cart.refresh_from_db()
+        empty_cart.refresh_from_db()
+        self.assertEqual(cart.amount, 160_000)
+        self.assertEqual(empty_cart.amount, 0)
+
+    def test_reconcile_leaves_correct_amounts(self):
+        cart = Cart.manage_items.get_cart(self.user)
+        CartItem.objects.create(cart=cart, product=self.product, quantity=2)
+        Cart.manage_items.get_cart(self.user2)
+
+        self.assertEqual(reconcile_cart_amounts(), 0)
+
+    def test_reprice_cart_items_in_chunks(self):
+        Cart.manage_items.set(self.user, self.product, quantity=2)
+        Cart.manage_items.set(self.user2, self.product, quantity=1)
+        Product.objects.filter(id=self.product.id).update(discount_price=50_000)
+
+        self.assertEqual(reprice_cart_items(str(self.product.id), chunk_size=1), 2)
+
+        self.assertEqual(Cart.objects.get(user=self.user).amount, 100_000)
+        self.assertEqual(Cart.objects.get(user=self.user2).amount, 50_000)
+        self.assertEqual(reconcile_cart_amounts(), 0)
+
+    def test_reprice_cart_items_of_deleted_product(self):
+        self.assertEqual(reprice_cart_items(str(uuid.uuid4())), 0)
+    def test_release_expired_reservations(self):
+        Cart.manage_items.set(self.user, self.product, quantity=2)
+        Cart.manage_items.set(self.user2, self.product, quantity=3)
+        StockReservation.objects.update(expires_at=timezone.now())
+
+        self.assertEqual(release_expired_reservations(chunk_size=1), 2)
+
+        self.assertFalse(StockReservation.objects.exists())
+        self.assertEqual(ReservedStock.objects.get(product=self.product).quantity, 0)
@@ -1,4 +1,7 @@
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 from rest_framework import status
 from rest_framework.test import APITestCase, APIClient
 from django.contrib.auth import get_user_model
@@ -62,6 +65,7 @@ class CartViewsTestCase(APITestCase):
         cls.set_quantity_url = lambda pid: reverse('cart_user:set_item_quantity', kwargs={'product_id': pid})
         cls.remove_item_url = lambda pid: reverse('cart_user:remove_cart', kwargs={'product_id': pid})
         cls.clear_cart_url = reverse('cart_user:cart_clear')
+        cls.batch_url = reverse('cart_user:cart_batch')
 
     def setUp(self):
         self.client = APIClient()
@@ -130,6 +134,18 @@ class CartViewsTestCase(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
         self.assertIn('Product does not exist', response.data['message'])
 
+    def test_add_to_cart_out_of_stock_fails(self):
+        """Stock held by other carts can't be added."""
+        Cart.manage_items.set(self.user2, self.product2, quantity=50)
+
+        response = self.client.post(self.add_to_cart_url(self.product2.id))
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response.data['product_ids'], [str(self.product2.id)])
+        self.assertFalse(CartItem.objects.filter(cart=self.cart).exists())
+
+        response = self.client.post(self.set_quantity_url(self.product1.id), {'quantity': 101})
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+
     def test_add_to_cart_unauthenticated_fails(self):
         """Unauthenticated POST should return 403."""
         self.client.force_authenticate(user=None)
@@ -272,6 +288,92 @@ class CartViewsTestCase(APITestCase):
         response = self.client.post(self.clear_cart_url)
         self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
 
+    # CartBatchView Tests
+    def test_batch_applies_all_changes(self):
+        """POST batch applies every change in order and returns the final cart."""
+        Cart.manage_items.set(self.user, self.product2, quantity=3)
+        data = [
+            {'product_id': str(self.product1.id), 'op': 'add', 'quantity': 2},
+            {'product_id': str(self.product1.id), 'op': 'add'},
+            {'product_id': str(self.product2.id), 'op': 'decrease'},
+            {'product_id': str(self.product1.id), 'op': 'decrease'},
+        ]
+        response = self.client.post(self.batch_url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        quantities = {item['product']: item['quantity'] for item in response.data['items']}
+        self.assertEqual(quantities, {self.product1.id: 2, self.product2.id: 2})
+        self.assertEqual(response.data['amount'], 2 * 80_000 + 2 * 200_000)
+        self.cart.refresh_from_db()
+        self.assertEqual(self.cart.amount, 2 * 80_000 + 2 * 200_000)
+
+    def test_batch_set_and_remove(self):
+        """POST batch with set and remove."""
+        Cart.manage_items.add(self.user, self.product1)
+        data = [
+            {'product_id': str(self.product1.id), 'op': 'remove'},
+            {'product_id': str(self.product2.id), 'op': 'set', 'quantity': 4},
+        ]
+        response = self.client.post(self.batch_url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['items']), 1)
+        self.assertEqual(response.data['amount'], 4 * 200_000)
+        self.assertFalse(CartItem.objects.filter(cart=self.cart, product=self.product1).exists())
+
+    def test_batch_remove_then_add_same_product(self):
+        """A removed product added again in the same batch starts from zero."""
+        Cart.manage_items.set(self.user, self.product1, quantity=5)
+        data = [
+            {'product_id': str(self.product1.id), 'op': 'remove'},
+            {'product_id': str(self.product1.id), 'op': 'add'},
+        ]
+        response = self.client.post(self.batch_url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['items'][0]['quantity'], 1)
+        self.assertEqual(response.data['amount'], 80_000)
+
+    def test_batch_nonexistent_product_fails(self):
+        """POST batch with unknown product returns 404 and changes nothing."""
+        missing = uuid.uuid4()
+        data = [
+            {'product_id': str(self.product1.id), 'op': 'add'},
+            {'product_id': str(missing), 'op': 'add'},
+        ]
+        response = self.client.post(self.batch_url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(response.data['product_ids'], [str(missing)])
+        self.assertEqual(self.cart.items.count(), 0)
+
+    def test_batch_is_atomic(self):
+        """A failing change rolls back the whole batch."""
+        data = [
+            {'product_id': str(self.product1.id), 'op': 'add'},
+            {'product_id': str(self.product2.id), 'op': 'remove'},
+        ]
+        response = self.client.post(self.batch_url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.cart.items.count(), 0)
+        self.cart.refresh_from_db()
+        self.assertEqual(self.cart.amount, 0)
+
+    def test_batch_invalid_payload_fails(self):
+        """Unknown op, missing quantity for set and empty list are rejected."""
+        invalid_payloads = [
+            [{'product_id': str(self.product1.id), 'op': 'buy'}],
+            [{'product_id': str(self.product1.id), 'op': 'set'}],
+            [{'product_id': str(self.product1.id), 'op': 'add', 'quantity': 0}],
+            [],
+        ]
+        for data in invalid_payloads:
+            response = self.client.post(self.batch_url, data, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, data)
+
+    def test_batch_unauthenticated_fails(self):
+        """Unauthenticated batch 401."""
+        self.client.force_authenticate(user=None)
+        response = self.client.post(self.batch_url, [], format='json')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
     # Additional Cross-View and Multi-User Tests
     def test_multi_user_carts_independent(self):
         """Operations on one user's cart don't affect another's."""
@@ -307,6 +409,68 @@ class CartViewsTestCase(APITestCase):
         self.assertEqual(CartItem.objects.get(cart=self.cart).product, self.product2)
 
 
+class CartQueryCountTestCase(APITestCase):
+    """Cart endpoints must cost a constant number of queries whatever the cart size."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(phone="09123456789", password="testpass123")
+        Marketer.objects.create(
+            user=cls.user,
+            age=20,
+            national_code="1234567890",
+            city="city",
+            province="province",
+            address="address",
+        )
+        cls.market = Market.objects.create(marketer=cls.user.marketer, name="Test Market")
+        cls.products = [
+            Product.objects.create(market=cls.market, name=f"Product {i}", price=10_000, stock=10)
+            for i in range(10)
+        ]
+        cls.cart_detail_url = reverse('cart_user:cart_detail')
+        cls.clear_cart_url = reverse('cart_user:cart_clear')
+        cls.set_quantity_url = reverse('cart_user:set_item_quantity', kwargs={'product_id': cls.products[0].id})
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def fill_cart(self, size):
+        Cart.manage_items.clear(self.user)
+        for product in self.products[:size]:
+            Cart.manage_items.add(self.user, product)
+
+    def count_queries(self, size, method, url, data=None):
+        self.fill_cart(size)
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(self.client, method)(url, data)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return len(queries), response
+
+    def test_cart_detail_query_count(self):
+        few, _ = self.count_queries(1, 'get', self.cart_detail_url)
+        many, response = self.count_queries(10, 'get', self.cart_detail_url)
+        self.assertEqual(few, many)
+        self.assertEqual(many, 2)
+        self.assertEqual(len(response.data['items']), 10)
+        self.assertEqual(
+            {item['product_name'] for item in response.data['items']},
+            {product.name for product in self.products},
+        )
+
+    def test_cart_clear_query_count(self):
+        few, _ = self.count_queries(1, 'post', self.clear_cart_url)
+        many, response = self.count_queries(10, 'post', self.clear_cart_url)
+        self.assertEqual(few, many)
+        self.assertEqual(response.data['items'], [])
+
+    def test_set_item_quantity_query_count(self):
+        few, _ = self.count_queries(1, 'post', self.set_quantity_url, {'quantity': 3})
+        many, response = self.count_queries(10, 'post', self.set_quantity_url, {'quantity': 3})
+        self.assertEqual(few, many)
+        self.assertEqual(response.data['product_name'], self.products[0].name)
+
 class CartInfoTestCase(APITestCase):
 
     @classmethod
@@ -357,4 +521,51 @@ class CartInfoTestCase(APITestCase):
     def test_list_by_authenticate_user(self):
         response = self.client.get(self.list_url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertNotIn('items', response.data['results'][0])
+        self.assertIsNone(response.data['next'])
+
+    def test_list_keyset_pagination(self):
+        created_at = timezone.now()
+        infos = CartInfo.objects.bulk_create([
+            CartInfo(user=self.main_user, amount=i, items=[{"quantity": i}])
+            for i in range(7)
+        ])
+        # the same created_at for all rows, id breaks the tie
+        CartInfo.objects.filter(id__in=[info.id for info in infos]).update(created_at=created_at)
+
+        seen = []
+        url = f'{self.list_url}?page_size=3'
+        while url:
+            with self.assertNumQueries(1):
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            seen += [row['id'] for row in response.data['results']]
+            url = response.data['next']
+
+        self.assertEqual(len(seen), 8)
+        self.assertEqual(len(set(seen)), 8)
+        self.assertEqual(seen[0], str(max(info.id for info in infos)))
+
+    def test_list_cursor_bounds_leading_column(self):
+        CartInfo.objects.bulk_create([CartInfo(user=self.main_user, amount=i) for i in range(3)])
+        response = self.client.get(self.list_url, {'page_size': 1})
+
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(response.data['next'])
+
+        # a plain bound on created_at, the start of the index range scan, and'ed with the tie breakers
+        sql = queries[0]['sql']
+        where = sql[sql.index(' WHERE '):]
+        self.assertIn('"cart_cartinfo"."created_at" <= ', where)
+
+    def test_list_invalid_cursor(self):
+        response = self.client.get(self.list_url, {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_detail_keeps_items(self):
+        info = CartInfo.objects.create(user=self.main_user, amount=10, items=[{"quantity": 1}])
+
+        response = self.client.get(self.detail_url(info.id))
+
+        self.assertEqual(response.data['items'], [{"quantity": 1}])
@@ -0,0 +1,224 @@
+import uuid
+from django.db import connection
+from django.utils import timezone
+
+from apps.cart.models import Cart, CartItem
+from apps.cart.signals.cart import coalesce_cart_amount
+
+ITEM_COLUMNS = [field.column for field in CartItem._meta.concrete_fields]
+ITEM_FIELDS = [field.attname for field in CartItem._meta.concrete_fields]
+
+LOCK_CART_SQL = f"""
+    INSERT INTO {Cart._meta.db_table} AS c (id, created_at, updated_at, user_id, amount)
+    VALUES (%(id)s, %(now)s, %(now)s, %(user_id)s, 0)
+    ON CONFLICT (user_id) DO UPDATE SET updated_at = EXCLUDED.updated_at
+    RETURNING c.id
+"""
+
+# every statement below changes one item and applies the difference of its
+# final price to the cart, the cart row is already locked by LOCK_CART_SQL
+# so "old" always sees the committed state of the item
+OLD_ITEM_CTE = f"""
+    old AS (
+        SELECT final_price FROM {CartItem._meta.db_table}
+        WHERE cart_id = %(cart_id)s AND product_id = %(product_id)s
+    )
+"""
+
+CART_AMOUNT_CTE = f"""
+    cart AS (
+        UPDATE {Cart._meta.db_table}
+        SET amount = amount
+            + COALESCE((SELECT final_price FROM item), 0)
+            - COALESCE((SELECT final_price FROM old), 0),
+            updated_at = %(now)s
+        WHERE id = %(cart_id)s AND EXISTS (SELECT 1 FROM item)
+    )
+"""
+
+UPSERT_ITEM_SQL = f"""
+    WITH {OLD_ITEM_CTE},
+    item AS (
+        INSERT INTO {CartItem._meta.db_table} AS i
+            (id, created_at, updated_at, cart_id, product_id, quantity, final_price)
+        VALUES (
+            %(id)s, %(now)s, %(now)s, %(cart_id)s, %(product_id)s,
+            %(quantity)s, %(quantity)s * %(price)s
+        )
+        ON CONFLICT (cart_id, product_id) DO UPDATE SET
+            quantity = {{quantity}},
+            final_price = ({{quantity}}) * %(price)s,
+            updated_at = EXCLUDED.updated_at
+        RETURNING {", ".join(f"i.{column}" for column in ITEM_COLUMNS)}
+    ),
+    {CART_AMOUNT_CTE}
+    SELECT * FROM item
+"""
+
+ADD_ITEM_SQL = UPSERT_ITEM_SQL.format(quantity="i.quantity + EXCLUDED.quantity")
+
+SET_ITEM_SQL = UPSERT_ITEM_SQL.format(quantity="EXCLUDED.quantity")
+
+DECREASE_ITEM_SQL = f"""
+    WITH {OLD_ITEM_CTE},
+    item AS (
+        UPDATE {CartItem._meta.db_table} AS i SET
+            quantity = GREATEST(i.quantity - %(quantity)s, 1),
+            final_price = GREATEST(i.quantity - %(quantity)s, 1) * %(price)s,
+            updated_at = %(now)s
+        WHERE i.cart_id = %(cart_id)s AND i.product_id = %(product_id)s
+        RETURNING {", ".join(f"i.{column}" for column in ITEM_COLUMNS)}
+    ),
+    {CART_AMOUNT_CTE}
+    SELECT * FROM item
+"""
+
+REMOVE_ITEM_SQL = f"""
+    WITH {OLD_ITEM_CTE},
+    deleted AS (
+        DELETE FROM {CartItem._meta.db_table}
+        WHERE cart_id = %(cart_id)s AND product_id = %(product_id)s
+        RETURNING id
+    ),
+    item AS (
+        SELECT 0 AS final_price FROM deleted
+    ),
+    {CART_AMOUNT_CTE}
+    SELECT id FROM deleted
+"""
+
+CART_COLUMNS = [field.column for field in Cart._meta.concrete_fields]
+CART_FIELDS = [field.attname for field in Cart._meta.concrete_fields]
+
+CLEAR_CART_SQL = f"""
+    WITH deleted AS (
+        DELETE FROM {CartItem._meta.db_table} WHERE cart_id = %(cart_id)s
+    )
+    UPDATE {Cart._meta.db_table} SET amount = 0, updated_at = %(now)s
+    WHERE id = %(cart_id)s
+    RETURNING {", ".join(CART_COLUMNS)}
+"""
+
+
+class CartItemUpsert:
+    """
+    Race free mutations of cart items.
+
+    On postgresql an operation costs two statements: an upsert that gets
+    (or creates) the cart and keeps its row locked, and one data modifying
+    CTE that changes the item and the cart amount together. Other databases
+    run the same steps through the orm while the cart row is locked.
+    """
+
+    @staticmethod
+    def is_native():
+        return connection.vendor == "postgresql"
+
+    @staticmethod
+    def execute(sql, params):
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.fetchone()
+
+    @staticmethod
+    def to_item(row, product):
+        item = CartItem.from_db(connection.alias, ITEM_FIELDS, row)
+        item.product = product
+        return item
+
+    @classmethod
+    def lock_cart(cls, user):
+        """returns id of the user's cart, the row stays locked until the transaction ends"""
+        if not cls.is_native():
+            cart, _ = Cart.objects.select_for_update().get_or_create(user=user)
+            return cart.id
+
+        row = cls.execute(
+            LOCK_CART_SQL,
+            {"id": uuid.uuid4(), "now": timezone.now(), "user_id": user.pk},
+        )
+        return row[0]
+
+    @classmethod
+    def params(cls, cart_id, product, quantity):
+        return {
+            "id": uuid.uuid4(),
+            "now": timezone.now(),
+            "cart_id": cart_id,
+            "product_id": product.pk,
+            "quantity": quantity,
+            "price": product.discount_price,
+        }
+
+    @staticmethod
+    def get_item(cart_id, product):
+        item = CartItem.objects.filter(cart_id=cart_id, product=product).first()
+        if item:
+            item.product = product
+        return item
+
+    @classmethod
+    def add(cls, cart_id, product, quantity=1):
+        if cls.is_native():
+            row = cls.execute(ADD_ITEM_SQL, cls.params(cart_id, product, quantity))
+            return cls.to_item(row, product)
+
+        item = cls.get_item(cart_id, product)
+        if item is None:
+            item = CartItem(cart_id=cart_id, product=product, quantity=0)
+        item.quantity += quantity
+        item.save()
+        return item
+
+    @classmethod
+    def set(cls, cart_id, product, quantity):
+        if cls.is_native():
+            row = cls.execute(SET_ITEM_SQL, cls.params(cart_id, product, quantity))
+            return cls.to_item(row, product)
+
+        item = cls.get_item(cart_id, product)
+        if item is None:
+            item = CartItem(cart_id=cart_id, product=product)
+        item.quantity = quantity
+        item.save()
+        return item
+
+    @classmethod
+    def decrease(cls, cart_id, product, quantity=1):
+        """decrease quantity but never below 1, returns None if product is not in cart"""
+        if cls.is_native():
+            row = cls.execute(DECREASE_ITEM_SQL, cls.params(cart_id, product, quantity))
+            return cls.to_item(row, product) if row else None
+
+        item = cls.get_item(cart_id, product)
+        if item is None:
+            return None
+        item.quantity = max(item.quantity - quantity, 1)
+        item.save()
+        return item
+
+    @classmethod
+    def remove(cls, cart_id, product):
+        """returns False if product is not in cart"""
+        if cls.is_native():
+            row = cls.execute(REMOVE_ITEM_SQL, cls.params(cart_id, product, 0))
+            return row is not None
+
+        item = cls.get_item(cart_id, product)
+        if item is None:
+            return False
+        item.delete()
+        return True
+
+    @classmethod
+    def clear(cls, cart_id):
+        """delete every item with one statement and reset the amount, returns the cart"""
+        if cls.is_native():
+            row = cls.execute(CLEAR_CART_SQL, {"cart_id": cart_id, "now": timezone.now()})
+            return Cart.from_db(connection.alias, CART_FIELDS, row)
+
+        with coalesce_cart_amount() as cart_ids:
+            cart_ids.add(cart_id)
+            CartItem.objects.filter(cart_id=cart_id).delete()
+
+        return Cart.objects.get(id=cart_id)
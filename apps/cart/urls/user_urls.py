@@ -7,6 +7,8 @@ from apps.cart.views.user_views import (
     RemoveCartItemView,
     DecreaseCartItemView,
     SetItemQuantityView,
+    CartBatchView,
+    CheckoutView,
     CartInfoListView,
     CartInfoDetailView
 )
@@ -20,6 +22,8 @@ urlpatterns = [
     path('remove/<str:product_id>/', RemoveCartItemView.as_view(), name='remove_cart'),
     path('set/<str:product_id>/', SetItemQuantityView.as_view(), name='set_item_quantity'),
     path('decrease/<str:product_id>/', DecreaseCartItemView.as_view(), name='decrease_item'),
+    path('batch/', CartBatchView.as_view(), name='cart_batch'),
+    path('checkout/', CheckoutView.as_view(), name='checkout'),
 
     path('info/list/', CartInfoListView.as_view(), name='cart_info_list'),
     path('info/detail/<str:pk>/', CartInfoDetailView.as_view(), name='cart_info_detail'),
@@ -6,13 +6,16 @@ from rest_framework.response import Response
 from apps.cart.serializer.user_serializer import (
     CartSerializer,
     CartItemSerializer,
+    CartBatchItemSerializer,
+    CheckoutSerializer,
+    CartInfoListSerializer,
     CartInfoDetailSerializer
 )
-from apps.cart.models import (
-    Cart,
-    CartInfo
-)
+from apps.cart.checkout import CheckoutService, EmptyCartError
+from apps.cart.models import CartInfo, OutOfStockError
+from apps.cart.store import get_cart_store
 from apps.product.models import Product
+from core.pagination import KeysetPagination
 
 logger = logging.getLogger(__name__)
 
@@ -22,7 +25,7 @@ class CartDetailView(views.APIView):
     serializer_class = CartSerializer
 
     def get(self, request):
-        cart = Cart.manage_items.get_cart(request.user)
+        cart = get_cart_store().get_cart_detail(request.user)
 
         serializer = CartSerializer(instance=cart)
 
@@ -48,7 +51,16 @@ class AddToCartView(views.APIView):
                 status=status.HTTP_404_NOT_FOUND
             )
 
-        item = Cart.manage_items.add(request.user, product)
+        try:
+            item = get_cart_store().add(request.user, product)
+        except OutOfStockError as e:
+            return Response(
+                data={
+                    "message": "Not enough stock",
+                    "product_ids": e.product_ids,
+                },
+                status=status.HTTP_409_CONFLICT
+            )
 
         serializer = CartItemSerializer(instance=item)
 
@@ -73,9 +85,9 @@ class DecreaseCartItemView(views.APIView):
                 status=status.HTTP_404_NOT_FOUND
             )
         try:
-            item = Cart.manage_items.decrease(request.user, product)
+            item = get_cart_store().decrease(request.user, product)
         except ValueError:
-            logger.info(f"This product don't exist in your cart. Cart id is {request.user.cart.id}")
+            logger.info(f"This product don't exist in your cart. User id is {request.user.id}")
             return Response(
                 data={
                     "message": "This product don't exist in your cart",
@@ -118,11 +130,20 @@ class SetItemQuantityView(views.APIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        item = Cart.manage_items.set(
-            request.user,
-            product=product,
-            quantity=serializer.validated_data.get('quantity'),
-        )
+        try:
+            item = get_cart_store().set(
+                request.user,
+                product=product,
+                quantity=serializer.validated_data.get('quantity'),
+            )
+        except OutOfStockError as e:
+            return Response(
+                data={
+                    "message": "Not enough stock",
+                    "product_ids": e.product_ids,
+                },
+                status=status.HTTP_409_CONFLICT
+            )
         serializer = CartItemSerializer(instance=item)
 
         return Response(
@@ -146,8 +167,8 @@ class RemoveCartItemView(views.APIView):
             )
 
         try:
-            Cart.manage_items.remove(request.user, product)
-        except ValueError as e:
+            get_cart_store().remove(request.user, product)
+        except ValueError:
             return Response(
                 data={
                     "message": "product doesn't exist in your cart",
@@ -175,7 +196,7 @@ class CartClearView(views.APIView):
         request=None
     )
     def post(self, request):
-        cart = Cart.manage_items.clear(request.user)
+        cart = get_cart_store().clear(request.user)
 
         serializer = CartSerializer(instance=cart)
 
@@ -185,12 +206,137 @@ class CartClearView(views.APIView):
         )
 
 
+class CartBatchView(views.APIView):
+    """
+    apply many cart changes in one request and one transaction
+    """
+    permission_classes = (IsAuthenticated,)
+    serializer_class = CartBatchItemSerializer
+    max_changes = 100
+
+    @extend_schema(
+        request=CartBatchItemSerializer(many=True),
+        responses={
+            status.HTTP_200_OK: CartSerializer,
+        },
+    )
+    def post(self, request):
+        serializer = CartBatchItemSerializer(
+            data=request.data,
+            many=True,
+            allow_empty=False,
+            max_length=self.max_changes,
+        )
+        serializer.is_valid(raise_exception=True)
+
+        product_ids = {change['product_id'] for change in serializer.validated_data}
+        products = Product.objects.in_bulk(product_ids)
+
+        missing = product_ids - set(products)
+        if missing:
+            logger.info('Product does not exist')
+            return Response(
+                data={
+                    "message": "Product does not exist",
+                    "product_ids": sorted(str(product_id) for product_id in missing),
+                },
+                status=status.HTTP_404_NOT_FOUND
+            )
+
+        changes = [
+            (products[change['product_id']], change['op'], change['quantity'])
+            for change in serializer.validated_data
+        ]
+
+        try:
+            cart = get_cart_store().batch(request.user, changes)
+        except OutOfStockError as e:
+            return Response(
+                data={
+                    "message": "Not enough stock",
+                    "product_ids": e.product_ids,
+                },
+                status=status.HTTP_409_CONFLICT
+            )
+        except ValueError:
+            return Response(
+                data={
+                    "message": "product doesn't exist in your cart",
+                },
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        serializer = CartSerializer(instance=cart)
+
+        return Response(
+            serializer.data,
+            status=status.HTTP_200_OK,
+        )
+
+
+class CheckoutView(views.APIView):
+    """
+    turn the cart into an order (CartInfo + Transaction) and decrement stock
+    """
+    permission_classes = (IsAuthenticated,)
+    serializer_class = CheckoutSerializer
+
+    @extend_schema(
+        request=CheckoutSerializer,
+        responses={
+            status.HTTP_201_CREATED: CartInfoDetailSerializer,
+        },
+    )
+    def post(self, request):
+        serializer = CheckoutSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        user = request.user
+        try:
+            cart_info, transaction = CheckoutService.checkout(
+                user,
+                first_name=serializer.validated_data.get('first_name') or user.first_name or '',
+                last_name=serializer.validated_data.get('last_name') or user.last_name or '',
+                mobile_number=serializer.validated_data.get('mobile_number') or user.phone or '',
+            )
+        except EmptyCartError:
+            return Response(
+                data={
+                    "message": "Your cart is empty",
+                },
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        except OutOfStockError as e:
+            logger.info(f'checkout failed, not enough stock. User id is {user.id}')
+            return Response(
+                data={
+                    "message": "Not enough stock",
+                    "product_ids": e.product_ids,
+                },
+                status=status.HTTP_409_CONFLICT
+            )
+
+        data = CartInfoDetailSerializer(instance=cart_info).data
+        data['transaction_id'] = transaction.id
+
+        return Response(
+            data,
+            status=status.HTTP_201_CREATED,
+        )
+
+
 class CartInfoListView(generics.ListAPIView):
     permission_classes = (IsAuthenticated,)
-    serializer_class = CartInfoDetailSerializer
+    serializer_class = CartInfoListSerializer
+    pagination_class = KeysetPagination
+    keyset_ordering = ('-created_at', '-id')
 
     def get_queryset(self):
-        queryset = CartInfo.objects.filter(user=self.request.user)
+        queryset = (
+            CartInfo.objects
+            .filter(user=self.request.user)
+            .only(*CartInfoListSerializer.Meta.fields)
+        )
         return queryset
 
 
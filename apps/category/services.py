@@ -1,3 +1,4 @@
+from apps.category.models import Category
 from core.cache.keys import category_detail_key, category_list_key
 from core.cache.backend import CacheBackend
 from core.cache.ttl import CacheTTL
@@ -5,31 +6,30 @@ from core.cache.ttl import CacheTTL
 
 class CategoryService:
     @staticmethod
-    def load_list_category():
+    def get_list_category(compute):
         key = category_list_key()
-        cached = CacheBackend.get(key)
-        if cached:
-            return cached
-        return False
+        return CacheBackend.get_or_compute(key, compute, CacheTTL.CATEGORY_LIST)
 
     @staticmethod
-    def load_detail_category(category_id: str):
+    def get_detail_category(category_id: str, compute):
         key = category_detail_key(category_id)
-        cached = CacheBackend.get(key)
-        if cached:
-            return cached
-        return False
+        return CacheBackend.get_or_compute(
+            key,
+            compute,
+            CacheTTL.CATEGORY_DETAIL,
+            not_found=Category.DoesNotExist,
+            not_found_ttl=CacheTTL.NOT_FOUND,
+        )
 
     @staticmethod
-    def save_list_category(data):
-        key = category_list_key()
-        result = CacheBackend.set(key, data, CacheTTL.CATEGORY_LIST)
-
-        return result
-
-    @staticmethod
-    def save_detail_category(data, category_id: str):
-        key = category_detail_key(category_id)
-        result = CacheBackend.set(key, data, CacheTTL.CATEGORY_DETAIL)
-
-        return result
+    def get_detail_categories(category_ids, compute):
+        """
+        cached details of category_ids as {id: detail}, compute(ids) -> {id: detail}
+        gets the missing ones (with one id__in query), unknown ids are left out
+        """
+        return CacheBackend.get_or_compute_many(
+            {category_id: category_detail_key(category_id) for category_id in category_ids},
+            compute,
+            CacheTTL.CATEGORY_DETAIL,
+            not_found_ttl=CacheTTL.NOT_FOUND,
+        )
@@ -4,6 +4,7 @@ from rest_framework.response import Response
 from rest_framework.views import APIView
 from apps.category.models import Category
 from apps.category.services import CategoryService
+from core.cache.rendered import RenderedJSON
 from apps.category.serializer.user_serializer import (
     CategoryDetailSerializer,
     CategoryListSerializer
@@ -15,45 +16,49 @@ class CategoryListView(APIView):
     serializer_class = CategoryListSerializer
 
     def get(self, request):
-        data = CategoryService.load_list_category()
-
-        if not data:
-            categories = Category.objects.all()
-
-            serializer = CategoryListSerializer(categories, many=True)
-            data = serializer.data
-
-            CategoryService.save_list_category(data)
+        data = CategoryService.get_list_category(self.render)
 
         return Response(
             data,
             status=status.HTTP_200_OK
         )
 
+    @staticmethod
+    def render():
+        return CategoryListSerializer(Category.objects.all(), many=True).data
+
+    @classmethod
+    def warm(cls, members=()):
+        """compute the missing category tree, the list and the detail (with sub categories) of each category"""
+        CategoryService.get_list_category(cls.render)
+        CategoryService.get_detail_categories(
+            Category.objects.values_list('id', flat=True),
+            CategoryDetailView.render_many,
+        )
+
 
 class CategoryDetailView(APIView):
     permission_classes = [IsAuthenticated]
     serializer_class = CategoryDetailSerializer
 
     def get(self, request, category_id):
-        data = CategoryService.load_detail_category(category_id)
-        if not data:
-            try:
-                category = Category.objects.get(id=category_id)
-            except Category.DoesNotExist:
-                return Response(
-                    data={
-                        "error": f"category with {category_id} does not exist"
-                    },
-                    status=status.HTTP_404_NOT_FOUND
-                )
-
-            serializer = CategoryDetailSerializer(category)
-            data = serializer.data
-
-            CategoryService.save_detail_category(data, category_id)
+        try:
+            rendered = CategoryService.get_detail_category(category_id, lambda: self.render(category_id))
+        except Category.DoesNotExist:
+            return Response(
+                data={
+                    "error": f"category with {category_id} does not exist"
+                },
+                status=status.HTTP_404_NOT_FOUND
+            )
 
-        return Response(
-            data,
-            status=status.HTTP_200_OK
-        )
+        return rendered.response(request)
+
+    @staticmethod
+    def render(category_id):
+        return RenderedJSON.render(CategoryDetailSerializer(Category.objects.get(id=category_id)).data)
+
+    @staticmethod
+    def render_many(category_ids):
+        categories = Category.objects.filter(id__in=category_ids).prefetch_related('sub_categories')
+        return {category.id: RenderedJSON.render(CategoryDetailSerializer(category).data) for category in categories}
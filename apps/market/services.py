@@ -8,34 +8,30 @@ from apps.market.serializer.market_serializer import MarketUserSerializer
 
 class MarketService:
     @staticmethod
-    def load_market_list(page=1):
+    def get_market_list(page, compute):
         key = market_list_key(page)
-        cached = CacheBackend.get(key)
-
-        if cached:
-            return cached
-
-        return False
+        return CacheBackend.get_or_compute(key, compute, CacheTTL.MARKET_LIST)
 
     @staticmethod
-    def save_market_list(data,page=1):
-        key = market_list_key(page)
-        CacheBackend.set(key, data, CacheTTL.MARKET_DETAIL)
-
-        return True
-
-    @staticmethod
-    def load_market_detail(market_id: str):
+    def get_market_detail(market_id: str, compute):
         key = market_detail_key(market_id)
-        cached = CacheBackend.get(key)
-        if cached:
-            return cached
-
-        return False
+        return CacheBackend.get_or_compute(
+            key,
+            compute,
+            CacheTTL.MARKET_DETAIL,
+            not_found=Market.DoesNotExist,
+            not_found_ttl=CacheTTL.NOT_FOUND,
+        )
 
     @staticmethod
-    def save_market_detail(data,market_id: str):
-        key = market_detail_key(market_id)
-        CacheBackend.set(key, data, CacheTTL.MARKET_DETAIL)
-
-        return True
+    def get_market_details(market_ids, compute):
+        """
+        cached details of market_ids as {id: detail}, compute(ids) -> {id: detail}
+        gets the missing ones (with one id__in query), unknown ids are left out
+        """
+        return CacheBackend.get_or_compute_many(
+            {market_id: market_detail_key(market_id) for market_id in market_ids},
+            compute,
+            CacheTTL.MARKET_DETAIL,
+            not_found_ttl=CacheTTL.NOT_FOUND,
+        )
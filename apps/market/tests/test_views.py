@@ -1,5 +1,6 @@
 from rest_framework import test, status, permissions
 from unittest.mock import patch
+from django.core.cache import cache
 from uuid import uuid4
 from apps.market.models import Market
 from django.urls import reverse
@@ -208,6 +209,8 @@ class OtherOwnerTest(BaseMarketOwnerTest):
 
 class BaseMarketUserTest(test.APITestCase):
     def setUp(self):
+        # cached pages of other tests, their markets are rolled back without an invalidation
+        cache.clear()
         self.user = User.objects.create(
             phone="09123456789"
         )
@@ -243,6 +246,16 @@ class UserListViewTest(BaseMarketUserTest):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(len(response.data['data']), 1)
 
+    def test_new_market_invalidates_cached_pages(self):
+        cache.clear()
+        self.client.get(reverse('market_user:list'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Market.objects.create(marketer=self.owner_user.marketer, name="new_market")
+        response = self.client.get(reverse('market_user:list'))
+
+        self.assertEqual(len(response.data['data']), 2)
+
 
 class UserDetailViewTest(BaseMarketUserTest):
     def test_dose_not_exist_market(self):
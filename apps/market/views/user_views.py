@@ -2,6 +2,9 @@ from django.core.paginator import Paginator, PageNotAnInteger, EmptyPage
 from rest_framework import views, status
 from rest_framework.response import Response
 from apps.market.services import MarketService
+from core.cache.hot import HotKeys
+from core.cache.keys import MARKET_LIST
+from core.cache.rendered import RenderedJSON
 from apps.market.models import Market
 from apps.market.serializer.market_serializer import (
     MarketUserSerializer
@@ -13,66 +16,70 @@ class AllMarketsView(views.APIView):
 
     def get(self, request):
         page = request.GET.get("page", 1)
-        data = MarketService.load_market_list(page)
 
-        if not data:
-            markets = Market.objects.filter(is_active=True)
-            paginator = Paginator(markets, 10)
-
-            try:
-                markets = paginator.page(page)
-            except PageNotAnInteger:
-                return Response(
-                    data={
-                        "error": "Page not an integer"
-                    },
-                    status=status.HTTP_400_BAD_REQUEST,
-                )
-            except EmptyPage:
-                return Response(
-                    data={
-                        "error": "Page is empty"
-                    },
-                    status=status.HTTP_404_NOT_FOUND,
-                )
-
-            serializer = MarketUserSerializer(markets, many=True)
-            data = {
-                "page": page,
-                "count": paginator.num_pages,
-                "data": serializer.data,
-            }
-            # save in cache
-            MarketService.save_market_list(data, page)
+        try:
+            data = MarketService.get_market_list(page, lambda: self.get_page(page))
+            HotKeys.record(MARKET_LIST, page)
+        except PageNotAnInteger:
+            return Response(
+                data={
+                    "error": "Page not an integer"
+                },
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        except EmptyPage:
+            return Response(
+                data={
+                    "error": "Page is empty"
+                },
+                status=status.HTTP_404_NOT_FOUND,
+            )
 
         return Response(
             data=data,
             status=status.HTTP_200_OK
         )
 
+    @classmethod
+    def warm(cls, pages):
+        """compute the missing pages, the first and pages"""
+        for page in dict.fromkeys([1, *pages]):
+            try:
+                MarketService.get_market_list(page, lambda: cls.get_page(page))
+            except (PageNotAnInteger, EmptyPage):
+                pass
+
+    @staticmethod
+    def get_page(page):
+        markets = Market.objects.filter(is_active=True)
+        paginator = Paginator(markets, 10)
+        markets = paginator.page(page)
+
+        serializer = MarketUserSerializer(markets, many=True)
+        return {
+            "page": page,
+            "count": paginator.num_pages,
+            "data": serializer.data,
+        }
+
 
 class MarketDetailView(views.APIView):
     serializer_class = MarketUserSerializer
 
     def get(self, request, market_id):
-        data = MarketService.load_market_detail(market_id)
-
-        if not data:
-            try:
-                market = Market.objects.get(id=market_id,is_active=True)
-            except Market.DoesNotExist:
-                return Response(
-                    data={
-                        "message": "Market does not exist"
-                    },
-                    status=status.HTTP_404_NOT_FOUND,
-                )
+        try:
+            rendered = MarketService.get_market_detail(
+                market_id,
+                lambda: RenderedJSON.render(
+                    MarketUserSerializer(instance=Market.objects.get(id=market_id, is_active=True)).data
+                ),
+            )
+        except Market.DoesNotExist:
+            return Response(
+                data={
+                    "message": "Market does not exist"
+                },
+                status=status.HTTP_404_NOT_FOUND,
+            )
 
-            serializer = MarketUserSerializer(instance=market)
-            data = serializer.data
-            MarketService.save_market_detail(data,market_id)
-
-        return Response(
-            data,
-            status=status.HTTP_200_OK,
-        )
+        return rendered.response(request)
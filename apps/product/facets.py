@@ -0,0 +1,95 @@
+from django.db.models import Case, Count, IntegerField, Value, When
+
+# (min, max) ranges, max is exclusive and None means unbounded
+SCORE_BANDS = ((1, 2), (2, 3), (3, 4), (4, None))
+PRICE_BUCKETS = (
+    (0, 100_000),
+    (100_000, 500_000),
+    (500_000, 1_000_000),
+    (1_000_000, 5_000_000),
+    (5_000_000, None),
+)
+
+
+def band(field, ranges):
+    """index of the range each row falls in, null when it is in none"""
+    whens = []
+    for index, (low, high) in enumerate(ranges):
+        lookup = {f"{field}__gte": low}
+        if high is not None:
+            lookup[f"{field}__lt"] = high
+        whens.append(When(**lookup, then=Value(index)))
+    return Case(*whens, default=None, output_field=IntegerField())
+
+
+class ProductFacets:
+    """
+    Counts of a filtered product queryset per category, market, score band
+    and price bucket.
+
+    All four come from one GROUP BY over (category, market, score band,
+    price bucket), the rows are folded into each facet here.
+    """
+
+    @staticmethod
+    def rows(queryset):
+        return (
+            queryset
+            .order_by()
+            .annotate(score_band=band('score', SCORE_BANDS), price_bucket=band('price', PRICE_BUCKETS))
+            .values(
+                'category_id',
+                'category__title',
+                'market_id',
+                'market__name',
+                'score_band',
+                'price_bucket',
+            )
+            .annotate(count=Count('id'))
+        )
+
+    @staticmethod
+    def ranges(counts, ranges):
+        return [
+            {"min": low, "max": high, "count": counts.get(index, 0)}
+            for index, (low, high) in enumerate(ranges)
+        ]
+
+    @classmethod
+    def count(cls, queryset):
+        total = 0
+        categories = {}
+        markets = {}
+        scores = {}
+        prices = {}
+
+        for row in cls.rows(queryset):
+            count = row['count']
+            total += count
+
+            if row['category_id'] is not None:
+                category = categories.setdefault(
+                    row['category_id'],
+                    {"id": str(row['category_id']), "title": row['category__title'], "count": 0},
+                )
+                category['count'] += count
+
+            market = markets.setdefault(
+                row['market_id'],
+                {"id": str(row['market_id']), "name": row['market__name'], "count": 0},
+            )
+            market['count'] += count
+
+            if row['score_band'] is not None:
+                scores[row['score_band']] = scores.get(row['score_band'], 0) + count
+            if row['price_bucket'] is not None:
+                prices[row['price_bucket']] = prices.get(row['price_bucket'], 0) + count
+
+        by_count = lambda facet: (-facet['count'], facet['id'])
+        return {
+            "count": total,
+            "category": sorted(categories.values(), key=by_count),
+            "market": sorted(markets.values(), key=by_count),
+            "score": cls.ranges(scores, SCORE_BANDS),
+            "price": cls.ranges(prices, PRICE_BUCKETS),
+        }
@@ -1,7 +1,10 @@
+import math
+from django.http import QueryDict
 from django_filters import FilterSet
 import django_filters
 
 from apps.product.models import Product
+from apps.product.search import ProductSearch
 
 
 class ProductFilter(FilterSet):
@@ -11,6 +14,7 @@ class ProductFilter(FilterSet):
     min_price = django_filters.NumberFilter(field_name='price', lookup_expr='gte')
     market_name = django_filters.CharFilter(field_name='market__name', lookup_expr='icontains')
     min_score = django_filters.NumberFilter(field_name='score', lookup_expr='gte')
+    q = django_filters.CharFilter(method='search', label='search')
 
 
     class Meta:
@@ -18,3 +22,76 @@ class ProductFilter(FilterSet):
         fields = {
             'category': ['exact'],
         }
+
+    # in the cache key of the product list range bounds are snapped to a coarse
+    # grid (widening the range), so close values share one cached bucket:
+    # min_price=12345 reads the bucket of min_price=12000, then the exact bounds
+    # are applied to its products (in_range)
+    RANGE_BOUNDS = {
+        'min_price': 'floor',
+        'max_price': 'ceil',
+        'min_score': 'floor',
+    }
+
+    def __init__(self, data=None, *args, **kwargs):
+        if data is not None:
+            data = self.canonical(data)
+        super().__init__(data, *args, **kwargs)
+
+    @staticmethod
+    def snap(name, value, rounding):
+        round_ = math.floor if rounding == 'floor' else math.ceil
+        if name == 'min_score':
+            # half stars
+            return round_(value * 2) / 2
+        # two significant digits
+        step = 10 ** max(len(str(int(abs(value)))) - 2, 0)
+        return round_(value / step) * step
+
+    @classmethod
+    def canonical(cls, params, snap=False):
+        """
+        the known filters of params with stripped values, and snapped ranges with snap,
+        invalid values are kept for the form to reject them
+        """
+        data = QueryDict(mutable=True)
+        for name in cls.base_filters:
+            values = [value.strip() for value in params.getlist(name) if value.strip()]
+            if snap and name in cls.RANGE_BOUNDS:
+                values = [cls.snap_value(name, value) for value in values]
+            if values:
+                data.setlist(name, values)
+        return data
+
+    @classmethod
+    def snap_value(cls, name, value):
+        try:
+            number = float(value)
+        except ValueError:
+            return value
+        if not math.isfinite(number):
+            return value
+        snapped = cls.snap(name, number, cls.RANGE_BOUNDS[name])
+        return f"{snapped:g}" if name == 'min_score' else str(int(snapped))
+
+    @classmethod
+    def ranges(cls, params):
+        """the exact range bounds of params as {name: number}, invalid ones are left out"""
+        ranges = {}
+        for name in cls.RANGE_BOUNDS:
+            try:
+                number = float(params.get(name, '').strip())
+            except ValueError:
+                continue
+            if math.isfinite(number):
+                ranges[name] = number
+        return ranges
+
+    @staticmethod
+    def in_range(price, score, ranges):
+        if 'min_score' in ranges and (score is None or score < ranges['min_score']):
+            return False
+        return ranges.get('min_price', -math.inf) <= price <= ranges.get('max_price', math.inf)
+
+    def search(self, queryset, name, value):
+        return ProductSearch.search(queryset, value)
@@ -0,0 +1,140 @@
+import pickle
+import random
+import time
+import uuid
+from datetime import datetime, timezone
+from django.core.management.base import BaseCommand
+from django_redis import get_redis_connection
+
+from apps.product.models import Product
+from apps.product.serializer.common_seializer import ProductDetailSerializer
+from core.cache import codecs
+
+KEY_PREFIX = "benchmark:codec"
+
+
+class Command(BaseCommand):
+    help = "Compare size and speed of the cache codecs (core/cache/codecs.py) with pickle on product detail payloads."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--count", type=int, default=200, help="number of payloads")
+        parser.add_argument("--from-db", action="store_true", help="serialize products of the database")
+        parser.add_argument("--images", type=int, default=6)
+        parser.add_argument("--features", type=int, default=15)
+        parser.add_argument("--comments", type=int, default=30)
+        parser.add_argument("--repeat", type=int, default=3)
+
+    def handle(self, *args, **options):
+        payloads = self.payloads(options)
+        self.stdout.write(f"{len(payloads)} product detail payloads")
+
+        # pickle without compression is what django_redis stores by default
+        candidates = [("pickle (django_redis default)", None)]
+        names = ["pickle", "json"] + (["msgpack"] if codecs.msgpack is not None else [])
+        for name in names:
+            candidates.append((f"{name}", codecs.Payload(name, compress_min_size=float("inf"))))
+            candidates.append((f"{name} + zlib", codecs.Payload(name)))
+        if codecs.msgpack is None:
+            self.stdout.write("msgpack is not installed, skipped")
+
+        redis = get_redis_connection("default")
+        header = f"{'codec':<30} {'avg bytes':>10} {'redis bytes':>12} {'encode us':>10} {'decode us':>10} {'set+get ms':>11}"
+        self.stdout.write(header)
+        for label, payload in candidates:
+            encode = (lambda value: pickle.dumps(value, pickle.HIGHEST_PROTOCOL)) if payload is None else (
+                lambda value, payload=payload: payload.encode(value)[0]
+            )
+            decode = pickle.loads if payload is None else codecs.Payload.decode
+
+            encoded, encode_time = self.measure(lambda: [encode(value) for value in payloads], options["repeat"])
+            _, decode_time = self.measure(lambda: [decode(data) for data in encoded], options["repeat"])
+            memory, round_trip = self.redis(redis, encoded, options["repeat"])
+
+            self.stdout.write(
+                f"{label:<30} {sum(map(len, encoded)) / len(encoded):>10.0f} {memory:>12.0f} "
+                f"{encode_time / len(payloads) * 1e6:>10.1f} {decode_time / len(payloads) * 1e6:>10.1f} "
+                f"{round_trip * 1000:>11.1f}"
+            )
+
+    @staticmethod
+    def measure(function, repeat):
+        """result and the best time of repeat runs"""
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = function()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return result, best
+
+    def redis(self, redis, encoded, repeat):
+        """average redis memory per key (len when MEMORY USAGE isn't supported) and the time to set and get all"""
+        keys = [f"{KEY_PREFIX}:{i}" for i in range(len(encoded))]
+
+        def round_trip():
+            for key, data in zip(keys, encoded):
+                redis.set(key, data)
+            for key in keys:
+                redis.get(key)
+
+        try:
+            _, elapsed = self.measure(round_trip, repeat)
+            try:
+                memory = sum(redis.memory_usage(key) for key in keys) / len(keys)
+            except Exception:
+                # servers without MEMORY USAGE may drop the connection
+                redis.connection_pool.disconnect()
+                memory = sum(map(len, encoded)) / len(encoded)
+        finally:
+            redis.delete(*keys)
+        return memory, elapsed
+
+    def payloads(self, options):
+        if options["from_db"]:
+            products = (
+                Product.objects
+                .select_related('category__category')
+                .prefetch_related('images', 'features')[:options["count"]]
+            )
+            return [dict(ProductDetailSerializer(product).data) for product in products]
+        return [self.synthetic(options) for _ in range(options["count"])]
+
+    @staticmethod
+    def synthetic(options):
+        """the shape of ProductDetailSerializer data"""
+        now = datetime.now(timezone.utc).isoformat()
+        words = "leather wireless galaxy cotton steel glass wooden compact portable classic".split()
+        text = lambda count: " ".join(random.choices(words, k=count))
+        price = random.randint(1, 1000) * 1000
+        return {
+            "id": str(uuid.uuid4()),
+            "name": text(4),
+            "price": price,
+            "discount_price": price,
+            "percentage_off": 0,
+            "description": text(150),
+            "images": [
+                {"title": text(2), "url": f"/media/market/product/{uuid.uuid4().hex}.jpg", "id": i}
+                for i in range(options["images"])
+            ],
+            "features": [
+                {"key": f"{text(1)} {i}", "value": text(3), "id": i}
+                for i in range(options["features"])
+            ],
+            "comments": [
+                {
+                    "id": str(uuid.uuid4()),
+                    "content": text(40),
+                    "score": float(random.randint(1, 5)),
+                    "images": [],
+                    "created_at": now,
+                    "updated_at": now,
+                }
+                for _ in range(options["comments"])
+            ],
+            "stock": random.randint(0, 100),
+            "main_category": text(1),
+            "main_category_id": uuid.uuid4(),
+            "category": text(1),
+            "category_id": uuid.uuid4(),
+        }
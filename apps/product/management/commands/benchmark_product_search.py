@@ -0,0 +1,109 @@
+import random
+import time
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Q
+
+from apps.market.models import Market
+from apps.product.models import Product
+from apps.product.search import ProductSearch
+from apps.user.models import User, Marketer
+
+WORDS = (
+    "galaxy phone case leather book python django laptop screen keyboard mouse "
+    "charger cable wireless headphone speaker camera lens watch shoe shirt bag "
+    "coffee tea cup glass lamp chair desk table pen notebook"
+).split()
+
+# model names like "galaxy42" keep terms selective, as in a real catalog
+VOCABULARY = [f"{word}{number}" for word in WORDS for number in range(100)]
+
+BENCHMARK_PHONE = "09999999999"
+
+
+class Command(BaseCommand):
+    help = "Compare product search (full text) with the icontains fallback, optionally on a seeded catalog."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--seed", type=int, default=0, help="number of products to create first")
+        parser.add_argument("--chunk-size", type=int, default=10_000)
+        parser.add_argument("--repeat", type=int, default=5)
+        parser.add_argument("--terms", nargs="+", default=["galaxy7", "leather42 case3", "wireless1"])
+        parser.add_argument("--clean", action="store_true", help="delete seeded products and exit")
+
+    def handle(self, *args, **options):
+        if options["clean"]:
+            deleted, _ = Product.objects.filter(market__marketer__user__phone=BENCHMARK_PHONE).delete()
+            self.stdout.write(f"{deleted} rows deleted")
+            return
+
+        if options["seed"]:
+            self.seed(options["seed"], options["chunk_size"])
+
+        self.stdout.write(f"{Product.objects.count()} products, database is {connection.vendor}")
+
+        for term in options["terms"]:
+            search = self.measure(lambda: ProductSearch.search(Product.objects.all(), term), options["repeat"])
+            fallback = self.measure(
+                lambda: Product.objects.filter(
+                    Q(name__icontains=term)
+                    | Q(description__icontains=term)
+                    | Q(market__name__icontains=term)
+                ),
+                options["repeat"],
+            )
+            self.stdout.write(f"{term!r}: search {search:.1f} ms, icontains {fallback:.1f} ms")
+
+    @staticmethod
+    def measure(make_queryset, repeat):
+        """average ms of fetching the first page"""
+        elapsed = 0
+        for _ in range(repeat):
+            start = time.perf_counter()
+            list(make_queryset().values_list('id', flat=True)[:20])
+            elapsed += time.perf_counter() - start
+        return elapsed / repeat * 1000
+
+    @staticmethod
+    def product(markets):
+        price = random.randint(1, 1000) * 1000
+        return Product(
+            market=random.choice(markets),
+            name=" ".join(random.sample(VOCABULARY, 3)),
+            description=" ".join(random.choices(VOCABULARY, k=20)),
+            price=price,
+            discount_price=price,
+            stock=random.randint(0, 100),
+        )
+
+    def seed(self, count, chunk_size):
+        user, _ = User.objects.get_or_create(phone=BENCHMARK_PHONE)
+        marketer, _ = Marketer.objects.get_or_create(
+            user=user,
+            defaults={
+                "age": 30,
+                "national_code": "0000000000",
+                "city": "city",
+                "province": "province",
+                "address": "address",
+            },
+        )
+        markets = [
+            Market.objects.get_or_create(marketer=marketer, name=f"Benchmark {word} store")[0]
+            for word in WORDS[:10]
+        ]
+
+        created = 0
+        while created < count:
+            size = min(chunk_size, count - created)
+            with transaction.atomic():
+                products = Product.objects.bulk_create([
+                    self.product(markets) for _ in range(size)
+                ])
+                # bulk_create doesn't send signals
+                ProductSearch.update_vectors(Product.objects.filter(id__in=[product.id for product in products]))
+            created += size
+            self.stdout.write(f"{created}/{count} products seeded")
+
+        with connection.cursor() as cursor:
+            cursor.execute(f"ANALYZE {Product._meta.db_table}")
@@ -0,0 +1,27 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core.cache import warming
+
+
+class Command(BaseCommand):
+    help = "Compute the missing cache entries of the most read keys (see settings.CACHE_WARMING), e.g. after a deploy."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--namespace",
+            action="append",
+            dest="namespaces",
+            help="namespace to warm, can be repeated, all by default",
+        )
+        parser.add_argument("--top", type=int, default=None, help="number of hot keys of each namespace")
+
+    def handle(self, *args, **options):
+        namespaces = options["namespaces"]
+        unknown = set(namespaces or ()) - set(settings.CACHE_WARMING["WARMERS"])
+        if unknown:
+            raise CommandError(f"no warmer for {', '.join(sorted(unknown))}")
+
+        warmed = warming.warm(namespaces, options["top"])
+        for namespace, count in warmed.items():
+            self.stdout.write(f"{namespace}: {count} hot keys")
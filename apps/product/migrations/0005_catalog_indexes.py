@@ -0,0 +1,23 @@
+# Generated by Django 5.2.10 on 2026-10-18 09:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('category', '0003_alter_category_options_alter_subcategory_options'),
+        ('market', '0006_market_score'),
+        ('product', '0004_product_category'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['-created_at', '-id'], name='product_created_at_id_index'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['price', 'id'], name='product_price_id_index'),
+        ),
+    ]
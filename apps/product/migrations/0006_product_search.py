@@ -0,0 +1,63 @@
+# Generated by Django 5.2.10 on 2026-10-18 09:15
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+# the search indexes only exist on postgresql, other databases search with icontains
+# (apps/product/search.py), so they are created here instead of Product.Meta.indexes
+
+
+def create_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+
+    schema_editor.execute(
+        "CREATE INDEX IF NOT EXISTS product_search_vector_index "
+        "ON product_product USING gin (search_vector)"
+    )
+
+    # pg_trgm is optional, without it search has no typo tolerance
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")
+        has_trigram = cursor.fetchone() is not None
+    if has_trigram:
+        schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        schema_editor.execute(
+            "CREATE INDEX IF NOT EXISTS product_name_trigram_index "
+            "ON product_product USING gin (name gin_trgm_ops)"
+        )
+
+    schema_editor.execute(
+        """
+        UPDATE product_product AS p SET search_vector =
+            setweight(to_tsvector('simple', coalesce(p.name, '')), 'A')
+            || setweight(to_tsvector('simple', coalesce(m.name, '')), 'B')
+            || setweight(to_tsvector('simple', coalesce(p.description, '')), 'C')
+        FROM market_market AS m
+        WHERE m.id = p.market_id
+        """
+    )
+
+
+def drop_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+
+    schema_editor.execute("DROP INDEX IF EXISTS product_search_vector_index")
+    schema_editor.execute("DROP INDEX IF EXISTS product_name_trigram_index")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0005_catalog_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
@@ -1,3 +1,4 @@
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
 from apps.market.models import Market
 from base.base_models import BaseModel
@@ -66,6 +67,12 @@ class Product(BaseModel):
         verbose_name=_("Score"),
     )
 
+    # name, market name and description, kept by signals (apps/product/search.py)
+    search_vector = SearchVectorField(
+        null=True,
+        editable=False,
+    )
+
     def __str__(self):
         return self.name
 
@@ -74,7 +81,10 @@ class Product(BaseModel):
             'name'
         ]
         indexes = BaseModel.Meta.indexes + [
-            models.Index(fields=['name'])
+            models.Index(fields=['name']),
+            # keys of the cursor paginated catalog (ProductCatalogView)
+            models.Index(fields=['-created_at', '-id'], name='product_created_at_id_index'),
+            models.Index(fields=['price', 'id'], name='product_price_id_index'),
         ]
     
     def save(self, *args, **kwargs):
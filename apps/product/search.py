@@ -0,0 +1,86 @@
+import logging
+from django.contrib.postgres.search import (
+    SearchQuery,
+    SearchRank,
+    SearchVector,
+    TrigramSimilarity,
+)
+from django.db import connection
+from django.db.models import F, OuterRef, Q, Subquery
+
+from apps.market.models import Market
+
+logger = logging.getLogger(__name__)
+
+# 'simple' doesn't stem words, names are persian and english
+SEARCH_CONFIG = "simple"
+
+
+class ProductSearch:
+    """
+    Product search for ?q=.
+
+    On postgresql products match by full text (Product.search_vector, a GIN
+    indexed tsvector of name, market name and description) and, when the
+    pg_trgm extension is installed, by trigram similarity of the name
+    (so typos still match).
+    Results are ordered by relevance. Other databases fall back to icontains.
+    """
+
+    _has_trigram = None
+
+    @staticmethod
+    def is_native():
+        return connection.vendor == "postgresql"
+
+    @classmethod
+    def has_trigram(cls):
+        if cls._has_trigram is None:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+                cls._has_trigram = cursor.fetchone() is not None
+        return cls._has_trigram
+
+    @staticmethod
+    def vector():
+        """search_vector of a product row, usable in Product.objects.update"""
+        market_name = Subquery(Market.objects.filter(id=OuterRef('market_id')).values('name')[:1])
+        return (
+            SearchVector('name', weight='A', config=SEARCH_CONFIG)
+            + SearchVector(market_name, weight='B', config=SEARCH_CONFIG)
+            + SearchVector('description', weight='C', config=SEARCH_CONFIG)
+        )
+
+    @classmethod
+    def update_vectors(cls, queryset):
+        if cls.is_native():
+            queryset.update(search_vector=cls.vector())
+
+    @classmethod
+    def search(cls, queryset, text):
+        text = text.strip()
+        if not text:
+            return queryset
+
+        if not cls.is_native():
+            return queryset.filter(
+                Q(name__icontains=text)
+                | Q(description__icontains=text)
+                | Q(market__name__icontains=text)
+            )
+
+        query = SearchQuery(text, search_type='websearch', config=SEARCH_CONFIG)
+        condition = Q(search_vector=query)
+        rank = SearchRank(F('search_vector'), query)
+
+        if cls.has_trigram():
+            condition |= Q(name__trigram_similar=text)
+            rank = rank + TrigramSimilarity('name', text)
+
+        ordering = queryset.query.order_by or queryset.model._meta.ordering
+        return (
+            queryset
+            .filter(condition)
+            .alias(rank=rank)
+            .order_by('-rank', *ordering)
+        )
@@ -70,7 +70,10 @@ class ProductDetailSerializer(serializers.ModelSerializer):
         read_only_fields = ['id']
 
     def get_comments(self, obj):
-        comments = Comment.published.filter(product_id=obj.id)
+        # prefetched by ProductDetailsView, queried per product otherwise
+        comments = getattr(obj, 'published_comments', None)
+        if comments is None:
+            comments = Comment.published.filter(product_id=obj.id)
         serializer = CommentSerializer(comments, many=True, read_only=True)
         return serializer.data
 
@@ -26,9 +26,12 @@ class ProductSimpleSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ['id']
 
-    # show just first image
+    # show just first image, ProductListView prefetches it as first_images
     def get_image(self, image_object):
-        image = image_object.images.first()
+        if hasattr(image_object, 'first_images'):
+            image = next(iter(image_object.first_images), None)
+        else:
+            image = image_object.images.order_by('id').first()
         if not image:
             return None
         return ProductImageSerializer(image).data
@@ -1,37 +1,40 @@
+from apps.product.models import Product
 from core.cache.backend import CacheBackend
-from core.cache.keys import product_list_key, product_detail_key
+from core.cache.keys import product_list_key, product_detail_key, product_facets_key
 from core.cache.ttl import CacheTTL
 
 
 class ProductService:
     @staticmethod
-    def load_product_list(page=1,query=""):
-        key = product_list_key(page,query)
-        cached = CacheBackend.get(key)
-        if cached:
-            return cached
-
-        return False
+    def get_product_list(query: str, compute):
+        key = product_list_key(query)
+        return CacheBackend.get_or_compute(key, compute, CacheTTL.PRODUCT_LIST)
 
     @staticmethod
-    def save_product_list(data, page,query=""):
-        key = product_list_key(page,query)
-        CacheBackend.set(key, data, CacheTTL.PRODUCT_LIST)
-
-        return True
+    def get_product_facets(query: str, compute):
+        key = product_facets_key(query)
+        return CacheBackend.get_or_compute(key, compute, CacheTTL.PRODUCT_FACETS)
 
     @staticmethod
-    def load_product_detail(product_id: str):
+    def get_product_detail(product_id: str, compute):
         key = product_detail_key(product_id)
-        cached = CacheBackend.get(key)
-        if cached:
-            return cached
-
-        return False
+        return CacheBackend.get_or_compute(
+            key,
+            compute,
+            CacheTTL.PRODUCT_DETAIL,
+            not_found=Product.DoesNotExist,
+            not_found_ttl=CacheTTL.NOT_FOUND,
+        )
 
     @staticmethod
-    def save_product_detail(data, product_id):
-        key = product_detail_key(product_id)
-        CacheBackend.set(key, data, CacheTTL.PRODUCT_DETAIL)
-
-        return True
+    def get_product_details(product_ids, compute):
+        """
+        cached details of product_ids as {id: detail}, compute(ids) -> {id: detail}
+        gets the missing ones (with one id__in query), unknown ids are left out
+        """
+        return CacheBackend.get_or_compute_many(
+            {product_id: product_detail_key(product_id) for product_id in product_ids},
+            compute,
+            CacheTTL.PRODUCT_DETAIL,
+            not_found_ttl=CacheTTL.NOT_FOUND,
+        )
@@ -1,11 +1,64 @@
-from django.db.models.signals import post_save, pre_delete
+from django.db.models.signals import pre_save, post_save, pre_delete
 from django.dispatch import receiver
 
+from apps.market.models import Market
 from apps.product.models import Product
-from core.cache.invalidation import invalidate_product_list,invalidate_product_detail
+from apps.product.search import ProductSearch
+from core.cache.invalidation import (
+    invalidate_product_list,
+    invalidate_product_detail,
+    invalidate_product_facets,
+)
 
 
 @receiver([post_save,pre_delete], sender=Product)
 def invalidate_cache_product(sender, instance, **kwargs):
     invalidate_product_list()
-    invalidate_product_detail(instance.id)
\ No newline at end of file
+    invalidate_product_detail(instance.id)
+    invalidate_product_facets()
+
+
+SEARCH_FIELDS = ('name', 'description', 'market_id')
+
+
+def search_fields(instance):
+    return tuple(
+        Product._meta.get_field(name).to_python(getattr(instance, name))
+        for name in SEARCH_FIELDS
+    )
+
+
+def search_may_change(instance, update_fields):
+    if instance._state.adding or not ProductSearch.is_native():
+        return False
+    return update_fields is None or bool({*SEARCH_FIELDS, 'market'} & set(update_fields))
+
+
+@receiver(pre_save, sender=Product)
+def remember_search_fields(sender, instance, update_fields=None, **kwargs):
+    instance._stored_search_fields = None
+    if not search_may_change(instance, update_fields):
+        return
+
+    instance._stored_search_fields = (
+        Product.objects
+        .filter(pk=instance.pk)
+        .values_list(*SEARCH_FIELDS)
+        .first()
+    )
+
+
+@receiver(post_save, sender=Product)
+def update_search_vector_product(sender, instance, created, **kwargs):
+    stored = getattr(instance, '_stored_search_fields', None)
+    # e.g. a price or stock change keeps the vector
+    if not created and (stored is None or stored == search_fields(instance)):
+        return
+    ProductSearch.update_vectors(Product.objects.filter(id=instance.id))
+
+
+@receiver(post_save, sender=Market)
+def update_search_vector_market(sender, instance, created, update_fields=None, **kwargs):
+    if created or (update_fields and 'name' not in update_fields):
+        return
+    ProductSearch.update_vectors(Product.objects.filter(market_id=instance.id))
@@ -0,0 +1,374 @@
+import gzip
+import time
+from io import StringIO
+from unittest.mock import patch
+from uuid import uuid4
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django_redis import get_redis_connection
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from apps.category.models import Category, SubCategory
+from apps.category.services import CategoryService
+from apps.category.views.user_view import CategoryListView
+from apps.market.models import Market
+from apps.market.serializer.market_serializer import MarketUserSerializer
+from apps.market.services import MarketService
+from apps.product.models import Product
+from apps.user.models import User, Marketer
+from core.cache import warming
+from core.cache.backend import CacheBackend
+from core.cache.hot import HotKeys
+from core.cache.local import LocalCache, InvalidationListener
+from core.cache.metrics import CacheMetrics
+from core.cache.rendered import RenderedJSON
+
+LOCAL_ENABLED = {**settings.CACHE_LOCAL, 'ENABLED': True}
+
+
+@override_settings(CACHE_LOCAL=LOCAL_ENABLED)
+class TwoTierCacheTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(phone="09909998877", password="password123")
+        Marketer.objects.create(
+            user=cls.user,
+            age=20,
+            national_code="1234567890",
+            city="city",
+            province="province",
+            address="address",
+        )
+        cls.market = Market.objects.create(marketer=cls.user.marketer, name="TestMarket")
+
+    def setUp(self):
+        cache.clear()
+        CacheBackend.local().clear()
+        CacheMetrics.reset("product:detail")
+        self.client.force_authenticate(user=self.user)
+        self.product = Product.objects.create(
+            market=self.market,
+            category=SubCategory.objects.first(),
+            name="Product",
+            price=1000,
+            stock=5,
+        )
+        self.url = reverse('product_user:product_detail', args=[self.product.id])
+
+    def test_hit_is_served_from_local_cache(self):
+        self.client.get(self.url)
+        # a hit doesn't reach redis (nor the database)
+        get_redis_connection("default").flushdb()
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['name'], "Product")
+        self.assertEqual(len(queries), 0)
+
+    def test_hit_rates(self):
+        self.client.get(self.url)
+        self.client.get(self.url)
+        CacheBackend.local().clear()
+        self.client.get(self.url)
+
+        stats = CacheMetrics.stats("product:detail")
+
+        self.assertEqual((stats['l1_hit'], stats['l2_hit'], stats['miss']), (1, 1, 1))
+
+    def test_invalidation_evicts_local_cache(self):
+        self.client.get(self.url)
+
+        self.product.name = "Renamed"
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.save()
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.json()['name'], "Renamed")
+
+    def test_invalidation_reaches_other_processes(self):
+        redis = get_redis_connection("default")
+        subscribers = lambda: redis.pubsub_numsub(CacheBackend.INVALIDATION_CHANNEL)[0][1]
+        before = subscribers()
+        other = LocalCache(max_entries=10, max_bytes=10_000, ttl=60)
+        InvalidationListener(other, CacheBackend.listener_connection(), CacheBackend.INVALIDATION_CHANNEL).start()
+        # wait for the subscription
+        deadline = time.monotonic() + 5
+        while subscribers() == before:
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.01)
+        other.set(f"product:detail:{self.product.id}", {"name": "Product"})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.save()
+
+        while other.get(f"product:detail:{self.product.id}") is not None:
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.01)
+
+
+class NotFoundCacheTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(phone="09909998877", password="password123")
+        self.client.force_authenticate(user=self.user)
+
+    def test_unknown_product_is_not_queried_again(self):
+        url = reverse('product_user:product_detail', args=[uuid4()])
+        self.client.get(url)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(len(queries), 0)
+
+    def test_unknown_category_is_not_queried_again(self):
+        url = reverse('category_user:detail', args=[uuid4()])
+        self.client.get(url)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(len(queries), 0)
+
+    def test_activated_market_is_found(self):
+        Marketer.objects.create(
+            user=self.user,
+            age=20,
+            national_code="1234567890",
+            city="city",
+            province="province",
+            address="address",
+        )
+        market = Market.objects.create(marketer=self.user.marketer, name="TestMarket", is_active=False)
+        url = reverse('market_user:detail', args=[market.id])
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_404_NOT_FOUND)
+
+        market.is_active = True
+        with self.captureOnCommitCallbacks(execute=True):
+            market.save()
+
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK)
+
+
+class RenderedJSONTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(phone="09909998877", password="password123")
+        Marketer.objects.create(
+            user=self.user,
+            age=20,
+            national_code="1234567890",
+            city="city",
+            province="province",
+            address="address",
+        )
+        self.client.force_authenticate(user=self.user)
+        self.market = Market.objects.create(marketer=self.user.marketer, name="TestMarket")
+        self.product = Product.objects.create(
+            market=self.market,
+            category=SubCategory.objects.first(),
+            name="Product",
+            description="x" * 2000,
+            price=1000,
+            stock=5,
+        )
+        self.url = reverse('product_user:product_detail', args=[self.product.id])
+
+    def test_hit_is_served_from_rendered_bytes(self):
+        first = self.client.get(self.url)
+
+        with patch("apps.product.views.user_views.ProductDetailSerializer") as serializer:
+            second = self.client.get(self.url)
+
+        serializer.assert_not_called()
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second.json()['name'], "Product")
+        self.assertEqual(second['ETag'], first['ETag'])
+
+    def test_not_modified(self):
+        etag = self.client.get(self.url)['ETag']
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response.content, b"")
+
+    def test_changed_product_has_new_etag(self):
+        etag = self.client.get(self.url)['ETag']
+
+        self.product.name = "Renamed"
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_large_body_is_sent_gzipped(self):
+        plain = self.client.get(self.url)
+        compressed = self.client.get(self.url, HTTP_ACCEPT_ENCODING="gzip, br")
+
+        self.assertEqual(compressed['Content-Encoding'], "gzip")
+        self.assertLess(len(compressed.content), len(plain.content))
+        self.assertEqual(gzip.decompress(compressed.content), plain.content)
+        self.assertFalse(plain.has_header('Content-Encoding'))
+
+    def test_small_body_is_not_compressed(self):
+        rendered = RenderedJSON.render({"id": 1})
+
+        self.assertFalse(rendered.compressed)
+        self.assertEqual(rendered.content, b'{"id":1}')
+
+    def test_market_and_category_details(self):
+        for url in (
+            reverse('market_user:detail', args=[self.market.id]),
+            reverse('category_user:detail', args=[SubCategory.objects.first().category_id]),
+        ):
+            response = self.client.get(url)
+            etag = response['ETag']
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_304_NOT_MODIFIED)
+
+
+@override_settings(CACHE_WARMING={**settings.CACHE_WARMING, 'ENABLED': True})
+class WarmingTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(phone="09909998877", password="password123")
+        Marketer.objects.create(
+            user=cls.user,
+            age=20,
+            national_code="1234567890",
+            city="city",
+            province="province",
+            address="address",
+        )
+        cls.market = Market.objects.create(marketer=cls.user.marketer, name="TestMarket")
+
+    def setUp(self):
+        self.client.force_authenticate(user=self.user)
+        self.product = Product.objects.create(
+            market=self.market,
+            category=SubCategory.objects.first(),
+            name="Product",
+            price=12_050,
+            stock=5,
+        )
+        # also the pending warming scheduled by the product
+        cache.clear()
+        HotKeys.flush()
+        get_redis_connection("default").delete(*(HotKeys.key(namespace) for namespace in settings.CACHE_WARMING["WARMERS"]))
+
+    def assert_served_from_cache(self, url, params=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(queries), 0)
+
+    def test_hot_pages_are_recomputed_after_invalidation(self):
+        list_url = reverse('product_user:product_list')
+        detail_url = reverse('product_user:product_detail', args=[self.product.id])
+        self.client.get(list_url, {'min_price': 12_345})
+        self.client.get(detail_url)
+
+        with patch("core.cache.warming.send"), self.captureOnCommitCallbacks(execute=True):
+            Product.objects.create(market=self.market, name="Other", price=1000, stock=1)
+        warming.warm()
+
+        self.assert_served_from_cache(list_url)
+        self.assert_served_from_cache(list_url, {'min_price': 12_000})
+        self.assert_served_from_cache(detail_url)
+        self.assert_served_from_cache(reverse('market_user:list'))
+        self.assert_served_from_cache(reverse('category_user:list'))
+
+    def test_warming_skips_cached_entries(self):
+        warming.warm(["product:list"])
+
+        with CaptureQueriesContext(connection) as queries:
+            warming.warm(["product:list"])
+
+        self.assertEqual(len(queries), 0)
+
+    def test_invalidations_are_coalesced(self):
+        with patch("core.cache.warming.send") as send, self.captureOnCommitCallbacks(execute=True):
+            for price in (1000, 2000, 3000):
+                Product.objects.create(market=self.market, name="Other", price=price, stock=1)
+
+        namespaces = [call.args[0] for call in send.call_args_list]
+        self.assertEqual(namespaces.count("product:list"), 1)
+
+    def test_command(self):
+        out = StringIO()
+        call_command("warm_cache", "--namespace", "product:list", "--top", "5", stdout=out)
+
+        self.assertIn("product:list", out.getvalue())
+        self.assert_served_from_cache(reverse('product_user:product_list'))
+
+
+class MultiGetServiceTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(phone="09909998877", password="password123")
+        Marketer.objects.create(
+            user=self.user,
+            age=20,
+            national_code="1234567890",
+            city="city",
+            province="province",
+            address="address",
+        )
+        self.markets = [
+            Market.objects.create(marketer=self.user.marketer, name=f"Market {i}", is_active=True)
+            for i in range(3)
+        ]
+        self.client.force_authenticate(user=self.user)
+
+    def test_misses_are_read_with_one_query(self):
+        def compute(ids):
+            markets = Market.objects.filter(id__in=ids)
+            return {market.id: RenderedJSON.render(MarketUserSerializer(market).data) for market in markets}
+
+        MarketService.get_market_details([self.markets[0].id], compute)
+        ids = [market.id for market in self.markets] + [uuid4()]
+
+        with CaptureQueriesContext(connection) as queries:
+            details = MarketService.get_market_details(ids, compute)
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(set(details), {market.id for market in self.markets})
+
+        # the entries are the ones of the detail view
+        response = self.client.get(reverse('market_user:detail', args=[self.markets[2].id]))
+        self.assertEqual(response.json()["name"], "Market 2")
+
+        with CaptureQueriesContext(connection) as queries:
+            MarketService.get_market_details(ids, compute)
+        self.assertEqual(len(queries), 0)
+
+    def test_category_warming_reads_details_together(self):
+        count = Category.objects.count()
+
+        with CaptureQueriesContext(connection) as queries:
+            CategoryListView.warm([])
+
+        # the list, the ids, the categories and their sub categories, whatever their count
+        self.assertGreater(count, 1)
+        self.assertEqual(len(queries), 4)
+        self.assertEqual(
+            len(CategoryService.get_detail_categories(Category.objects.values_list('id', flat=True), dict)),
+            count,
+        )
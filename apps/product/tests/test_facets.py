@@ -0,0 +1,114 @@
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from apps.category.models import SubCategory
+from apps.market.models import Market
+from apps.product.models import Product
+from apps.user.models import User, Marketer
+
+
+class ProductFacetsTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(phone="09909998877", password="password123")
+        Marketer.objects.create(
+            user=cls.user,
+            age=20,
+            national_code="1234567890",
+            city="city",
+            province="province",
+            address="address",
+        )
+        cls.market = Market.objects.create(marketer=cls.user.marketer, name="TestMarket")
+        cls.other_market = Market.objects.create(marketer=cls.user.marketer, name="OtherMarket")
+        cls.category, cls.other_category = SubCategory.objects.all()[:2]
+        cls.url = reverse('product_user:product_facets')
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_authenticate(user=self.user)
+
+        self.products = [
+            self.create(self.market, self.category, price=50_000, score=4.5),
+            self.create(self.market, self.category, price=200_000, score=3.2),
+            self.create(self.market, self.other_category, price=700_000, score=None),
+            self.create(self.other_market, None, price=6_000_000, score=1.0),
+        ]
+
+    def create(self, market, category, price, score):
+        return Product.objects.create(
+            market=market,
+            category=category,
+            name="Product",
+            price=price,
+            score=score,
+            stock=1,
+        )
+
+    def counts(self, facet):
+        return {row.get('id', row.get('min')): row['count'] for row in facet}
+
+    def test_counts(self):
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 4)
+        self.assertEqual(
+            self.counts(response.data['category']),
+            {str(self.category.id): 2, str(self.other_category.id): 1},
+        )
+        self.assertEqual(response.data['category'][0]['title'], self.category.title)
+        self.assertEqual(
+            self.counts(response.data['market']),
+            {str(self.market.id): 3, str(self.other_market.id): 1},
+        )
+        self.assertEqual(self.counts(response.data['score']), {1: 1, 2: 0, 3: 1, 4: 1})
+        self.assertEqual(
+            self.counts(response.data['price']),
+            {0: 1, 100_000: 1, 500_000: 1, 1_000_000: 0, 5_000_000: 1},
+        )
+
+    def test_counts_follow_filters(self):
+        response = self.client.get(self.url, {'market_name': 'test', 'min_price': 100_000})
+
+        self.assertEqual(response.data['count'], 2)
+        self.assertEqual(self.counts(response.data['market']), {str(self.market.id): 2})
+        self.assertEqual(self.counts(response.data['score']), {1: 0, 2: 0, 3: 1, 4: 0})
+
+    def test_one_query(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(self.url, {'min_score': 1})
+        self.assertEqual(len(queries), 1)
+
+    def test_cached_under_canonical_filters(self):
+        self.client.get(self.url, {'min_price': 1, 'market_name': 'test'})
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, {'market_name': 'test', 'unknown': 'x', 'min_price': 1})
+
+        self.assertEqual(len(queries), 0)
+        self.assertEqual(response.data['count'], 3)
+
+    def test_product_save_invalidates(self):
+        self.client.get(self.url)
+
+        self.products[0].price = 300_000
+        with self.captureOnCommitCallbacks(execute=True):
+            self.products[0].save()
+        response = self.client.get(self.url)
+
+        self.assertEqual(self.counts(response.data['price'])[100_000], 2)
+
+    def test_invalid_filter(self):
+        response = self.client.get(self.url, {'min_price': 'abc'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_anonymous_denied(self):
+        self.client.force_authenticate(user=None)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
@@ -0,0 +1,100 @@
+from unittest import skipUnless
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from apps.market.models import Market
+from apps.product.models import Product
+from apps.user.models import User, Marketer
+
+
+class ProductSearchTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(phone="09909998877", password="password123")
+        Marketer.objects.create(
+            user=cls.user,
+            age=20,
+            national_code="1234567890",
+            city="city",
+            province="province",
+            address="address",
+        )
+        cls.market = Market.objects.create(marketer=cls.user.marketer, name="Digital Store")
+        cls.other_market = Market.objects.create(marketer=cls.user.marketer, name="Book House")
+        cls.phone = Product.objects.create(
+            market=cls.market,
+            name="Galaxy phone",
+            description="a phone with a big screen",
+            price=1000,
+            stock=5,
+        )
+        cls.case = Product.objects.create(
+            market=cls.market,
+            name="Leather case",
+            description="case for your galaxy phone",
+            price=100,
+            stock=5,
+        )
+        cls.book = Product.objects.create(
+            market=cls.other_market,
+            name="Python book",
+            description="learn programming",
+            price=500,
+            stock=5,
+        )
+        cls.list_url = reverse('product_user:product_list')
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_authenticate(user=self.user)
+
+    def search(self, text, **params):
+        response = self.client.get(self.list_url, {'q': text, **params})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [row['id'] for row in response.data]
+
+    def test_search_name_description_and_market(self):
+        self.assertEqual(set(self.search('galaxy')), {str(self.phone.id), str(self.case.id)})
+        self.assertEqual(self.search('programming'), [str(self.book.id)])
+        self.assertEqual(self.search('book house'), [str(self.book.id)])
+        self.assertEqual(self.search('nothing like this'), [])
+
+    def test_search_with_other_filters(self):
+        self.assertEqual(self.search('galaxy', max_price=500), [str(self.case.id)])
+
+    def test_empty_search(self):
+        self.assertEqual(len(self.search(' ')), 3)
+
+    @skipUnless(connection.vendor == 'postgresql', 'full text search needs postgresql')
+    def test_name_matches_rank_first(self):
+        self.assertEqual(self.search('galaxy phone'), [str(self.phone.id), str(self.case.id)])
+
+    @skipUnless(connection.vendor == 'postgresql', 'full text search needs postgresql')
+    def test_vectors_follow_changes(self):
+        self.book.name = "Django book"
+        self.book.save()
+        self.assertEqual(self.search('django'), [str(self.book.id)])
+
+        self.other_market.name = "Library"
+        self.other_market.save()
+        self.assertEqual(self.search('library'), [str(self.book.id)])
+
+    @skipUnless(connection.vendor == 'postgresql', 'full text search needs postgresql')
+    def test_unrelated_saves_do_not_update_vector(self):
+        self.book.score = 4.5
+        with self.assertNumQueries(1):
+            self.book.save(update_fields=['score'])
+
+    @skipUnless(connection.vendor == 'postgresql', 'full text search needs postgresql')
+    def test_price_change_does_not_update_vector(self):
+        self.book.price = 600
+        with CaptureQueriesContext(connection) as queries:
+            self.book.save()
+
+        updates = [query for query in queries if query['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 1)
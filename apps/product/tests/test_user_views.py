@@ -1,13 +1,24 @@
 import os
 import shutil
+from django.core.cache import cache
+from django.db import connection
+from django.http import QueryDict
 from django.urls import reverse
+from django.test.utils import CaptureQueriesContext
 from django.test import override_settings
+from unittest import skipUnless
 from rest_framework.test import APITestCase
 from rest_framework import status
 from apps.category.models import SubCategory
+from apps.comment.models import Comment, CommentImage
 from apps.user.models import User, Marketer
 from apps.market.models import Market
 from apps.product.models import Product, ProductImage, ProductFeature
+from apps.product.filters import ProductFilter
+from core.cache.invalidation import invalidate_product_list
+from core.cache.keys import canonical_query, product_list_key
+from core.cache.metrics import CacheMetrics
+from core.pagination import KeysetPagination
 from django.core.files.uploadedfile import SimpleUploadedFile
 from io import BytesIO
 from PIL import Image
@@ -107,11 +118,12 @@ class ProductViewPermissionTests(APITestCase):
         self.client.force_authenticate(user=self.user)
         response = self.client.get(self.detail_url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(response.data['id'], str(self.product.id))
-        self.assertIn('images', response.data)
-        self.assertIn('features', response.data)
-        self.assertEqual(len(response.data['images']), 1)
-        self.assertEqual(len(response.data['features']), 1)
+        data = response.json()
+        self.assertEqual(data['id'], str(self.product.id))
+        self.assertIn('images', data)
+        self.assertIn('features', data)
+        self.assertEqual(len(data['images']), 1)
+        self.assertEqual(len(data['features']), 1)
 
     def test_product_detail_authenticated_not_exists(self):
         self.client.force_authenticate(user=self.user)
@@ -146,7 +158,7 @@ class ProductViewPermissionTests(APITestCase):
         self.client.force_authenticate(user=self.user)
         response = self.client.get(self.detail_url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data['images']), 2)
+        self.assertEqual(len(response.json()['images']), 2)
 
     def test_product_without_image_or_feature(self):
 
@@ -160,5 +172,420 @@ class ProductViewPermissionTests(APITestCase):
         detail_url = reverse('product_user:product_detail', args=[product.id])
         response = self.client.get(detail_url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data['images']), 0)
-        self.assertEqual(len(response.data['features']), 0)
+        self.assertEqual(len(response.json()['images']), 0)
+        self.assertEqual(len(response.json()['features']), 0)
+
+
+class ProductListQueryCountTests(APITestCase):
+    """The product list costs the same number of queries for any number of products."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(phone="09909998877", password="password123")
+        Marketer.objects.create(
+            user=cls.user,
+            age=20,
+            national_code="1234567890",
+            city="city",
+            province="province",
+            address="address",
+        )
+        cls.market = Market.objects.create(marketer=cls.user.marketer, name="TestMarket")
+        cls.list_url = reverse('product_user:product_list')
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_authenticate(user=self.user)
+
+    def create_products(self, count):
+        for i in range(count):
+            product = Product.objects.create(market=self.market, name=f"Product {i}", price=1000, stock=5)
+            for j in range(2):
+                ProductImage.objects.create(product=product, title=f"Image {j}", image=f"products/{i}-{j}.jpg")
+
+    def count_queries(self):
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.list_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return len(queries), response
+
+    def test_query_count_does_not_depend_on_products(self):
+        self.create_products(1)
+        few, _ = self.count_queries()
+
+        self.create_products(25)
+        many, response = self.count_queries()
+
+        self.assertEqual(few, many)
+        # products and their first images
+        self.assertEqual(many, 2)
+        self.assertEqual(len(response.data), 26)
+
+    def test_first_image_is_returned(self):
+        self.create_products(1)
+
+        _, response = self.count_queries()
+
+        image = response.data[0]['image']
+        self.assertEqual(image['title'], "Image 0")
+        self.assertTrue(image['url'].endswith("products/0-0.jpg"))
+
+    def test_product_without_image(self):
+        Product.objects.create(market=self.market, name="No image", price=1000, stock=5)
+
+        _, response = self.count_queries()
+
+        self.assertIsNone(response.data[0]['image'])
+
+
+class ProductCatalogTests(APITestCase):
+    """Cursor paginated catalog."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(phone="09909998877", password="password123")
+        Marketer.objects.create(
+            user=cls.user,
+            age=20,
+            national_code="1234567890",
+            city="city",
+            province="province",
+            address="address",
+        )
+        cls.market = Market.objects.create(marketer=cls.user.marketer, name="TestMarket")
+        cls.other_market = Market.objects.create(marketer=cls.user.marketer, name="OtherMarket")
+        cls.products = [
+            Product.objects.create(
+                market=cls.market if i % 2 else cls.other_market,
+                name=f"Product {i}",
+                price=1000 * (i % 5 + 1),
+                stock=5,
+            )
+            for i in range(15)
+        ]
+        cls.catalog_url = reverse('product_user:product_catalog')
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_authenticate(user=self.user)
+
+    def walk(self, params):
+        """ids of every page, and queries of each page"""
+        ids = []
+        queries_per_page = []
+        response = self.client.get(self.catalog_url, params)
+        while True:
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            ids += [row['id'] for row in response.data['results']]
+            if not response.data['next']:
+                break
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(response.data['next'])
+            queries_per_page.append(queries.captured_queries)
+        return ids, queries_per_page
+
+    def test_walk_newest_first(self):
+        ids, pages = self.walk({'page_size': 4})
+
+        expected = Product.objects.order_by('-created_at', '-id').values_list('id', flat=True)
+        self.assertEqual(ids, [str(product_id) for product_id in expected])
+        for queries in pages:
+            self.assertEqual(len(queries), 2)
+            for query in queries:
+                self.assertNotIn('OFFSET', query['sql'])
+                self.assertNotIn('COUNT(', query['sql'])
+
+    def test_walk_by_price(self):
+        ids, _ = self.walk({'page_size': 4, 'order': 'price'})
+
+        expected = Product.objects.order_by('price', 'id').values_list('id', flat=True)
+        self.assertEqual(ids, [str(product_id) for product_id in expected])
+
+    def test_filters(self):
+        ids, _ = self.walk({'page_size': 2, 'market_name': 'other', 'min_price': 2000, 'order': 'price'})
+
+        expected = (
+            Product.objects
+            .filter(market=self.other_market, price__gte=2000)
+            .order_by('price', 'id')
+            .values_list('id', flat=True)
+        )
+        self.assertEqual(ids, [str(product_id) for product_id in expected])
+        self.assertTrue(ids)
+
+    def test_invalid_cursor(self):
+        response = self.client.get(self.catalog_url, {'cursor': 'abc'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_unknown_order_and_page_size_share_a_key(self):
+        self.client.get(self.catalog_url, {'order': 'newest', 'page_size': 100})
+
+        for params in ({'order': 'bogus', 'page_size': 1000}, {'page_size': 100, 'utm_source': 'x'}):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(self.catalog_url, params)
+            self.assertEqual(len(queries), 0)
+            self.assertEqual(len(response.data['results']), 15)
+
+    @override_settings(ALLOWED_HOSTS=['testserver', 'shop.example'])
+    def test_links_are_built_for_each_request(self):
+        self.client.get(self.catalog_url, {'page_size': 4, 'utm_source': 'tracking'})
+
+        response = self.client.get(self.catalog_url, {'page_size': 4}, HTTP_HOST='shop.example')
+
+        next_link = response.data['next']
+        self.assertTrue(next_link.startswith('http://shop.example/'))
+        self.assertNotIn('utm_source', next_link)
+
+    @skipUnless(connection.vendor == 'postgresql', 'plans of postgres')
+    def test_cursor_is_an_index_condition(self):
+        orderings = {
+            ('-created_at', '-id'): 'product_created_at_id_index',
+            ('price', 'id'): 'product_price_id_index',
+        }
+        with connection.cursor() as cursor:
+            # the test tables are tiny, a seq scan would always win
+            cursor.execute("SET LOCAL enable_seqscan = off")
+        for ordering, index in orderings.items():
+            last = Product.objects.order_by(*ordering)[7]
+            values = [getattr(last, name.lstrip('-')) for name in ordering]
+
+            plan = (
+                Product.objects
+                .filter(KeysetPagination().after(values, ordering))
+                .order_by(*ordering)[:4]
+                .explain()
+            )
+
+            self.assertIn(index, plan)
+            # the whole cursor is the start of the range scan, not a filter on it
+            self.assertRegex(plan, r'Index Cond: .*ROW\(')
+            self.assertNotIn('Filter:', plan)
+
+
+class ProductListCacheTests(APITestCase):
+    """The product list is cached under its canonical filters."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(phone="09909998877", password="password123")
+        Marketer.objects.create(
+            user=cls.user,
+            age=20,
+            national_code="1234567890",
+            city="city",
+            province="province",
+            address="address",
+        )
+        cls.market = Market.objects.create(marketer=cls.user.marketer, name="TestMarket")
+        cls.list_url = reverse('product_user:product_list')
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_authenticate(user=self.user)
+        self.product = Product.objects.create(market=self.market, name="Product", price=12_050, stock=5)
+
+    def count_queries(self, params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.list_url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return len(queries), response
+
+    def test_param_order_and_unknown_params_share_a_key(self):
+        self.count_queries({'min_price': 1000, 'market_name': 'test'})
+
+        queries, response = self.count_queries({'market_name': ' test', 'utm_source': 'x', 'min_price': 1000})
+
+        self.assertEqual(queries, 0)
+        self.assertEqual(len(response.data), 1)
+
+    def test_page_param_shares_a_key(self):
+        # the list is not paginated, every page is the whole list
+        self.count_queries({})
+
+        for page in ('2', '999', 'abc'):
+            queries, response = self.count_queries({'page': page})
+            self.assertEqual((queries, len(response.data)), (0, 1))
+
+    def test_ranges_are_bucketed(self):
+        # min_price=12345 reads the bucket of 12000, but 12050 is below the bound asked for
+        self.count_queries({'min_price': 12_000})
+
+        queries, response = self.count_queries({'min_price': 12_345})
+
+        self.assertEqual(queries, 0)
+        self.assertEqual(len(response.data), 0)
+
+        queries, response = self.count_queries({'min_price': 12_050})
+        self.assertEqual(queries, 0)
+        self.assertEqual([row['id'] for row in response.data], [str(self.product.id)])
+
+    def test_exact_bounds_of_a_bucket(self):
+        Product.objects.create(market=self.market, name="Cheap", price=1_099, stock=5, score=3.8)
+
+        _, response = self.count_queries({'max_price': 1_001})
+        self.assertEqual(len(response.data), 0)
+
+        queries, response = self.count_queries({'max_price': 1_099})
+        self.assertEqual(queries, 0)
+        self.assertEqual([row['name'] for row in response.data], ["Cheap"])
+
+        _, response = self.count_queries({'min_score': 3.9})
+        self.assertEqual(len(response.data), 0)
+        queries, response = self.count_queries({'min_score': 3.7})
+        self.assertEqual(queries, 0)
+        self.assertEqual([row['name'] for row in response.data], ["Cheap"])
+
+    def test_hit_ratio(self):
+        CacheMetrics.reset("product:list")
+        self.count_queries({'min_price': 1000})
+        self.count_queries({'min_price': 1000})
+        self.count_queries({'min_price': 1000})
+
+        stats = CacheMetrics.stats("product:list")
+
+        self.assertEqual((stats['hit'], stats['miss']), (2, 1))
+        self.assertAlmostEqual(stats['ratio'], 2 / 3)
+
+    def test_product_save_invalidates(self):
+        self.count_queries({})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.create(market=self.market, name="New", price=1000, stock=5)
+        _, response = self.count_queries({})
+
+        self.assertEqual(len(response.data), 2)
+
+    def test_invalidation_waits_for_commit(self):
+        self.count_queries({})
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            Product.objects.create(market=self.market, name="New", price=1000, stock=5)
+            # the generation is the same until the commit, no old rows are cached under a new one
+            queries, response = self.count_queries({})
+            self.assertEqual((queries, len(response.data)), (0, 1))
+        for callback in callbacks:
+            callback()
+
+        _, response = self.count_queries({})
+        self.assertEqual(len(response.data), 2)
+
+    def test_canonical_filters(self):
+        params = QueryDict('max_price=12345&min_score=3.7&min_price=abc&name=&page=2&unknown=1')
+
+        canonical = ProductFilter.canonical(params, snap=True)
+
+        self.assertEqual(
+            canonical.dict(),
+            {'max_price': '13000', 'min_score': '3.5', 'min_price': 'abc'},
+        )
+
+    def test_invalidation_bumps_generation(self):
+        self.count_queries({})
+        old_key = product_list_key(canonical_query(QueryDict(), []))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            invalidate_product_list()
+
+        new_key = product_list_key(canonical_query(QueryDict(), []))
+        self.assertNotEqual(old_key, new_key)
+        # the old page is left to expire, it is never read again
+        self.assertIsNotNone(cache.get(old_key))
+        self.assertIsNone(cache.get(new_key))
+
+
+class ProductDetailsViewTests(APITestCase):
+    """Details of several products with a constant number of queries."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(phone="09909998877", password="password123")
+        Marketer.objects.create(
+            user=cls.user,
+            age=20,
+            national_code="1234567890",
+            city="city",
+            province="province",
+            address="address",
+        )
+        cls.market = Market.objects.create(marketer=cls.user.marketer, name="TestMarket")
+        cls.url = reverse('product_user:product_details')
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_authenticate(user=self.user)
+
+    def create_products(self, count):
+        products = []
+        for i in range(count):
+            product = Product.objects.create(
+                market=self.market,
+                category=SubCategory.objects.first(),
+                name=f"Product {i}",
+                price=1000,
+                stock=5,
+            )
+            ProductImage.objects.create(product=product, title="Image", image=f"products/{i}.jpg")
+            ProductFeature.objects.create(product=product, key="Color", value="Red")
+            comment = Comment.objects.create(
+                user=self.user, product=product, content="good", score=5, status=Comment.CommentStatus.PUBLISHED,
+            )
+            CommentImage.objects.create(comment=comment, image=f"comments/{i}.jpg")
+            Comment.objects.create(user=self.user, product=product, content="draft", score=1)
+            products.append(product)
+        return products
+
+    def get(self, ids):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, {'ids': ','.join(map(str, ids))})
+        return len(queries), response
+
+    def test_payload_is_the_detail_payload(self):
+        product, = self.create_products(1)
+
+        _, response = self.get([product.id])
+        detail = self.client.get(reverse('product_user:product_detail', args=[product.id]))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), [detail.json()])
+        self.assertEqual(len(response.json()[0]['comments']), 1)
+
+    def test_query_count_does_not_depend_on_ids(self):
+        few, _ = self.get([product.id for product in self.create_products(1)])
+        cache.clear()
+        many, response = self.get([product.id for product in self.create_products(20)])
+
+        self.assertEqual(few, many)
+        self.assertEqual(len(response.json()), 20)
+
+    def test_only_missing_details_are_queried(self):
+        products = self.create_products(3)
+        self.client.get(reverse('product_user:product_detail', args=[products[0].id]))
+        self.get([product.id for product in products])
+
+        queries, response = self.get([product.id for product in products])
+
+        self.assertEqual(queries, 0)
+        self.assertEqual(len(response.json()), 3)
+
+    def test_order_of_ids_and_unknown_ids(self):
+        products = self.create_products(2)
+
+        _, response = self.get([products[1].id, uuid4(), products[0].id, products[1].id])
+
+        self.assertEqual(
+            [detail['id'] for detail in response.json()],
+            [str(products[1].id), str(products[0].id)],
+        )
+
+    def test_invalid_ids(self):
+        for ids in ([], ['not-an-id'], [uuid4() for _ in range(51)]):
+            _, response = self.get(ids)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_anonymous_denied(self):
+        self.client.logout()
+
+        _, response = self.get([uuid4()])
+
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
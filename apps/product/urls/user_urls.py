@@ -1,12 +1,18 @@
 from django.urls import path
 from apps.product.views.user_views import (
     ProductListView,
+    ProductCatalogView,
+    ProductFacetsView,
     ProductDetailView,
+    ProductDetailsView,
 )
 
 app_name = 'user_product'
 
 urlpatterns = [
     path('list/', ProductListView.as_view(), name='product_list'),
+    path('catalog/', ProductCatalogView.as_view(), name='product_catalog'),
+    path('facets/', ProductFacetsView.as_view(), name='product_facets'),
+    path('detail/', ProductDetailsView.as_view(), name='product_details'),
     path('detail/<str:product_id>/', ProductDetailView.as_view(), name='product_detail'),
 ]
\ No newline at end of file
@@ -4,6 +4,7 @@ from permissions.product import IsProductOwner
 from permissions.market import IsMarketOwner, IsMarketer
 from rest_framework.response import Response
 from apps.market.models import Market
+from apps.cart.signals.cart import coalesce_cart_amount
 from apps.product.serializer.owner_serializer import (
     ProductOwnerCreateSerializer,
     ProductOwnerUpdateSerializer,
@@ -68,7 +69,9 @@ class ProductDeleteView(views.APIView):
 
         self.check_object_permissions(request, product)
 
-        product.delete()
+        # product may be in many carts, recalculate each one once
+        with coalesce_cart_amount():
+            product.delete()
 
         return Response(
             data={
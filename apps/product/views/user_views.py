@@ -1,22 +1,27 @@
-import time
-
+import uuid
 from rest_framework import views, status, generics
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.request import Request
 from rest_framework.response import Response
 from rest_framework.pagination import PageNumberPagination
-from django.utils.decorators import method_decorator
-from django.views.decorators.cache import cache_page
+from django.db.models import Prefetch
+from django.http import HttpRequest, QueryDict
 from django_filters import rest_framework as filters
-from core.cache.ttl import CacheTTL
+from core.cache.hot import HotKeys
+from core.cache.keys import PRODUCT_LIST, canonical_query
+from core.cache.rendered import RenderedJSON
 from apps.product.services import ProductService
-from apps.product.models import Product
+from apps.comment.models import Comment
+from apps.product.models import Product, ProductImage
 from apps.product.serializer.user_serializer import (
     ProductSimpleSerializer
 )
 from apps.product.serializer.common_seializer import (
     ProductDetailSerializer,
 )
+from apps.product.facets import ProductFacets
 from apps.product.filters import ProductFilter
+from core.pagination import KeysetPagination
 
 
 class ProductListView(generics.ListAPIView):
@@ -28,14 +33,143 @@ class ProductListView(generics.ListAPIView):
 
     filter_backends = (filters.DjangoFilterBackend,)
     filterset_class = ProductFilter
+    # reads are counted for the cache warmer (warm()), None for views it can't warm
+    hot_namespace = PRODUCT_LIST
+    # the (unpaginated) products of the snapped range bounds are cached, and the
+    # exact bounds are applied to them (ProductFilter.RANGE_BOUNDS)
+    bucket_ranges = True
+
+    def get_page_params(self):
+        """canonical params besides the filters that change the response"""
+        return {}
+
+    def get_cache_query(self):
+        """the canonical filters and page params, the cache key of the response"""
+        params = self.filterset_class.canonical(self.request.query_params, snap=self.bucket_ranges)
+        for name, value in self.get_page_params().items():
+            params[name] = value
+        return canonical_query(params, params.keys())
 
-    @method_decorator(cache_page(CacheTTL.PRODUCT_LIST, key_prefix='product:list'))
     def list(self, request, *args, **kwargs):
-        return super().list(request, *args, **kwargs)
+        query = self.get_cache_query()
+        if self.hot_namespace:
+            HotKeys.record(self.hot_namespace, query)
+
+        bucket = ProductService.get_product_list(query, self.of_query(query).compute)
+        ranges = self.filterset_class.ranges(request.query_params)
+        return Response([
+            row
+            for row, (price, score) in zip(bucket["rows"], bucket["bounds"])
+            if self.filterset_class.in_range(price, score, ranges)
+        ])
+
+    def compute(self):
+        """the cached value of the query of the request"""
+        products = list(self.filter_queryset(self.get_queryset()))
+        return {
+            "rows": self.get_serializer(products, many=True).data,
+            "bounds": [[product.price, product.score] for product in products],
+        }
+
+    @classmethod
+    def of_query(cls, query):
+        """the view of a request with query (of get_cache_query)"""
+        request = HttpRequest()
+        request.method = "GET"
+        request.GET = QueryDict(query)
+        return cls(request=Request(request), args=(), kwargs={}, format_kwarg=None)
+
+    @classmethod
+    def warm(cls, queries):
+        """compute the missing pages of the unfiltered list and of queries (of get_cache_query)"""
+        for query in dict.fromkeys(["", *queries]):
+            ProductService.get_product_list(query, cls.of_query(query).compute)
 
     def get_queryset(self):
-        time.sleep(2)
-        return super().get_queryset()
+        # only the first image of each product, with one query for the whole page
+        first_image = Prefetch(
+            'images',
+            queryset=ProductImage.objects.order_by('id')[:1],
+            to_attr='first_images',
+        )
+        return (
+            super().get_queryset()
+            .only('id', 'name', 'price', 'discount_price', 'percentage_off', 'description', 'score')
+            .prefetch_related(first_image)
+        )
+
+
+class ProductCatalogView(ProductListView):
+    """
+    the product list paginated by cursor, pages cost the same at any depth.
+    ?order=price lists the cheapest products first.
+    """
+    pagination_class = KeysetPagination
+    page_params = ('order', 'cursor', 'page_size')
+    hot_namespace = None
+    bucket_ranges = False
+    orderings = {
+        'newest': ('-created_at', '-id'),
+        'price': ('price', 'id'),
+    }
+
+    @property
+    def order(self):
+        order = self.request.query_params.get('order')
+        return order if order in self.orderings else 'newest'
+
+    @property
+    def keyset_ordering(self):
+        return self.orderings[self.order]
+
+    def get_page_params(self):
+        return {
+            'order': self.order,
+            'cursor': self.request.query_params.get('cursor', ''),
+            'page_size': str(self.paginator.get_page_size(self.request)),
+        }
+
+    def list(self, request, *args, **kwargs):
+        # the links are built for each request, the cached page holds no host or unknown params
+        query = self.get_cache_query()
+        page = ProductService.get_product_list(query, self.compute)
+        next_cursor = page["next_cursor"]
+        return Response({
+            "next": self.paginator.get_link(request, query, next_cursor) if next_cursor else None,
+            "results": page["results"],
+        })
+
+    def compute(self):
+        products = self.paginate_queryset(self.filter_queryset(self.get_queryset()))
+        return {
+            "results": self.get_serializer(products, many=True).data,
+            "next_cursor": self.paginator.next_cursor,
+        }
+
+
+class ProductFacetsView(generics.GenericAPIView):
+    """
+    counts per category, market, score band and price bucket of the products
+    matching the same filters as the product list
+    """
+    permission_classes = [IsAuthenticated]
+    queryset = Product.objects.all()
+
+    filter_backends = (filters.DjangoFilterBackend,)
+    filterset_class = ProductFilter
+
+    def get(self, request):
+        params = self.filterset_class.canonical(request.query_params)
+        query = canonical_query(params, params.keys())
+        data = ProductService.get_product_facets(
+            query,
+            lambda: ProductFacets.count(self.filter_queryset(self.get_queryset())),
+        )
+
+        return Response(
+            data,
+            status=status.HTTP_200_OK,
+        )
 
 
 class ProductDetailView(views.APIView):
@@ -43,23 +177,90 @@ class ProductDetailView(views.APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request, product_id):
-        data = ProductService.load_product_detail(product_id)
-        if not data:
+        try:
+            rendered = ProductService.get_product_detail(product_id, lambda: self.render(product_id))
+        except Product.DoesNotExist:
+            return Response(
+                data={
+                    "message": f"Product with id {product_id} does not exist",
+                },
+                status=status.HTTP_404_NOT_FOUND,
+            )
+
+        HotKeys.record("product:detail", product_id)
+        return rendered.response(request)
+
+    @staticmethod
+    def render(product_id):
+        return RenderedJSON.render(ProductDetailSerializer(Product.objects.get(id=product_id), many=False).data)
+
+    @classmethod
+    def warm(cls, product_ids):
+        """compute the missing details of product_ids"""
+        for product_id in product_ids:
             try:
-                product = Product.objects.get(id=product_id)
+                ProductService.get_product_detail(product_id, lambda: cls.render(product_id))
             except Product.DoesNotExist:
-                return Response(
-                    data={
-                        "message": f"Product with id {product_id} does not exist",
-                    },
-                    status=status.HTTP_404_NOT_FOUND,
-                )
-            serializer = ProductDetailSerializer(product, many=False)
-            data = serializer.data
+                pass
 
-            ProductService.save_product_detail(data, product_id)
 
-        return Response(
-            data,
-            status=status.HTTP_200_OK,
+class ProductDetailsView(views.APIView):
+    """
+    The details of several products, ?ids=<id>,<id>... (or repeated ids),
+    in the order of the ids, unknown ids are left out.
+    The cached details are read with one round trip and the missing ones with
+    one set of prefetched queries, whatever the number of ids.
+    """
+    serializer_class = ProductDetailSerializer
+    permission_classes = [IsAuthenticated]
+    max_ids = 50
+
+    def get(self, request):
+        try:
+            product_ids = self.get_ids(request.query_params.getlist('ids'))
+        except ValueError as e:
+            return Response(
+                data={
+                    "message": str(e),
+                },
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        details = ProductService.get_product_details(product_ids, self.render_many)
+        for product_id in details:
+            HotKeys.record("product:detail", product_id)
+        return RenderedJSON.join(
+            [details[product_id] for product_id in product_ids if product_id in details]
+        ).response(request)
+
+    @classmethod
+    def get_ids(cls, params):
+        """the distinct product ids of the ids params, in order"""
+        values = [value.strip() for param in params for value in param.split(',') if value.strip()]
+        if not values:
+            raise ValueError("ids is required")
+        try:
+            product_ids = list(dict.fromkeys(uuid.UUID(value) for value in values))
+        except ValueError:
+            raise ValueError("ids must be product ids")
+        if len(product_ids) > cls.max_ids:
+            raise ValueError(f"at most {cls.max_ids} ids are allowed")
+        return product_ids
+
+    @staticmethod
+    def render_many(product_ids):
+        products = (
+            Product.objects
+            .filter(id__in=product_ids)
+            .select_related('category__category')
+            .prefetch_related(
+                'images',
+                'features',
+                Prefetch(
+                    'comments',
+                    queryset=Comment.published.prefetch_related('images'),
+                    to_attr='published_comments',
+                ),
+            )
         )
+        return {product.id: RenderedJSON.render(ProductDetailSerializer(product).data) for product in products}
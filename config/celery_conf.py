@@ -7,4 +7,6 @@ celery_app = Celery('AmirShop')
 
 celery_app.config_from_object('django.conf:settings', namespace='CELERY')
 
-celery_app.autodiscover_tasks()
\ No newline at end of file
+celery_app.autodiscover_tasks()
+# tasks outside the apps
+celery_app.autodiscover_tasks(['core.cache'])
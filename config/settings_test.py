@@ -25,3 +25,7 @@ LOGGING = {
         'level': 'CRITICAL',
     }
 }
+
+# tests clear redis between cases, a per process cache would outlive that
+CACHE_LOCAL = {**CACHE_LOCAL, 'ENABLED': False}
+CACHE_WARMING = {**CACHE_WARMING, 'ENABLED': False}
@@ -1,30 +1,367 @@
+from django.conf import settings
 from django.core.cache import cache
+from django_redis import get_redis_connection
 import logging
+import math
+import os
+import random
+import redis
+import time
+import uuid
+
+from core.cache import codecs
+from core.cache.local import LocalCache, InvalidationListener
+from core.cache.metrics import CacheMetrics
 
 logger = logging.getLogger(__name__)
 
+# returned by CacheBackend.get for a missing key, so falsy values ([], {}, 0, None) are cached like any other
+MISS = object()
+
+
+class NotFound:
+    """cached in place of an object that doesn't exist (negative caching)"""
+
+
+codecs.register("not_found", NotFound, lambda value: [], lambda parts: NotFound())
+
 
 class CacheBackend:
+    """
+    Redis (L2) with a per process LRU (L1) in front of it for the keys under
+    settings.CACHE_LOCAL["PREFIXES"].
+    L1 entries are evicted across processes by prefixes published on
+    INVALIDATION_CHANNEL (see core/cache/invalidation.py).
+    """
+
+    INVALIDATION_CHANNEL = "cache:invalidate"
+
+    _local = None
+    _listener = None
+    _payload = None
+
+    @classmethod
+    def payload(cls):
+        """how values are encoded for redis, settings.CACHE_CODEC (core/cache/codecs.py)"""
+        if cls._payload is None:
+            config = settings.CACHE_CODEC
+            cls._payload = codecs.Payload(config["CODEC"], config["COMPRESS_MIN_SIZE"], config["COMPRESS_LEVEL"])
+        return cls._payload
+
+    @classmethod
+    def encode(cls, key, value):
+        payload, size = cls.payload().encode(value)
+        namespace = CacheMetrics.namespace(key)
+        CacheMetrics.record(namespace, "sets")
+        CacheMetrics.record(namespace, "bytes", len(payload))
+        CacheMetrics.record(namespace, "raw_bytes", size)
+        return payload
 
     @staticmethod
-    def get(key: str):
-        value = cache.get(key)
-        logger.info("CACHE GET %s -> %s", key, "HIT" if value else "MISS")
+    def decode(value):
+        # values of other writers (cache.set) are left as django_redis unpickled them
+        if isinstance(value, bytes):
+            return codecs.Payload.decode(value)
         return value
 
+    @classmethod
+    def local(cls):
+        """the local cache of this process, its listener is started on first use (and after fork)"""
+        if cls._local is None:
+            config = settings.CACHE_LOCAL
+            cls._local = LocalCache(config["MAX_ENTRIES"], config["MAX_BYTES"], config["TTL"])
+        if cls._listener is None or cls._listener.pid != os.getpid():
+            cls._local.clear()
+            cls._listener = InvalidationListener(cls._local, cls.listener_connection(), cls.INVALIDATION_CHANNEL)
+            cls._listener.start()
+        return cls._local
+
     @staticmethod
-    def set(key, value, ttl):
-        cache.set(key, value, ttl)
+    def listener_connection():
+        """
+        a connection of its own for the subscription, the SOCKET_TIMEOUT of the
+        cache would time out an idle subscription
+        """
+        pool = get_redis_connection("default").connection_pool
+        return redis.Redis(connection_pool=redis.ConnectionPool(
+            connection_class=pool.connection_class,
+            **{
+                **pool.connection_kwargs,
+                "socket_timeout": None,
+                "health_check_interval": InvalidationListener.health_check_interval,
+            },
+        ))
+
+    @staticmethod
+    def is_local(key: str):
+        config = settings.CACHE_LOCAL
+        return config["ENABLED"] and key.startswith(tuple(config["PREFIXES"]))
+
+    @classmethod
+    def get(cls, key: str):
+        """the cached value of key, MISS if there is none"""
+        namespace = CacheMetrics.namespace(key)
+        local = cls.is_local(key)
+        if local:
+            value = cls.local().get(key, MISS)
+            if value is not MISS:
+                CacheMetrics.record(namespace, "l1_hit")
+                logger.info("CACHE GET %s -> L1 HIT", key)
+                return value
+
+        value = cache.get(key, MISS)
+        hit = value is not MISS
+        if hit:
+            value = cls.decode(value)
+        CacheMetrics.record(namespace, "l2_hit" if hit else "miss")
+        logger.info("CACHE GET %s -> %s", key, "HIT" if hit else "MISS")
+        if local and hit:
+            cls.local().set(key, value)
+        return value
+
+    @classmethod
+    def set(cls, key, value, ttl):
+        cache.set(key, cls.encode(key, value), ttl)
+        if cls.is_local(key):
+            cls.local().set(key, value, ttl)
         logger.info("CACHE SET %s (ttl=%s)", key, ttl)
         return True
 
-    @staticmethod
-    def delete(key):
+    @classmethod
+    def delete(cls, key):
         cache.delete(key)
+        if cls.is_local(key):
+            cls.local().delete(key)
         logger.info("CACHE DELETE %s ", key)
         return True
 
+    @classmethod
+    def get_many(cls, keys):
+        """
+        the cached values of keys as {key: value}, missing keys are left out,
+        the keys that aren't in L1 are read with one MGET
+        """
+        values = {}
+        remote = []
+        for key in keys:
+            if cls.is_local(key):
+                value = cls.local().get(key, MISS)
+                if value is not MISS:
+                    CacheMetrics.record(CacheMetrics.namespace(key), "l1_hit")
+                    values[key] = value
+                    continue
+            remote.append(key)
+
+        found = cache.get_many(remote) if remote else {}
+        for key in remote:
+            namespace = CacheMetrics.namespace(key)
+            if key not in found:
+                CacheMetrics.record(namespace, "miss")
+                continue
+            value = values[key] = cls.decode(found[key])
+            CacheMetrics.record(namespace, "l2_hit")
+            if cls.is_local(key):
+                cls.local().set(key, value)
+        logger.info("CACHE GET MANY %s keys -> %s HIT", len(keys), len(values))
+        return values
+
+    @classmethod
+    def set_many(cls, values: dict, ttl):
+        """set {key: value} with one pipeline"""
+        if not values:
+            return True
+        cache.set_many({key: cls.encode(key, value) for key, value in values.items()}, ttl)
+        for key, value in values.items():
+            if cls.is_local(key):
+                cls.local().set(key, value, ttl)
+        logger.info("CACHE SET MANY %s keys (ttl=%s)", len(values), ttl)
+        return True
+
+    @classmethod
+    def delete_many(cls, keys):
+        if not keys:
+            return True
+        cache.delete_many(keys)
+        for key in keys:
+            if cls.is_local(key):
+                cls.local().delete(key)
+        logger.info("CACHE DELETE MANY %s keys", len(keys))
+        return True
+
+    @classmethod
+    def get_or_compute(
+        cls,
+        key,
+        compute,
+        ttl,
+        stale_ttl=None,
+        beta=1.0,
+        lock_timeout=10,
+        lock_wait=2,
+        not_found=None,
+        not_found_ttl=None,
+    ):
+        """
+        cached value of key, computed by compute() on a miss, with stampede protection:
+
+        - single flight: one process computes (holding lock:<key>), the others
+          serve the stale value if there is one, or wait up to lock_wait seconds
+          for the new one
+        - stale serving: entries are kept stale_ttl (default ttl) seconds after
+          they expire, for the others to serve while one recomputes
+        - probabilistic early refresh: an entry is recomputed before it expires
+          with a probability that grows near its expiry and with how long it
+          took to compute (beta scales it, 0 disables it)
+
+        When compute raises not_found (an exception class, e.g. Model.DoesNotExist)
+        that is cached for not_found_ttl seconds and raised again on the next hits.
+        """
+        stale_ttl = ttl if stale_ttl is None else stale_ttl
+        entry = cls.get(key)
+        if entry is not MISS:
+            value, delta, expires_at = entry
+            # -log(random()) is exponential with mean 1
+            early = delta * beta * -math.log(1 - random.random())
+            if time.time() + early < expires_at:
+                return cls.unwrap(value, not_found)
+
+        token = uuid.uuid4().hex
+        lock_key = f"lock:{key}"
+        if not cache.add(lock_key, token, lock_timeout):
+            if entry is not MISS:
+                logger.info("CACHE STALE %s", key)
+                return cls.unwrap(entry[0], not_found)
+            entry = cls.wait(key, lock_wait)
+            if entry is not MISS:
+                return cls.unwrap(entry[0], not_found)
+            # the computing process is too slow (or died), compute without the lock
+            return cls.compute(key, compute, ttl, stale_ttl, not_found, not_found_ttl)
+
+        try:
+            return cls.compute(key, compute, ttl, stale_ttl, not_found, not_found_ttl)
+        finally:
+            if cache.get(lock_key) == token:
+                cache.delete(lock_key)
+
+    @classmethod
+    def get_or_compute_many(cls, keys: dict, compute, ttl, stale_ttl=None, not_found_ttl=None):
+        """
+        the values of keys ({id: key}) as {id: value}, the entries are the ones of get_or_compute.
+        The hits are read with one round trip, the ids that are missing (or expired)
+        are computed together by compute(ids) -> {id: value} and written with one pipeline.
+        Ids compute leaves out don't exist, they are cached for not_found_ttl seconds
+        (when given) and left out of the result.
+        There is no single flight or early refresh, concurrent misses of a batch
+        are computed by each caller.
+        """
+        stale_ttl = ttl if stale_ttl is None else stale_ttl
+        entries = cls.get_many(list(keys.values()))
+        now = time.time()
+        values = {}
+        missing = []
+        for id_, key in keys.items():
+            entry = entries.get(key)
+            if entry is None or entry[2] <= now:
+                missing.append(id_)
+            elif not isinstance(entry[0], NotFound):
+                values[id_] = entry[0]
+        if not missing:
+            return values
+
+        start = time.time()
+        computed = compute(missing)
+        now = time.time()
+        # each entry's share of the batch, for the early refresh of get_or_compute
+        delta = (now - start) / len(missing)
+        found = {}
+        not_found = {}
+        for id_ in missing:
+            if id_ in computed:
+                values[id_] = computed[id_]
+                found[keys[id_]] = (computed[id_], delta, now + ttl)
+            elif not_found_ttl:
+                not_found[keys[id_]] = (NotFound(), delta, now + not_found_ttl)
+        cls.set_many(found, ttl + stale_ttl)
+        cls.set_many(not_found, not_found_ttl)
+        return values
+
+    @classmethod
+    def compute(cls, key, compute, ttl, stale_ttl, not_found=None, not_found_ttl=None):
+        start = time.time()
+        try:
+            value = compute()
+        except Exception as e:
+            if not_found is None or not isinstance(e, not_found) or not not_found_ttl:
+                raise
+            now = time.time()
+            cls.set(key, (NotFound(), now - start, now + not_found_ttl), not_found_ttl)
+            raise
+        now = time.time()
+        cls.set(key, (value, now - start, now + ttl), ttl + stale_ttl)
+        return value
+
     @staticmethod
-    def delete_prefix(key):
-        logger.info("CACHE DELETE_PREFIX %s", key)
-        cache.delete_pattern(f"*{key}*")
+    def unwrap(value, not_found):
+        if isinstance(value, NotFound):
+            logger.info("CACHE NOT FOUND")
+            raise (not_found or LookupError)()
+        return value
+
+    @classmethod
+    def wait(cls, key, timeout, interval=0.05):
+        """the entry of key once another process has computed it, MISS after timeout"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            time.sleep(interval)
+            entry = cache.get(key, MISS)
+            if entry is not MISS:
+                return cls.decode(entry)
+        return MISS
+
+    @classmethod
+    def publish(cls, prefix):
+        """evict prefix from the local cache of every process"""
+        if not settings.CACHE_LOCAL["ENABLED"]:
+            return
+        cls.local().delete_prefix(prefix)
+        get_redis_connection("default").publish(cls.INVALIDATION_CHANNEL, prefix)
+        logger.info("CACHE PUBLISH %s", prefix)
+
+    @staticmethod
+    def first_generation():
+        # a counter lost to eviction restarts from the clock (ms), above the
+        # generations it reached, so entries of old generations are not read again
+        return int(time.time() * 1000)
+
+    @staticmethod
+    def generation_key(namespace):
+        return f"generation:{namespace}"
+
+    @classmethod
+    def generation(cls, namespace):
+        """current generation of a namespace, it is part of every key in the namespace"""
+        key = cls.generation_key(namespace)
+        local = cls.is_local(key)
+        if local:
+            generation = cls.local().get(key)
+            if generation is not None:
+                return generation
+
+        generation = cache.get_or_set(key, cls.first_generation, None)
+        if local:
+            cls.local().set(key, generation)
+        return generation
+
+    @classmethod
+    def bump(cls, namespace):
+        """
+        invalidate a whole namespace with one INCR, keys of older generations
+        are never read again and expire by their ttl
+        """
+        key = cls.generation_key(namespace)
+        cache.add(key, cls.first_generation(), None)
+        generation = cache.incr(key)
+        if cls.is_local(key):
+            cls.local().delete(key)
+        logger.info("CACHE BUMP %s -> %s", namespace, generation)
+        return generation
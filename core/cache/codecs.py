@@ -0,0 +1,155 @@
+import base64
+import datetime
+import decimal
+import json
+import pickle
+import uuid
+import zlib
+
+try:
+    import msgpack
+except ImportError:  # optional, the msgpack codec is only available with it
+    msgpack = None
+
+# objects cached besides plain data (dict, list, str, numbers, bytes),
+# name -> (type, to parts, from parts)
+EXTENSIONS = {}
+
+
+def register(name, type_, dump, load):
+    """make type_ encodable by the json and msgpack codecs, dump returns a list of plain parts"""
+    EXTENSIONS[name] = (type_, dump, load)
+
+
+register("uuid", uuid.UUID, lambda value: [str(value)], lambda parts: uuid.UUID(parts[0]))
+register("decimal", decimal.Decimal, lambda value: [str(value)], lambda parts: decimal.Decimal(parts[0]))
+# before date, datetime is a date
+register(
+    "datetime",
+    datetime.datetime,
+    lambda value: [value.isoformat()],
+    lambda parts: datetime.datetime.fromisoformat(parts[0]),
+)
+register("date", datetime.date, lambda value: [value.isoformat()], lambda parts: datetime.date.fromisoformat(parts[0]))
+
+
+def extension_of(value):
+    for name, (type_, dump, _) in EXTENSIONS.items():
+        if isinstance(value, type_):
+            return name, dump(value)
+    raise TypeError(f"{type(value).__name__} can't be encoded")
+
+
+class PickleCodec:
+    name = "pickle"
+    tag = b"p"
+
+    @staticmethod
+    def dumps(value):
+        return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def loads(data):
+        return pickle.loads(data)
+
+
+class JSONCodec:
+    """tuples come back as lists"""
+
+    name = "json"
+    tag = b"j"
+
+    @staticmethod
+    def default(value):
+        if isinstance(value, bytes):
+            return {"__bytes__": base64.b64encode(value).decode()}
+        name, parts = extension_of(value)
+        return {"__ext__": name, "parts": parts}
+
+    @staticmethod
+    def hook(obj):
+        if "__bytes__" in obj:
+            return base64.b64decode(obj["__bytes__"])
+        if "__ext__" in obj:
+            return EXTENSIONS[obj["__ext__"]][2](obj["parts"])
+        return obj
+
+    @classmethod
+    def dumps(cls, value):
+        return json.dumps(value, default=cls.default, separators=(",", ":"), ensure_ascii=False).encode()
+
+    @classmethod
+    def loads(cls, data):
+        return json.loads(data, object_hook=cls.hook)
+
+
+class MsgpackCodec:
+    """tuples come back as lists"""
+
+    name = "msgpack"
+    tag = b"m"
+    extension_code = 1
+
+    @classmethod
+    def default(cls, value):
+        name, parts = extension_of(value)
+        return msgpack.ExtType(cls.extension_code, cls.dumps([name, parts]))
+
+    @classmethod
+    def ext_hook(cls, code, data):
+        name, parts = cls.loads(data)
+        return EXTENSIONS[name][2](parts)
+
+    @classmethod
+    def dumps(cls, value):
+        return msgpack.packb(value, default=cls.default, use_bin_type=True)
+
+    @classmethod
+    def loads(cls, data):
+        return msgpack.unpackb(data, ext_hook=cls.ext_hook, raw=False, strict_map_key=False)
+
+
+CODECS = {codec.name: codec for codec in (PickleCodec, JSONCodec, MsgpackCodec)}
+TAGS = {codec.tag: codec for codec in CODECS.values()}
+
+
+class Payload:
+    """
+    Cached values as bytes: a codec tag, a compression flag and the encoded value,
+    compressed with zlib from compress_min_size bytes.
+    The tag is stored with each value, so values written with another codec
+    (e.g. before the setting changed) are still read.
+    Values the codec can't encode fall back to pickle.
+    """
+
+    COMPRESSED = b"z"
+    RAW = b"-"
+
+    def __init__(self, codec="json", compress_min_size=1024, compress_level=6):
+        if codec == "msgpack" and msgpack is None:
+            raise ImportError("the msgpack codec needs the msgpack package")
+        self.codec = CODECS[codec]
+        self.compress_min_size = compress_min_size
+        self.compress_level = compress_level
+
+    def encode(self, value):
+        """(payload, size before compression)"""
+        codec = self.codec
+        try:
+            data = codec.dumps(value)
+        except (TypeError, ValueError, OverflowError):
+            codec = PickleCodec
+            data = codec.dumps(value)
+
+        size = len(data)
+        if size >= self.compress_min_size:
+            return codec.tag + self.COMPRESSED + zlib.compress(data, self.compress_level), size
+        return codec.tag + self.RAW + data, size
+
+    @classmethod
+    def decode(cls, payload):
+        codec = TAGS[payload[:1]]
+        data = payload[2:]
+        if payload[1:2] == cls.COMPRESSED:
+            data = zlib.decompress(data)
+        return codec.loads(data)
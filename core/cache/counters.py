@@ -0,0 +1,58 @@
+import logging
+import threading
+import time
+from collections import Counter
+from django_redis import get_redis_connection
+
+logger = logging.getLogger(__name__)
+
+
+class BufferedCounter:
+    """
+    Counts per (namespace, member) of one process, kept in memory and written
+    to redis in one pipeline at most every flush_interval seconds, so counting
+    costs no round trip. Subclasses set key_prefix, name (for the logs) and
+    write a count into the pipeline.
+    """
+
+    key_prefix = None
+    name = "counters"
+    flush_interval = 10
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.counters = Counter()
+        cls.flushed_at = time.monotonic()
+        cls.lock = threading.Lock()
+
+    @classmethod
+    def key(cls, namespace):
+        return f"{cls.key_prefix}:{namespace}"
+
+    @classmethod
+    def record(cls, namespace, member, amount=1):
+        with cls.lock:
+            cls.counters[(namespace, member)] += amount
+            due = time.monotonic() - cls.flushed_at >= cls.flush_interval
+        if due:
+            cls.flush()
+
+    @classmethod
+    def flush(cls):
+        with cls.lock:
+            counters, cls.counters = cls.counters, Counter()
+            cls.flushed_at = time.monotonic()
+        if not counters:
+            return
+
+        try:
+            pipeline = get_redis_connection("default").pipeline(transaction=False)
+            for (namespace, member), count in counters.items():
+                cls.write(pipeline, namespace, member, count)
+            pipeline.execute()
+        except Exception as e:
+            logger.warning(f"{cls.name} were not written: {e}")
+
+    @classmethod
+    def write(cls, pipeline, namespace, member, count):
+        raise NotImplementedError
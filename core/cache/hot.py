@@ -0,0 +1,41 @@
+from django_redis import get_redis_connection
+
+from core.cache.counters import BufferedCounter
+
+
+class HotKeys(BufferedCounter):
+    """
+    How often each key of a namespace is read, in a redis sorted set per
+    namespace, e.g. the canonical queries of product list pages. The cache
+    warmer (core/cache/warming.py) recomputes the top ones.
+
+    Counts are buffered like those of CacheMetrics (see BufferedCounter).
+    """
+
+    key_prefix = "cache:hot"
+    name = "hot keys"
+
+    @classmethod
+    def record(cls, namespace, member, amount=1):
+        super().record(namespace, str(member), amount)
+
+    @classmethod
+    def write(cls, pipeline, namespace, member, count):
+        pipeline.zincrby(cls.key(namespace), count, member)
+
+    @classmethod
+    def top(cls, namespace, count):
+        """the count most read members, most read first"""
+        cls.flush()
+        members = get_redis_connection("default").zrevrange(cls.key(namespace), 0, count - 1)
+        return [member.decode() for member in members]
+
+    @classmethod
+    def decay(cls, namespace, factor=0.5, minimum=1):
+        """scale the counts down so old reads weigh less, and drop members under minimum"""
+        key = cls.key(namespace)
+        redis = get_redis_connection("default")
+        pipeline = redis.pipeline()
+        pipeline.zunionstore(key, {key: factor})
+        pipeline.zremrangebyscore(key, "-inf", f"({minimum}")
+        pipeline.execute()
@@ -1,26 +1,64 @@
+from django.db import transaction
+
+from core.cache import warming
 from core.cache.backend import CacheBackend
-from core.cache.keys import product_detail_key, market_detail_key, category_detail_key
+from core.cache.keys import (
+    PRODUCT_LIST,
+    PRODUCT_FACETS,
+    MARKET_LIST,
+    CATEGORY_LIST,
+    product_detail_key,
+    market_detail_key,
+    category_detail_key,
+)
+
+# Everything runs on commit of the writer's transaction (at once outside of one):
+# a reader that recomputes before the commit still sees the old rows, and would
+# cache them under the new generation (or key) if it was bumped (deleted) already.
+
+
+def bump(namespace):
+    def run():
+        CacheBackend.bump(namespace)
+        CacheBackend.publish(CacheBackend.generation_key(namespace))
+    transaction.on_commit(run)
+
+
+def delete(key):
+    def run():
+        CacheBackend.delete(key)
+        CacheBackend.publish(key)
+    transaction.on_commit(run)
 
 
 def invalidate_product_list():
-    CacheBackend.delete_prefix("product:list")
+    bump(PRODUCT_LIST)
+    warming.schedule(PRODUCT_LIST)
+
+
+def invalidate_product_facets():
+    bump(PRODUCT_FACETS)
 
 
 def invalidate_market_list():
-    CacheBackend.delete("market:list")
+    bump(MARKET_LIST)
+    warming.schedule(MARKET_LIST)
 
 
 def invalidate_category_list():
-    CacheBackend.delete("category:list")
+    bump(CATEGORY_LIST)
+    warming.schedule(CATEGORY_LIST)
 
 
 def invalidate_product_detail(product_id: str):
-    CacheBackend.delete(product_detail_key(product_id))
+    delete(product_detail_key(product_id))
+    warming.schedule("product:detail")
 
 
 def invalidate_market_detail(market_id: str):
-    CacheBackend.delete(market_detail_key(market_id))
+    delete(market_detail_key(market_id))
 
 
 def invalidate_category_detail(category_id: str):
-    CacheBackend.delete(category_detail_key(category_id))
+    delete(category_detail_key(category_id))
+    warming.schedule(CATEGORY_LIST)
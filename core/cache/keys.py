@@ -1,5 +1,42 @@
-def product_list_key(page: int, query: str):
-    return f"product:list:{page}:{query}"
+import hashlib
+from urllib.parse import urlencode
+
+from core.cache.backend import CacheBackend
+
+# namespaces invalidated as a whole, by bumping their generation
+PRODUCT_LIST = "product:list"
+PRODUCT_FACETS = "product:facets"
+MARKET_LIST = "market:list"
+CATEGORY_LIST = "category:list"
+
+
+def canonical_query(params, allowed):
+    """
+    the allowed, non empty query params sorted by name (and value), so the same
+    filters in another order or with unknown params give the same string
+    """
+    items = sorted(
+        (name, value.strip())
+        for name in allowed
+        for value in params.getlist(name)
+        if value.strip()
+    )
+    return urlencode(items)
+
+
+def versioned_key(namespace: str, *parts):
+    generation = CacheBackend.generation(namespace)
+    return ":".join([namespace, f"v{generation}", *map(str, parts)])
+
+
+def product_list_key(query: str):
+    digest = hashlib.md5(query.encode()).hexdigest()
+    return versioned_key(PRODUCT_LIST, digest)
+
+
+def product_facets_key(query: str):
+    digest = hashlib.md5(query.encode()).hexdigest()
+    return versioned_key(PRODUCT_FACETS, digest)
 
 
 def product_detail_key(product_id: str):
@@ -7,7 +44,7 @@ def product_detail_key(product_id: str):
 
 
 def market_list_key(page: int):
-    return f"market:list:{page}"
+    return versioned_key(MARKET_LIST, page)
 
 
 def market_detail_key(market_id: str):
@@ -17,5 +54,6 @@ def market_detail_key(market_id: str):
 def category_detail_key(category_id: str):
     return f"category:detail:{category_id}"
 
+
 def category_list_key():
-    return "category:list"
+    return versioned_key(CATEGORY_LIST)
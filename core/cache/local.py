@@ -0,0 +1,118 @@
+import logging
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class LocalCache:
+    """
+    Per process LRU in front of redis, bounded by number of entries and by
+    bytes. Values are kept pickled, so callers never share (and mutate) the
+    same object, and their size is known.
+    """
+
+    def __init__(self, max_entries, max_bytes, ttl):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (expires_at, blob)
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return default
+            expires_at, blob = entry
+            if expires_at <= time.monotonic():
+                self._remove(key)
+                return default
+            self.entries.move_to_end(key)
+        return pickle.loads(blob)
+
+    def set(self, key, value, ttl=None):
+        blob = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        if len(blob) > self.max_bytes:
+            return False
+
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        with self.lock:
+            self._remove(key)
+            self.entries[key] = (time.monotonic() + ttl, blob)
+            self.size += len(blob)
+            while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+        return True
+
+    def delete(self, key):
+        with self.lock:
+            self._remove(key)
+
+    def delete_prefix(self, prefix):
+        with self.lock:
+            for key in [key for key in self.entries if key.startswith(prefix)]:
+                self._remove(key)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def _remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= len(entry[1])
+
+
+class InvalidationListener(threading.Thread):
+    """
+    Evicts keys of the local cache that other processes invalidated, each
+    message on the channel is a key prefix.
+    While the subscription is down messages are lost, so the local cache is
+    cleared on every (re)subscribe; the short ttl bounds what is left in between.
+    The connection must not time out while idle (socket_timeout=None), dead
+    connections are found by a PING every health_check_interval seconds.
+    """
+
+    retry_delay = 1
+    health_check_interval = 30
+
+    def __init__(self, local, connection, channel):
+        super().__init__(name="cache-invalidation-listener", daemon=True)
+        self.local = local
+        self.connection = connection
+        self.channel = channel
+        self.pid = os.getpid()
+
+    def run(self):
+        pubsub = self.connection.pubsub()
+        while True:
+            try:
+                if not pubsub.subscribed:
+                    pubsub.subscribe(self.channel)
+                # redis-py subscribes again by itself after a reconnect, the
+                # confirmation of each subscribe is a "subscribe" message
+                message = pubsub.get_message(timeout=self.health_check_interval)
+                if message is not None:
+                    self.handle(message)
+            except Exception as e:
+                logger.debug(f"cache invalidation listener disconnected: {e}")
+                pubsub.reset()
+                time.sleep(self.retry_delay)
+
+    def handle(self, message):
+        if message.get("type") == "subscribe":
+            logger.debug(f"cache invalidation listener subscribed to {self.channel}")
+            self.local.clear()
+            return
+        if message.get("type") != "message":
+            return
+        prefix = message["data"]
+        if isinstance(prefix, bytes):
+            prefix = prefix.decode()
+        self.local.delete_prefix(prefix)
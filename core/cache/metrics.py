@@ -0,0 +1,54 @@
+from django_redis import get_redis_connection
+
+from core.cache.counters import BufferedCounter
+
+
+class CacheMetrics(BufferedCounter):
+    """
+    Counters per cache namespace, kept in a redis hash: l1_hit, l2_hit and miss
+    of reads, sets, bytes (stored) and raw_bytes (before compression) of writes.
+
+    Counts are buffered (see BufferedCounter), so a local cache hit costs no
+    round trip.
+    """
+
+    key_prefix = "cache:stats"
+    name = "cache metrics"
+
+    @staticmethod
+    def namespace(key):
+        """product:list:v1:abc -> product:list"""
+        return ":".join(key.split(":")[:2])
+
+    @classmethod
+    def write(cls, pipeline, namespace, event, count):
+        pipeline.hincrby(cls.key(namespace), event, count)
+
+    @classmethod
+    def stats(cls, namespace):
+        cls.flush()
+        counters = get_redis_connection("default").hgetall(cls.key(namespace))
+        count = lambda name: int(counters.get(name.encode(), 0))
+        l1_hit = count("l1_hit")
+        l2_hit = count("l2_hit")
+        miss = count("miss")
+        hit = l1_hit + l2_hit
+        total = hit + miss
+        sets = count("sets")
+        return {
+            "l1_hit": l1_hit,
+            "l2_hit": l2_hit,
+            "hit": hit,
+            "miss": miss,
+            "ratio": hit / total if total else 0.0,
+            "l1_ratio": l1_hit / total if total else 0.0,
+            "sets": sets,
+            "bytes": count("bytes"),
+            "raw_bytes": count("raw_bytes"),
+            "avg_bytes": count("bytes") / sets if sets else 0.0,
+        }
+
+    @classmethod
+    def reset(cls, namespace):
+        cls.flush()
+        get_redis_connection("default").delete(cls.key(namespace))
@@ -0,0 +1,73 @@
+import gzip
+import hashlib
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags
+from rest_framework.renderers import JSONRenderer
+
+from core.cache import codecs
+
+
+class RenderedJSON:
+    """
+    Serializer data rendered once to the JSON body of the response, with its
+    ETag. Cached in place of the data, a hit is served from these bytes
+    without the serializer and the renderer.
+    Bodies of compress_min_size bytes or more are kept gzipped, and sent as
+    they are to clients that accept gzip.
+    """
+
+    compress_min_size = 1024
+    compress_level = 6
+
+    def __init__(self, body, etag, compressed):
+        self.body = body
+        self.etag = etag
+        self.compressed = compressed
+
+    @classmethod
+    def render(cls, data):
+        return cls.of(JSONRenderer().render(data))
+
+    @classmethod
+    def join(cls, items):
+        """a JSON array of rendered items, without rendering them again"""
+        return cls.of(b"[" + b",".join(item.content for item in items) + b"]")
+
+    @classmethod
+    def of(cls, body):
+        etag = f'"{hashlib.md5(body).hexdigest()}"'
+        if len(body) >= cls.compress_min_size:
+            # mtime=0 keeps the bytes (and so the cache) the same for the same body
+            return cls(gzip.compress(body, cls.compress_level, mtime=0), etag, True)
+        return cls(body, etag, False)
+
+    @property
+    def content(self):
+        """the uncompressed body"""
+        return gzip.decompress(self.body) if self.compressed else self.body
+
+    def response(self, request):
+        etags = parse_etags(request.headers.get("If-None-Match", ""))
+        if self.etag in etags or "*" in etags:
+            response = HttpResponseNotModified()
+            response["ETag"] = self.etag
+            return response
+
+        if self.compressed and "gzip" in request.headers.get("Accept-Encoding", ""):
+            response = HttpResponse(self.body, content_type="application/json")
+            response["Content-Encoding"] = "gzip"
+        else:
+            response = HttpResponse(self.content, content_type="application/json")
+        response["ETag"] = self.etag
+        if self.compressed:
+            patch_vary_headers(response, ("Accept-Encoding",))
+        return response
+
+
+codecs.register(
+    "rendered_json",
+    RenderedJSON,
+    lambda rendered: [rendered.body, rendered.etag, rendered.compressed],
+    lambda parts: RenderedJSON(*parts),
+)
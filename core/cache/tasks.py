@@ -0,0 +1,26 @@
+from celery import shared_task
+from celery.signals import worker_ready
+from django.conf import settings
+
+from core.cache import warming
+from core.cache.hot import HotKeys
+
+
+@shared_task
+def warm_caches(namespaces=None, decay=False):
+    """
+    recompute the hot entries of namespaces (all by default) that are missing,
+    decay=True also ages the access counts (hourly by celery beat)
+    """
+    warmed = warming.warm(namespaces)
+    if decay:
+        for namespace in warmed:
+            HotKeys.decay(namespace)
+    return warmed
+
+
+@worker_ready.connect
+def warm_caches_on_startup(sender, **kwargs):
+    # after a deploy the caches are cold (or of an older release)
+    if settings.CACHE_WARMING["ENABLED"]:
+        warm_caches.delay()
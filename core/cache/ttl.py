@@ -4,5 +4,8 @@ class CacheTTL:
     MARKET_DETAIL = 60 * 30
     PRODUCT_DETAIL = 60 * 10
     PRODUCT_LIST = 60 * 5
+    PRODUCT_FACETS = 60 * 5
     CATEGORY_DETAIL = 60 * 60 * 24
-    CATEGORY_LIST = 60 * 60 * 24
\ No newline at end of file
+    CATEGORY_LIST = 60 * 60 * 24
+    # unknown product, market and category ids
+    NOT_FOUND = 60
@@ -0,0 +1,51 @@
+import logging
+import time
+from celery import current_app
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+from core.cache.hot import HotKeys
+
+logger = logging.getLogger(__name__)
+
+WARM_TASK = "core.cache.tasks.warm_caches"
+
+
+def schedule(namespace: str):
+    """
+    warm namespace after settings.CACHE_WARMING["DELAY"] seconds, invalidations
+    of the namespace until then are coalesced into that one warming
+    """
+    config = settings.CACHE_WARMING
+    if not config["ENABLED"] or namespace not in config["WARMERS"]:
+        return
+    if cache.add(f"warming:pending:{namespace}", 1, config["DELAY"]):
+        transaction.on_commit(lambda: send(namespace, config["DELAY"]))
+
+
+def send(namespace, countdown):
+    try:
+        current_app.send_task(WARM_TASK, args=[[namespace]], countdown=countdown, retry=False)
+    except Exception as e:
+        # the next warming (hourly) covers it
+        logger.warning(f"cache warming of {namespace} was not scheduled: {e}")
+
+
+def warm(namespaces=None, top=None):
+    """
+    recompute the missing entries of the hottest keys of each namespace,
+    settings.CACHE_WARMING["WARMERS"] maps namespaces to views with a warm(hot keys) classmethod
+    """
+    config = settings.CACHE_WARMING
+    top = top or config["TOP"]
+    warmed = {}
+    for namespace in namespaces or config["WARMERS"]:
+        view = import_string(config["WARMERS"][namespace])
+        start = time.perf_counter()
+        members = HotKeys.top(namespace, top)
+        view.warm(members)
+        warmed[namespace] = len(members)
+        logger.info(f"cache warmed {namespace}: {len(members)} hot keys in {time.perf_counter() - start:.2f}s")
+    return warmed
@@ -0,0 +1 @@
+from core.pagination.keyset import KeysetPagination
@@ -0,0 +1,163 @@
+import base64
+import json
+from django.db.models import F, Q
+from django.db.models.fields.tuple_lookups import Tuple, TupleGreaterThan, TupleLessThan
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination on a unique ordering, e.g. ("-created_at", "-id").
+
+    The cursor holds the ordering values of the last row, the next page is
+    "rows after these values" so every page costs one indexed range scan,
+    no COUNT(*) and no OFFSET.
+    """
+
+    ordering = ("-created_at", "-id")
+    page_size = 20
+    page_size_query_param = "page_size"
+    max_page_size = 100
+    cursor_query_param = "cursor"
+    invalid_cursor_message = "Invalid cursor"
+
+    def get_ordering(self, request, queryset, view):
+        return getattr(view, "keyset_ordering", self.ordering)
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(page_size, 1), self.max_page_size)
+
+    @staticmethod
+    def split(ordering):
+        """("-created_at", "id") -> [("created_at", True), ("id", False)]"""
+        return [(name.lstrip("-"), name.startswith("-")) for name in ordering]
+
+    def encode_cursor(self, obj, ordering):
+        model = type(obj)
+        values = [
+            model._meta.get_field(name).value_to_string(obj)
+            for name, _ in self.split(ordering)
+        ]
+        return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+    def decode_cursor(self, cursor, queryset, ordering):
+        try:
+            values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            fields = [queryset.model._meta.get_field(name) for name, _ in self.split(ordering)]
+            if len(values) != len(fields):
+                raise ValueError
+            return [field.to_python(value) for field, value in zip(fields, values)]
+        except Exception:
+            raise NotFound(self.invalid_cursor_message)
+
+    def after(self, values, ordering):
+        """
+        rows after values in ordering, a >= x and then
+        (a, b, ...) > (x, y, ...) when every column sorts the same way, a row
+        value comparison the database uses as an index condition as a whole,
+        else ((a > x) or (a = x and b > y) or ...).
+        the plain bound on the first column is the start of the index range
+        scan where the rest is only a filter (the or-chain, and the row value
+        on backends without them, e.g. sqlite)
+        """
+        columns = self.split(ordering)
+        first, descending = columns[0]
+        bound = Q(**{f"{first}__lte" if descending else f"{first}__gte": values[0]})
+        if all(descending_ == descending for _, descending_ in columns):
+            lookup = TupleLessThan if descending else TupleGreaterThan
+            return bound & lookup(Tuple(*(F(name) for name, _ in columns)), values)
+
+        condition = Q()
+        equal = {}
+        for (name, descending_), value in zip(columns, values):
+            lookup = f"{name}__lt" if descending_ else f"{name}__gt"
+            condition |= Q(**equal, **{lookup: value})
+            equal[name] = value
+        return bound & condition
+
+    def load_ordering(self, queryset, ordering):
+        """ordering fields are read for the cursor, they must not be deferred"""
+        names = {name for name, _ in self.split(ordering)}
+        field_names, defer = queryset.query.deferred_loading
+        if not defer:
+            return queryset.only(*field_names, *names)
+        if field_names & names:
+            return queryset.defer(None).defer(*(field_names - names))
+        return queryset
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        ordering = self.get_ordering(request, queryset, view)
+        page_size = self.get_page_size(request)
+
+        queryset = self.load_ordering(queryset.order_by(*ordering), ordering)
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            values = self.decode_cursor(cursor, queryset, ordering)
+            queryset = queryset.filter(self.after(values, ordering))
+
+        # one more row tells whether there is a next page
+        rows = list(queryset[:page_size + 1])
+        page = rows[:page_size]
+
+        self.next_cursor = None
+        if len(rows) > page_size:
+            self.next_cursor = self.encode_cursor(page[-1], ordering)
+
+        return page
+
+    def get_next_link(self):
+        if self.next_cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.next_cursor)
+
+    def get_link(self, request, query, cursor):
+        """the link of the page at cursor, with the query string query (e.g. canonical params) for that of request"""
+        url = request.build_absolute_uri(f"{request.path}?{query}")
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def get_paginated_response(self, data):
+        return Response({
+            "next": self.get_next_link(),
+            "results": data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "required": ["results"],
+            "properties": {
+                "next": {
+                    "type": "string",
+                    "nullable": True,
+                    "format": "uri",
+                },
+                "results": schema,
+            },
+        }
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                "name": self.cursor_query_param,
+                "required": False,
+                "in": "query",
+                "description": "The pagination cursor value.",
+                "schema": {"type": "string"},
+            },
+            {
+                "name": self.page_size_query_param,
+                "required": False,
+                "in": "query",
+                "description": "Number of results to return per page.",
+                "schema": {"type": "integer"},
+            },
+        ]
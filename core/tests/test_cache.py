@@ -0,0 +1,377 @@
+import threading
+import time
+from datetime import datetime, timezone as dt_timezone
+from decimal import Decimal
+from unittest import skipUnless
+from unittest.mock import patch
+from uuid import uuid4
+from django.core.cache import cache
+from django.core.exceptions import ObjectDoesNotExist
+from django.test import SimpleTestCase
+from django_redis import get_redis_connection
+
+from core.cache import codecs
+from core.cache.backend import CacheBackend, MISS, NotFound
+from core.cache.codecs import Payload
+from core.cache.hot import HotKeys
+from core.cache.local import LocalCache, InvalidationListener
+from core.cache.metrics import CacheMetrics
+from core.cache.rendered import RenderedJSON
+
+
+class LocalCacheTests(SimpleTestCase):
+
+    def test_evicts_least_recently_used_entry(self):
+        local = LocalCache(max_entries=2, max_bytes=10_000, ttl=60)
+        local.set("a", 1)
+        local.set("b", 2)
+        local.get("a")
+
+        local.set("c", 3)
+
+        self.assertEqual(local.get("a"), 1)
+        self.assertIsNone(local.get("b"))
+        self.assertEqual(local.get("c"), 3)
+
+    def test_bounded_by_bytes(self):
+        local = LocalCache(max_entries=100, max_bytes=1000, ttl=60)
+        for i in range(10):
+            local.set(f"key:{i}", "x" * 300)
+
+        self.assertLessEqual(local.size, 1000)
+        self.assertEqual(list(local.entries), ["key:7", "key:8", "key:9"])
+        # a value larger than the whole cache is not kept
+        self.assertFalse(local.set("big", "x" * 2000))
+
+    def test_entries_expire(self):
+        local = LocalCache(max_entries=10, max_bytes=10_000, ttl=5)
+        local.set("a", 1)
+        local.set("b", 2, ttl=1)
+
+        with patch("core.cache.local.time.monotonic", return_value=time.monotonic() + 2):
+            self.assertEqual(local.get("a"), 1)
+            self.assertIsNone(local.get("b"))
+
+    def test_values_are_copies(self):
+        local = LocalCache(max_entries=10, max_bytes=10_000, ttl=60)
+        value = {"images": []}
+        local.set("a", value)
+
+        local.get("a")["images"].append("changed")
+
+        self.assertEqual(local.get("a"), {"images": []})
+
+    def test_delete_prefix(self):
+        local = LocalCache(max_entries=10, max_bytes=10_000, ttl=60)
+        local.set("product:detail:1", 1)
+        local.set("product:detail:2", 2)
+        local.set("category:list", 3)
+
+        local.delete_prefix("product:detail:")
+
+        self.assertEqual(list(local.entries), ["category:list"])
+
+    def test_listener_evicts_published_prefix(self):
+        local = LocalCache(max_entries=10, max_bytes=10_000, ttl=60)
+        local.set("product:detail:1", 1)
+        listener = InvalidationListener(local, None, "channel")
+
+        listener.handle({"type": "message", "data": b"product:detail:1"})
+
+        self.assertIsNone(local.get("product:detail:1"))
+
+    def test_listener_clears_on_subscribe_only(self):
+        local = LocalCache(max_entries=10, max_bytes=10_000, ttl=60)
+        local.set("product:detail:1", 1)
+        listener = InvalidationListener(local, None, "channel")
+
+        listener.handle({"type": "pong", "data": b""})
+        self.assertEqual(local.get("product:detail:1"), 1)
+
+        # messages published while it was resubscribing are lost
+        listener.handle({"type": "subscribe", "data": 1})
+        self.assertIsNone(local.get("product:detail:1"))
+
+    def test_listener_connection_does_not_time_out(self):
+        kwargs = CacheBackend.listener_connection().connection_pool.connection_kwargs
+
+        self.assertIsNone(kwargs["socket_timeout"])
+        self.assertEqual(kwargs["health_check_interval"], InvalidationListener.health_check_interval)
+
+
+class GetOrComputeTests(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.calls = 0
+
+    def compute(self, value="value", seconds=0):
+        def compute():
+            self.calls += 1
+            time.sleep(seconds)
+            return value
+        return compute
+
+    def test_computes_once(self):
+        first = CacheBackend.get_or_compute("test:key", self.compute(), 60)
+        second = CacheBackend.get_or_compute("test:key", self.compute(), 60)
+
+        self.assertEqual((first, second), ("value", "value"))
+        self.assertEqual(self.calls, 1)
+
+    def test_single_flight(self):
+        results = []
+        threads = [
+            threading.Thread(
+                target=lambda: results.append(CacheBackend.get_or_compute("test:key", self.compute(seconds=0.3), 60))
+            )
+            for _ in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results, ["value"] * 5)
+        self.assertEqual(self.calls, 1)
+
+    def test_serves_stale_while_another_computes(self):
+        cache.set("test:key", ("old", 0.1, time.time() - 1), 60)
+        cache.add("lock:test:key", "other", 10)
+
+        value = CacheBackend.get_or_compute("test:key", self.compute(), 60)
+
+        self.assertEqual(value, "old")
+        self.assertEqual(self.calls, 0)
+
+    def test_recomputes_expired_entry(self):
+        cache.set("test:key", ("old", 0.1, time.time() - 1), 60)
+
+        value = CacheBackend.get_or_compute("test:key", self.compute("new"), 60)
+
+        self.assertEqual(value, "new")
+        self.assertEqual(CacheBackend.get("test:key")[0], "new")
+        self.assertIsNone(cache.get("lock:test:key"))
+
+    def test_early_refresh(self):
+        # 5 s before expiry, computing took 10 s
+        cache.set("test:key", ("old", 10, time.time() + 5), 60)
+
+        with patch("core.cache.backend.random.random", return_value=0.9):
+            value = CacheBackend.get_or_compute("test:key", self.compute("new"), 60)
+        self.assertEqual(value, "new")
+
+        cache.set("test:key", ("old", 10, time.time() + 5), 60)
+        value = CacheBackend.get_or_compute("test:key", self.compute("new"), 60, beta=0)
+        self.assertEqual(value, "old")
+
+    def test_failed_compute_releases_lock(self):
+        def compute():
+            raise ValueError
+
+        with self.assertRaises(ValueError):
+            CacheBackend.get_or_compute("test:key", compute, 60)
+
+        self.assertIsNone(cache.get("lock:test:key"))
+        self.assertEqual(CacheBackend.get_or_compute("test:key", self.compute(), 60), "value")
+
+    def test_empty_value_is_cached(self):
+        CacheBackend.get_or_compute("test:key", self.compute([]), 60)
+        value = CacheBackend.get_or_compute("test:key", self.compute([]), 60)
+
+        self.assertEqual(value, [])
+        self.assertEqual(self.calls, 1)
+
+    def test_miss_sentinel(self):
+        self.assertIs(CacheBackend.get("test:key"), MISS)
+
+        CacheBackend.set("test:key", None, 60)
+
+        self.assertIsNone(CacheBackend.get("test:key"))
+
+    def test_not_found_is_cached(self):
+        def compute():
+            self.calls += 1
+            raise ObjectDoesNotExist
+
+        for _ in range(3):
+            with self.assertRaises(ObjectDoesNotExist):
+                CacheBackend.get_or_compute(
+                    "test:key", compute, 60, not_found=ObjectDoesNotExist, not_found_ttl=5,
+                )
+
+        self.assertEqual(self.calls, 1)
+        self.assertLessEqual(cache.ttl("test:key"), 5)
+
+
+class PayloadTests(SimpleTestCase):
+
+    value = (
+        {
+            "id": uuid4(),
+            "name": "محصول",
+            "price": Decimal("10.50"),
+            "created_at": datetime(2026, 1, 2, 3, 4, tzinfo=dt_timezone.utc),
+            "images": [{"url": "/media/a.jpg"}],
+        },
+        0.01,
+        1700000000.5,
+    )
+
+    def test_json_round_trip(self):
+        payload = Payload("json", compress_min_size=10_000)
+
+        data, size = payload.encode(self.value)
+
+        self.assertTrue(data.startswith(b"j-"))
+        self.assertEqual(size, len(data) - 2)
+        # tuples come back as lists
+        self.assertEqual(Payload.decode(data), list(self.value))
+
+    def test_extensions(self):
+        payload = Payload("json")
+        value = [RenderedJSON.render({"id": 1}), NotFound(), b"\x00bytes"]
+
+        rendered, not_found, raw = Payload.decode(payload.encode(value)[0])
+
+        self.assertEqual((rendered.body, rendered.etag), (value[0].body, value[0].etag))
+        self.assertIsInstance(not_found, NotFound)
+        self.assertEqual(raw, b"\x00bytes")
+
+    def test_compressed_above_threshold(self):
+        payload = Payload("json", compress_min_size=100)
+        value = {"description": "x" * 1000}
+
+        data, size = payload.encode(value)
+
+        self.assertTrue(data.startswith(b"jz"))
+        self.assertLess(len(data), size)
+        self.assertEqual(Payload.decode(data), value)
+
+    def test_unsupported_values_fall_back_to_pickle(self):
+        data, _ = Payload("json").encode({1, 2})
+
+        self.assertTrue(data.startswith(b"p"))
+        self.assertEqual(Payload.decode(data), {1, 2})
+
+    def test_values_of_another_codec_are_read(self):
+        data, _ = Payload("pickle").encode(self.value)
+
+        self.assertEqual(Payload.decode(data), self.value)
+
+    @skipUnless(codecs.msgpack, "msgpack is not installed")
+    def test_msgpack_round_trip(self):
+        data, _ = Payload("msgpack").encode(self.value)
+
+        self.assertTrue(data.startswith(b"m"))
+        self.assertEqual(Payload.decode(data), list(self.value))
+
+    def test_size_metrics(self):
+        cache.clear()
+        CacheMetrics.reset("test:sizes")
+
+        CacheBackend.set("test:sizes:1", {"description": "x" * 5000}, 60)
+        CacheBackend.set("test:sizes:2", {"description": "y"}, 60)
+
+        stats = CacheMetrics.stats("test:sizes")
+        self.assertEqual(stats["sets"], 2)
+        self.assertGreater(stats["raw_bytes"], 5000)
+        self.assertLess(stats["bytes"], 1000)
+        self.assertEqual(CacheBackend.get("test:sizes:1"), {"description": "x" * 5000})
+
+
+class HotKeysTests(SimpleTestCase):
+
+    def setUp(self):
+        HotKeys.flush()
+        get_redis_connection("default").delete(HotKeys.key("test"))
+
+    def test_top_is_most_read_first(self):
+        for member, reads in (("a", 1), ("b", 3), ("c", 2)):
+            for _ in range(reads):
+                HotKeys.record("test", member)
+
+        self.assertEqual(HotKeys.top("test", 2), ["b", "c"])
+
+    def test_decay_drops_rare_members(self):
+        for member, reads in (("a", 1), ("b", 4)):
+            for _ in range(reads):
+                HotKeys.record("test", member)
+        HotKeys.flush()
+
+        HotKeys.decay("test")
+
+        self.assertEqual(HotKeys.top("test", 10), ["b"])
+        self.assertEqual(get_redis_connection("default").zscore(HotKeys.key("test"), "b"), 2)
+
+    def test_buffer_is_not_shared_with_metrics(self):
+        CacheMetrics.flush()
+        HotKeys.record("test", 1)
+
+        self.assertEqual(HotKeys.counters, {("test", "1"): 1})
+        self.assertEqual(CacheMetrics.counters, {})
+
+
+class BatchCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.computed = []
+
+    def compute(self, ids):
+        self.computed.append(sorted(ids))
+        return {id_: f"value {id_}" for id_ in ids if id_ != "unknown"}
+
+    def test_set_get_and_delete_many(self):
+        CacheBackend.set_many({"test:a": 1, "test:b": [2]}, 60)
+
+        self.assertEqual(CacheBackend.get_many(["test:a", "test:b", "test:c"]), {"test:a": 1, "test:b": [2]})
+
+        CacheBackend.delete_many(["test:a", "test:b"])
+        self.assertEqual(CacheBackend.get_many(["test:a", "test:b"]), {})
+
+    def test_get_many_is_one_round_trip(self):
+        CacheBackend.set_many({f"test:{i}": i for i in range(20)}, 60)
+
+        with patch.object(cache, "get", wraps=cache.get) as get, \
+                patch.object(cache, "get_many", wraps=cache.get_many) as get_many:
+            values = CacheBackend.get_many([f"test:{i}" for i in range(20)])
+
+        self.assertEqual(len(values), 20)
+        self.assertEqual(get.call_count, 0)
+        self.assertEqual(get_many.call_count, 1)
+
+    def test_only_misses_are_computed(self):
+        keys = {id_: f"test:{id_}" for id_ in ("a", "b", "c")}
+        CacheBackend.get_or_compute_many({"a": "test:a"}, self.compute, 60)
+
+        values = CacheBackend.get_or_compute_many(keys, self.compute, 60)
+
+        self.assertEqual(values, {"a": "value a", "b": "value b", "c": "value c"})
+        self.assertEqual(self.computed, [["a"], ["b", "c"]])
+
+    def test_unknown_ids_are_cached(self):
+        keys = {id_: f"test:{id_}" for id_ in ("a", "unknown")}
+
+        for _ in range(2):
+            values = CacheBackend.get_or_compute_many(keys, self.compute, 60, not_found_ttl=5)
+
+        self.assertEqual(values, {"a": "value a"})
+        self.assertEqual(self.computed, [["a", "unknown"]])
+        self.assertLessEqual(cache.ttl("test:unknown"), 5)
+
+    def test_entries_are_shared_with_get_or_compute(self):
+        CacheBackend.get_or_compute("test:a", lambda: "single", 60)
+        CacheBackend.get_or_compute_many({"b": "test:b"}, self.compute, 60)
+
+        values = CacheBackend.get_or_compute_many({"a": "test:a"}, self.compute, 60)
+
+        self.assertEqual(values, {"a": "single"})
+        self.assertEqual(CacheBackend.get_or_compute("test:b", lambda: "single", 60), "value b")
+
+    def test_expired_entries_are_computed(self):
+        CacheBackend.set("test:a", ("old", 0.1, time.time() - 1), 60)
+
+        values = CacheBackend.get_or_compute_many({"a": "test:a"}, self.compute, 60)
+
+        self.assertEqual(values, {"a": "value a"})